@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Run emission calculations in batch from the command line: python -m eocalc --help"""
+
+import sys
+
+from eocalc.batch import main
+
+sys.exit(main())
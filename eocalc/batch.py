@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""Plan and run emission calculations for many regions, periods, pollutants and methods."""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, field
+from calendar import monthrange
+from datetime import date, MAXYEAR
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+
+from eocalc.context import Pollutant
+from eocalc.regions import RegionRegistry, REGION_FILE_SUFFIXES
+from eocalc.methods import registry
+from eocalc.methods.base import DateRange, EOEmissionCalculator, EmissionTotals, RunHandle
+
+if TYPE_CHECKING:
+    from shapely.geometry import MultiPolygon
+
+# Name of the file in the output directory recording each job finished
+JOURNAL_FILE = "jobs.jsonl"
+# Output formats supported, "csv" only writes the totals table
+OUTPUT_FORMATS = ("parquet", "arrow", "csv")
+
+# Calculators are kept for the life time of the (worker) process, so their caches stay warm between jobs
+_calculators: dict[type, EOEmissionCalculator] = {}
+_calculators_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Job:
+    """Represent a single emission calculation to run."""
+
+    method: type
+    region_name: str
+    region: MultiPolygon = field(compare=False, repr=False)
+    period: DateRange
+    pollutant: Pollutant
+
+    @property
+    def name(self) -> str:
+        """Unique name of the job, also used for its output file."""
+        return f"{self.method.__name__}_{self.region_name}_{self.period.start}_{self.period.end}_{self.pollutant.name}"
+
+
+def find_methods() -> dict[str, type]:
+    """
+    Find all emission calculation methods available.
+
+    Returns
+    -------
+    dict
+        Non-abstract EOEmissionCalculator subclasses returning emission tables by class name, see
+        eocalc.methods.registry and EOEmissionCalculator.returns_tables().
+    """
+    methods = {name: spec.load() for name, spec in registry.discover().items()}
+    return {name: method for name, method in methods.items() if method.returns_tables()}
+
+
+def load_regions(paths: list[str]) -> dict[str, MultiPolygon]:
+    """
+    Load regions from GeoJSON files and/or directories of such files.
+
+    Parameters
+    ----------
+    paths: list
+        Files and directories to read.
+
+    Returns
+    -------
+    dict
+        Regions by name, i.e. file name without suffix.
+    """
+    regions = {}
+    for path in paths:
+        path = str(path).rstrip("/")
+        if os.path.isdir(path):
+            folder = RegionRegistry(path)
+            regions.update({name: folder.get(name) for name in folder.names()})
+        else:
+            suffix = next((suffix for suffix in REGION_FILE_SUFFIXES if path.endswith(suffix)), None)
+            if suffix is None:
+                raise ValueError(f"Region file {path} needs to end on one of {REGION_FILE_SUFFIXES}!")
+            name = os.path.basename(path)[:-len(suffix)]
+            regions[name] = RegionRegistry(os.path.dirname(path) or ".").get(name)
+
+    return regions
+
+
+def parse_period(text: str) -> DateRange:
+    """Create period from text like "2018-08-01:2018-08-31"."""
+    start, _, end = text.partition(":")
+    return DateRange(start, end or start)
+
+
+def monthly_periods(start: date, end: date) -> list[DateRange]:
+    """
+    Split time span into calendar months, only full months are included.
+
+    Parameters
+    ----------
+    start: date
+        First day to consider.
+    end: date
+        Last day to consider.
+
+    Returns
+    -------
+    list
+        One period per month, in chronological order.
+    """
+    periods = []
+    month = start.year * 12 + start.month - 1 + (start.day > 1)  # First full month, counted from year 0
+    while month // 12 <= MAXYEAR:
+        year, number = month // 12, month % 12 + 1
+        last = date(year, number, monthrange(year, number)[1])
+        if last > end:
+            break
+        periods.append(DateRange(date(year, number, 1), last))
+        month += 1
+
+    return periods
+
+
+def plan(methods: list[type], regions: dict[str, MultiPolygon], periods: dict[type, list[DateRange]],
+         pollutants: list[Pollutant]) -> list[Job]:
+    """
+    Create jobs for all combinations the methods are applicable to.
+
+    Parameters
+    ----------
+    methods: list
+        Calculation methods to use.
+    regions: dict
+        Regions by name.
+    periods: dict
+        Periods to calculate emissions for, per method.
+    pollutants: list
+        Pollutants to calculate emissions for.
+
+    Returns
+    -------
+    list
+        Jobs passing the methods' input validation.
+    """
+    for method in methods:
+        if not method.returns_tables():
+            raise ValueError(f"Method {method.__name__} does not return emission tables, cannot use it in batches!")
+
+    jobs, covering = [], registry.CapabilityIndex(methods).covering(regions)
+    for method in methods:
+        calculator = method()
+        # Checking a region is expensive, so check it once and then only the periods and pollutants
+        valid_periods = [period for period in periods[method] if _passes(calculator._validate_period, period)]
+        valid_pollutants = [pollutant for pollutant in pollutants
+                            if _passes(calculator._validate_pollutant, pollutant)]
+        for region_name, region in regions.items():
+            if method not in covering[region_name] or not _passes(calculator._validate_region, region):
+                continue
+            jobs += [Job(method, region_name, region, period, pollutant)
+                     for period in valid_periods for pollutant in valid_pollutants]
+
+    return jobs
+
+
+def _passes(check, value) -> bool:
+    """Tell whether value passes a validation raising ValueError."""
+    try:
+        check(value)
+        return True
+    except ValueError:
+        return False
+
+
+def prefetch(jobs: list[Job]):
+    """Make sure data for all jobs is available locally, loading data shared between jobs only once."""
+    for method, period in sorted({(job.method, job.period) for job in jobs},
+                                 key=lambda item: (item[0].__name__, item[1].start)):
+        method.prefetch(period)
+
+
+def run(jobs: list[Job], output: str, output_format: str = "parquet", workers: int = 1) -> list[dict]:
+    """
+    Run jobs and write their results to the output directory. Jobs already recorded as done in
+    the output directory's journal are skipped, so an interrupted batch can simply be run again.
+
+    Parameters
+    ----------
+    jobs: list
+        Jobs to run.
+    output: str
+        Directory to write results and journal to.
+    output_format: str
+        One of OUTPUT_FORMATS, defaults to "parquet".
+    workers: int
+        Number of worker processes, defaults to 1, i.e. run all jobs in this process.
+
+    Returns
+    -------
+    list
+        Journal records of the jobs run by this call.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Output format needs to be one of {OUTPUT_FORMATS}, got {output_format}!")
+
+    os.makedirs(output, exist_ok=True)
+    done = {record["job"] for record in read_journal(output) if record["status"] == "done"}
+    todo = [job for job in jobs if job.name not in done]
+    prefetch(todo)
+
+    records = []
+    with open(f"{output}/{JOURNAL_FILE}", 'a+') as journal:
+        # Make sure to start on a new line, even if an incomplete line was left behind by a crash
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != "\n":
+                journal.write("\n")
+
+        def record(entry: dict):
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            records.append(entry)
+
+        if workers <= 1:
+            for job in todo:
+                record(execute(job, output, output_format))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for future in as_completed([executor.submit(execute, job, output, output_format) for job in todo]):
+                    record(future.result())
+
+    return records
+
+
+def calculator(method: type) -> EOEmissionCalculator:
+    """Get this process' instance of the method, create it on first use. Instances serve concurrent runs."""
+    with _calculators_lock:
+        if method not in _calculators:
+            _calculators[method] = method()
+        return _calculators[method]
+
+
+def execute(job: Job, output: str, output_format: str) -> dict:
+    """Run a single job and write its results, return journal record. Never raises."""
+    start = time.perf_counter()
+    file = f"{output}/{job.name}.{output_format}"
+    handle = RunHandle()
+    try:
+        results = calculator(job.method).run(job.region, job.period, job.pollutant, handle=handle)
+        if not isinstance(results, dict):
+            raise TypeError(f"Method {job.method.__name__} did not return emission tables!")
+
+        # Write to temporary file first, so no partial results are left behind on crashes
+        temporary = f"{output}/{job.name}.tmp.{output_format}"
+        if output_format == "csv":
+            results[EOEmissionCalculator.TOTAL_EMISSIONS_KEY].to_csv(temporary)
+        else:
+            from eocalc.results import save
+            save(results, temporary)
+        os.replace(temporary, file)
+
+        totals = EmissionTotals.from_table(results[EOEmissionCalculator.TOTAL_EMISSIONS_KEY])
+        return {"job": job.name, "status": "done", "file": file, "value": totals.value, "umin": totals.umin,
+                "umax": totals.umax, "seconds": time.perf_counter() - start, "timings": handle.timings}
+    except Exception as error:
+        return {"job": job.name, "status": "failed", "error": f"{type(error).__name__}: {error}",
+                "seconds": time.perf_counter() - start}
+
+
+def read_journal(output: str) -> list[dict]:
+    """
+    Read records of jobs run so far.
+
+    Parameters
+    ----------
+    output: str
+        Output directory used for the batch.
+
+    Returns
+    -------
+    list
+        Journal records in order of completion, empty if there is no journal yet.
+    """
+    if not os.path.isfile(f"{output}/{JOURNAL_FILE}"):
+        return []
+
+    records = []
+    with open(f"{output}/{JOURNAL_FILE}", 'r') as journal:
+        for line in journal:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass  # A crash might leave an incomplete line behind, ignore it
+
+    return records
+
+
+def main(argv: list[str] = None) -> int:
+    """Command line entry point, see "python -m eocalc --help"."""
+    import argparse
+
+    methods = sorted(registry.discover())  # Only import the methods actually selected
+    parser = argparse.ArgumentParser(prog="python -m eocalc", description=__doc__)
+    parser.add_argument("regions", nargs="+", help="GeoJSON region files or directories containing them")
+    parser.add_argument("-m", "--methods", nargs="+", required=True, choices=methods, metavar="METHOD",
+                        help=f"calculation methods to use, any of: {', '.join(methods)}")
+    parser.add_argument("-p", "--periods", nargs="+", default=[], metavar="START:END", type=parse_period,
+                        help="periods to calculate emissions for, like 2018-08-01:2018-08-31")
+    parser.add_argument("--monthly", nargs="?", const="", default=None, metavar="START:END",
+                        help="add one period per month within given span, or within each method's "
+                             "availability window if no span is given (and the window is bounded)")
+    parser.add_argument("-l", "--pollutants", nargs="+", default=[Pollutant.NO2.name],
+                        choices=[p.name for p in Pollutant], help="pollutants to calculate emissions for")
+    parser.add_argument("-o", "--output", required=True, help="directory to write results to")
+    parser.add_argument("-f", "--format", default="parquet", choices=OUTPUT_FORMATS, help="output format")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    arguments = parser.parse_args(argv)
+
+    selected = [registry.load(name) for name in arguments.methods]
+    periods = {method: list(arguments.periods) for method in selected}
+    if arguments.monthly is not None:
+        for method in selected:
+            window = parse_period(arguments.monthly) if arguments.monthly else \
+                DateRange(method.earliest_start_date(), method.latest_end_date())
+            if not arguments.monthly and (window.start == date.min or window.end == date.max):
+                parser.error(f"Method {method.__name__} is available at any time, give a span for --monthly!")
+            periods[method] += monthly_periods(window.start, window.end)
+    if not any(periods.values()):
+        parser.error("No periods given, use --periods and/or --monthly!")
+
+    try:
+        jobs = plan(selected, load_regions(arguments.regions), periods,
+                    [Pollutant[name] for name in arguments.pollutants])
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"Planned {len(jobs)} job(s), writing results to {arguments.output}")
+    records = run(jobs, arguments.output, arguments.format, arguments.workers)
+
+    failed = [record for record in records if record["status"] != "done"]
+    for record in failed:
+        print(f"Job {record['job']} failed: {record['error']}")
+    print(f"Ran {len(records)} job(s), {len(failed)} failed, {len(jobs) - len(records)} already done before")
+    return 1 if failed else 0
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Measure how the naive TEMIS method scales with region size and period length: python -m eocalc.benchmark"""
+
+from __future__ import annotations
+
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, TYPE_CHECKING
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange
+from eocalc.synthetic import SYNTHETIC_DATA_FOLDER, SYNTHETIC_SEED, generate, temis_file
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+    from shapely.geometry import MultiPolygon
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+# Regions swept by default, from small to large
+BENCHMARK_REGIONS = ["data/regions/roughly_saxonia.geo.json", "data/regions/germany.geo.json",
+                     "data/regions/europe.geo.json"]
+# Period lengths swept by default: a day, a month, a year and five years [days]
+BENCHMARK_PERIOD_LENGTHS = [1, 31, 365, 1826]
+# First day of all periods benchmarked
+BENCHMARK_START = date(2019, 1, 1)
+
+
+def measure(function: Callable, repeat: int = 1, memory: bool = True) -> tuple[float, float]:
+    """
+    Time function and trace its peak memory use.
+
+    Timing runs are not traced, since tracing slows down Python allocations. The peak is taken
+    from an extra, traced run. It covers all memory allocated via Python, including numpy and
+    pandas data, but not memory mapped files or allocations of other threads' native libraries.
+
+    Parameters
+    ----------
+    function: Callable
+        Function to call without arguments.
+    repeat: int
+        Number of timed runs, the fastest counts. Defaults to 1.
+    memory: bool
+        Whether to measure the peak memory, defaults to True.
+
+    Returns
+    -------
+    tuple
+        Seconds of the fastest run and peak memory allocated during the traced run [MB], NaN if not measured.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    if not memory:
+        return seconds, float("nan")
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        function()
+        return seconds, (tracemalloc.get_traced_memory()[1] - baseline) / 10**6
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def benchmark(regions: dict[str, MultiPolygon], lengths: list[int], start: date = BENCHMARK_START,
+              folder: str = SYNTHETIC_DATA_FOLDER, calculator: Callable = None, repeat: int = 1, memory: bool = True,
+              seed: int = SYNTHETIC_SEED, report: Callable = None) -> DataFrame:
+    """
+    Run the naive TEMIS method for all combinations of regions and period lengths on synthetic data.
+
+    Synthetic monthly files missing in the folder are generated first (see eocalc.synthetic),
+    file generation is not part of the measurements.
+
+    Parameters
+    ----------
+    regions: dict
+        Regions by name.
+    lengths: list
+        Period lengths [days], all periods start on the same day.
+    start: date
+        First day of all periods, defaults to BENCHMARK_START.
+    folder: str
+        Directory with synthetic monthly files, defaults to SYNTHETIC_DATA_FOLDER.
+    calculator: Callable
+        Creates the calculator to benchmark, e.g. with a TemisDataCache or compact storage mode set,
+        called once per region and period. Defaults to TropomiMonthlyMeanAggregator().
+    repeat: int
+        Number of timed runs, see measure().
+    memory: bool
+        Whether to measure peak memory, see measure().
+    seed: int
+        Seed for files generated, see eocalc.synthetic.synthetic_columns().
+    report: Callable
+        Called with each result row (as a dict) once measured, e.g. print. Defaults to None.
+
+    Returns
+    -------
+    DataFrame
+        One row per region and period length with the region's number of cells, seconds and peak memory [MB].
+    """
+    from pandas import DataFrame
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+    calculator = calculator or TropomiMonthlyMeanAggregator
+    generate(start, start + timedelta(days=max(lengths) - 1), folder, seed=seed)
+
+    rows = []
+    for name, region in regions.items():
+        for length in lengths:
+            period = DateRange(start, start + timedelta(days=length - 1))
+            instance = _on_synthetic_data(calculator(), folder)
+            cells = []
+
+            def run():
+                cells.append(len(instance.run(region, period, Pollutant.NO2)[instance.GRIDDED_EMISSIONS_KEY]))
+
+            seconds, peak = measure(run, repeat, memory)
+            rows.append({"region": name, "cells": cells[0], "days": length, "seconds": seconds,
+                         "peak memory [MB]": peak})
+            if report is not None:
+                report(rows[-1])
+
+    return DataFrame(rows, columns=["region", "cells", "days", "seconds", "peak memory [MB]"])
+
+
+def curves(results: DataFrame) -> dict[str, DataFrame]:
+    """
+    Turn benchmark results into scaling curves.
+
+    Parameters
+    ----------
+    results: DataFrame
+        As returned by benchmark().
+
+    Returns
+    -------
+    dict
+        Seconds and peak memory as tables with one row per period length and one column per region,
+        plus the scaling exponents per region (slope of seconds and memory over days in log-log space).
+    """
+    import numpy
+    from pandas import DataFrame
+
+    def slope(group, column):
+        valid = group[group[column] > 0]
+        if valid["days"].nunique() < 2:
+            return numpy.nan
+        return numpy.polyfit(numpy.log(valid["days"]), numpy.log(valid[column]), 1)[0]
+
+    regions = list(dict.fromkeys(results["region"]))
+    return {
+        "seconds": results.pivot(index="days", columns="region", values="seconds")[regions],
+        "peak memory [MB]": results.pivot(index="days", columns="region", values="peak memory [MB]")[regions],
+        "exponents": DataFrame({column: [slope(results[results["region"] == region], column) for region in regions]
+                                for column in ["seconds", "peak memory [MB]"]}, index=regions)
+    }
+
+
+def _on_synthetic_data(calculator: TropomiMonthlyMeanAggregator, folder: str) -> TropomiMonthlyMeanAggregator:
+    """Point the calculator to the synthetic files in folder instead of the downloaded ones."""
+    calculator._assure_data_availability = lambda day: temis_file(folder, day)
+    return calculator
+
+
+def main(argv: list[str] = None) -> int:
+    """Command line entry point, see "python -m eocalc.benchmark --help"."""
+    import argparse
+    from eocalc.batch import load_regions
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TemisDataCache, TEMIS_STORAGE_MODES
+
+    parser = argparse.ArgumentParser(prog="python -m eocalc.benchmark", description=__doc__)
+    parser.add_argument("-r", "--regions", nargs="+", default=BENCHMARK_REGIONS,
+                        help="GeoJSON region files or directories containing them, ideally small to large")
+    parser.add_argument("-d", "--days", nargs="+", type=int, default=BENCHMARK_PERIOD_LENGTHS,
+                        help="period lengths to sweep [days]")
+    parser.add_argument("--start", type=date.fromisoformat, default=BENCHMARK_START, help="first day of all periods")
+    parser.add_argument("--data", default=SYNTHETIC_DATA_FOLDER, help="directory with (or for) synthetic files")
+    parser.add_argument("--storage", default="float64", choices=TEMIS_STORAGE_MODES, help="storage mode to use")
+    parser.add_argument("--cache", action="store_true", help="share a TemisDataCache between runs")
+    parser.add_argument("--repeat", type=int, default=1, help="number of timed runs per point, fastest counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra run measuring peak memory")
+    parser.add_argument("-o", "--output", help="CSV file to write all results to")
+    arguments = parser.parse_args(argv)
+
+    cache = TemisDataCache() if arguments.cache else None
+    results = benchmark(load_regions(arguments.regions), sorted(arguments.days), arguments.start, arguments.data,
+                        lambda: TropomiMonthlyMeanAggregator(cache=cache, storage=arguments.storage),
+                        arguments.repeat, not arguments.no_memory,
+                        report=lambda row: print(f"{row['region']}, {row['days']} day(s), {row['cells']} cells: "
+                                                 f"{row['seconds']:.2f}s, {row['peak memory [MB]']:.1f} MB"))
+
+    for name, table in curves(results).items():
+        print(f"\n{name}\n{table.to_string(float_format=lambda value: f'{value:.2f}')}")
+    if arguments.output:
+        results.to_csv(arguments.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
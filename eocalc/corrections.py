@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Correct gridded daily values for atmospheric effects that depend on day and latitude only."""
+
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy
+
+if TYPE_CHECKING:
+    from eocalc.methods.base import DateRange
+    from eocalc.weighting import GridSpec
+
+# Maximum solar declination, i.e. the earth's axial tilt [degrees]
+AXIAL_TILT = 23.44
+# Day of year of the December solstice, counted from January 1st as day 0 [1]
+SOLSTICE_OFFSET = 10
+# Mean length of a year [days]
+YEAR_LENGTH = 365.25
+# Default number of months of factor tables kept in memory per correction [1]
+CORRECTION_CACHE_SIZE = 36
+# NO2 lifetime with the sun in zenith, i.e. at maximum photochemical activity [h]
+NO2_MINIMUM_LIFETIME = 4
+# NO2 lifetime in polar night and low sun conditions [h]
+NO2_MAXIMUM_LIFETIME = 24
+# NO2 lifetime the uncorrected values are assumed to reflect [h]
+NO2_REFERENCE_LIFETIME = 6
+# NO2 emissions at night relative to daytime emissions (mostly traffic and heating) [1]
+NO2_NIGHT_EMISSION_SHARE = .5
+
+
+class Correction(ABC):
+    """
+    Scale daily values per latitude, e.g. to account for a pollutant's atmospheric lifetime or
+    for the diurnal cycle a satellite with a single overpass per day does not see.
+
+    Factors are evaluated for whole (day x latitude band) arrays, then broadcast over the cells.
+    Tables for full months of a grid's latitude bands are cached, so runs re-using months only
+    evaluate them once. Safe to share between threads and calculators.
+    """
+
+    def __init__(self, max_months: int = CORRECTION_CACHE_SIZE):
+        self.max_months = max_months
+        self._tables: OrderedDict[tuple, numpy.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def factors(self, days: numpy.ndarray, lats: numpy.ndarray) -> numpy.ndarray:
+        """
+        Evaluate correction factors.
+
+        Parameters
+        ----------
+        days: numpy.ndarray
+            Days to evaluate, as datetime64[D].
+        lats: numpy.ndarray
+            Latitudes to evaluate [degrees].
+
+        Returns
+        -------
+        numpy.ndarray
+            Factors of shape (number of days, number of latitudes) [1].
+        """
+        pass
+
+    def table(self, month: numpy.datetime64, grid: GridSpec) -> numpy.ndarray:
+        """
+        Get factors for all days of a month and the centers of all latitude rows of a grid, cached.
+
+        Parameters
+        ----------
+        month: numpy.datetime64
+            Month to get factors for.
+        grid: GridSpec
+            Grid defining the latitude bands.
+
+        Returns
+        -------
+        numpy.ndarray
+            Read-only factors of shape (number of days in month, grid.rows) [1].
+        """
+        month = numpy.datetime64(month, "M")
+        key = (month, grid.cell_size)
+        with self._lock:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+                return self._tables[key]
+
+        days = numpy.arange(month.astype("datetime64[D]"), (month + 1).astype("datetime64[D]"))
+        table = self.factors(days, -90 + (numpy.arange(grid.rows) + .5) * grid.cell_size)
+        table.flags.writeable = False
+
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.max_months:
+                self._tables.popitem(last=False)
+        return table
+
+    def for_period(self, period: DateRange, grid: GridSpec) -> numpy.ndarray:
+        """
+        Get factors for all days of a period, see table().
+
+        Returns
+        -------
+        numpy.ndarray
+            Factors of shape (len(period), grid.rows) [1].
+        """
+        months = period.split_months()
+        return numpy.concatenate([self.table(numpy.datetime64(month.start, "M"), grid)
+                                  [month.start.day - 1:month.end.day] for month in months])
+
+    def month_sums(self, period: DateRange, months: numpy.ndarray, grid: GridSpec) -> tuple[numpy.ndarray, ...]:
+        """
+        Sum up factors and squared factors of a period's days per month.
+
+        Parameters
+        ----------
+        period: DateRange
+            Days to include.
+        months: numpy.ndarray
+            Sorted months to sum up for, as datetime64[M], need to include all months of the period.
+        grid: GridSpec
+            Grid defining the latitude bands.
+
+        Returns
+        -------
+        tuple
+            Factor sums and squared factor sums, each of shape (number of months, grid.rows).
+        """
+        factors = self.for_period(period, grid)
+        positions = numpy.searchsorted(months, period.months()[0])[period.month_index()]
+
+        sums, squares = numpy.zeros((len(months), grid.rows)), numpy.zeros((len(months), grid.rows))
+        numpy.add.at(sums, positions, factors)
+        numpy.add.at(squares, positions, factors ** 2)
+        return sums, squares
+
+
+class CombinedCorrection(Correction):
+    """Apply several corrections at once, factors are multiplied."""
+
+    def __init__(self, corrections: list[Correction], **kwargs):
+        super().__init__(**kwargs)
+
+        self.corrections = list(corrections)
+
+    def factors(self, days: numpy.ndarray, lats: numpy.ndarray) -> numpy.ndarray:
+        result = numpy.ones((len(days), len(lats)))
+        for correction in self.corrections:
+            result *= correction.factors(days, lats)
+        return result
+
+
+class LifetimeCorrection(Correction):
+    """
+    Correct for the pollutant's atmospheric lifetime: the shorter the lifetime, the higher the
+    emissions needed to sustain the column seen. Lifetime is modelled to grow with the noon solar
+    zenith angle, from minimum (sun in zenith) to maximum (sun at the horizon or below). Factors
+    are the reference lifetime divided by the lifetime. Defaults are rough values for NO2.
+    """
+
+    def __init__(self, minimum: float = NO2_MINIMUM_LIFETIME, maximum: float = NO2_MAXIMUM_LIFETIME,
+                 reference: float = NO2_REFERENCE_LIFETIME, **kwargs):
+        super().__init__(**kwargs)
+
+        self.minimum, self.maximum, self.reference = minimum, maximum, reference
+
+    def factors(self, days: numpy.ndarray, lats: numpy.ndarray) -> numpy.ndarray:
+        zenith = numpy.asarray(lats, dtype=float)[numpy.newaxis, :] - _declination(days)[:, numpy.newaxis]
+        lifetimes = self.minimum / numpy.maximum(numpy.cos(numpy.radians(zenith)), self.minimum / self.maximum)
+        return self.reference / lifetimes
+
+
+class DiurnalCorrection(Correction):
+    """
+    Correct daytime observations to daily means: emissions are assumed to be constant during
+    daylight and a constant share of that during the night, so the daily mean depends on the day
+    length. Defaults are rough values for NO2.
+    """
+
+    def __init__(self, night_share: float = NO2_NIGHT_EMISSION_SHARE, **kwargs):
+        super().__init__(**kwargs)
+
+        self.night_share = night_share
+
+    def factors(self, days: numpy.ndarray, lats: numpy.ndarray) -> numpy.ndarray:
+        daylight = day_length(days, lats) / 24
+        return daylight + self.night_share * (1 - daylight)
+
+
+def day_length(days: numpy.ndarray, lats: numpy.ndarray) -> numpy.ndarray:
+    """
+    Calculate the time the sun is above the horizon (geometrically, no refraction).
+
+    Parameters
+    ----------
+    days: numpy.ndarray
+        Days to evaluate, as datetime64[D].
+    lats: numpy.ndarray
+        Latitudes to evaluate [degrees].
+
+    Returns
+    -------
+    numpy.ndarray
+        Day lengths of shape (number of days, number of latitudes) [h].
+    """
+    tangents = numpy.tan(numpy.radians(numpy.clip(numpy.asarray(lats, dtype=float), -89.99, 89.99)))
+    hour_angles = numpy.arccos(numpy.clip(-tangents[numpy.newaxis, :] *
+                                          numpy.tan(numpy.radians(_declination(days)))[:, numpy.newaxis], -1, 1))
+    return numpy.degrees(hour_angles) * 2 / 15
+
+
+def _declination(days: numpy.ndarray) -> numpy.ndarray:
+    """Approximate solar declination per day [degrees]."""
+    days = numpy.asarray(days, dtype="datetime64[D]")
+    day_of_year = (days - days.astype("datetime64[Y]").astype("datetime64[D]")).astype(int)
+    return -AXIAL_TILT * numpy.cos(2 * numpy.pi * (day_of_year + SOLSTICE_OFFSET) / YEAR_LENGTH)
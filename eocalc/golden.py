@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""Guard the naive TEMIS method's results and performance with golden references: python -m eocalc.golden"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, TYPE_CHECKING
+
+import numpy
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, RunHandle
+from eocalc.benchmark import measure
+from eocalc.synthetic import SYNTHETIC_DATA_FOLDER, generate, temis_file
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+# Local directory holding the reference results and performance figures. The bundled results stem from the
+# original naive implementation (commit bbf556c), run on the same cases; timings stem from the current one.
+GOLDEN_FOLDER = "data/golden"
+# File in GOLDEN_FOLDER holding the reference stage timings and memory peaks
+GOLDEN_PERFORMANCE_FILE = "performance.json"
+# Bundled regions, all covered by the method are checked
+GOLDEN_REGIONS_FOLDER = "data/regions"
+# Bundled, clipped TEMIS file, regions within its latitudes are checked on it for the whole month
+GOLDEN_CLIPPED_FILE = "data/methods/temis/tropomi/no2/monthly_mean/no2_201808_clipped.asc"
+# Synthetic months (see eocalc.synthetic) all regions are checked on, winter and summer
+GOLDEN_SYNTHETIC_MONTHS = [date(2019, 1, 1), date(2019, 7, 1)]
+# Relative tolerance for totals and cell values compared to the references [1]
+GOLDEN_TOLERANCE = 1e-6
+# Absolute tolerances for values close to zero (e.g. cells barely touching the region) per GNFR table column [kt, %, %]
+GOLDEN_TOTALS_ABSOLUTE_TOLERANCE = (1e-9, 1e-6, 1e-6)
+# Absolute tolerances per grid column kept by reference(): area, emissions, Umin and Umax [km², kg, %, %]
+GOLDEN_GRID_ABSOLUTE_TOLERANCE = (1e-6, 1e-6, 1e-6, 1e-6)
+# Runs may take this many times the reference seconds per stage, scaled by the machine's calibration [1]
+GOLDEN_TIME_BUDGET = 2.5
+# Runs may allocate this many times the reference peak memory per stage [1]
+GOLDEN_MEMORY_BUDGET = 1.25
+# Budgets never go below these, shorter stages and smaller allocations are too noisy to compare [s, MB]
+GOLDEN_MINIMUM_SECONDS = .1
+GOLDEN_MINIMUM_MEMORY = 5.
+
+
+@dataclass(frozen=True)
+class GoldenCase:
+    """Represent a single golden reference: one bundled region on one data set."""
+
+    region: str  # Name of the region file, without ".geo.json"
+    dataset: str  # "clipped" or "synthetic-YYYY-MM"
+    period: DateRange
+
+    @property
+    def name(self) -> str:
+        return f"{self.dataset}_{self.region}"
+
+
+class _TracedHandle(RunHandle):
+    """Run handle also recording the peak memory traced per stage [MB], needs tracemalloc to be tracing."""
+
+    def __init__(self):
+        super().__init__()
+        self.peaks: dict[str, float] = {}
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def lap(self, stage: str):
+        peak = (tracemalloc.get_traced_memory()[1] - self._baseline) / 10**6
+        self.peaks[stage] = max(self.peaks.get(stage, 0), peak)
+        self.peaks["total"] = max(self.peaks.get("total", 0), peak)
+        tracemalloc.reset_peak()
+        super().lap(stage)
+
+
+def cases(regions_folder: str = GOLDEN_REGIONS_FOLDER) -> list[GoldenCase]:
+    """
+    List all golden cases: each bundled region covered by the method on each synthetic month,
+    and on the clipped file if the region lies within the file's latitudes.
+
+    Parameters
+    ----------
+    regions_folder: str
+        Directory with GeoJSON region files, defaults to GOLDEN_REGIONS_FOLDER.
+
+    Returns
+    -------
+    list
+        Cases sorted by data set and region.
+    """
+    from eocalc.batch import load_regions
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+    regions = load_regions([regions_folder])
+    with open(GOLDEN_CLIPPED_FILE, 'r') as data:
+        lats = [float(line.split("=")[1]) for line in data if line.startswith("lat=")]
+    result = []
+    for name, region in sorted(regions.items()):
+        if not TropomiMonthlyMeanAggregator.covers(region):
+            continue
+        if min(lats) <= region.bounds[1] and region.bounds[3] <= max(lats):
+            result.append(GoldenCase(name, "clipped", DateRange("2018-08-01", "2018-08-31")))
+        for month in GOLDEN_SYNTHETIC_MONTHS:
+            end = (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            result.append(GoldenCase(name, f"synthetic-{month:%Y-%m}", DateRange(month, end)))
+    return sorted(result, key=lambda case: (case.dataset, case.region))
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Time a fixed workload mixing what the method spends its time on: parsing numbers, clipping
+    cells and array arithmetic. Run times relative to it are roughly comparable between machines.
+
+    Parameters
+    ----------
+    repeat: int
+        Number of timed runs, the fastest counts. Defaults to 5.
+
+    Returns
+    -------
+    float
+        Seconds the workload took.
+    """
+    import shapely
+
+    def workload():
+        text = b"".join(f"{value:4d}".encode() for value in range(-999, 9999)) * 20
+        values = numpy.frombuffer(text, dtype="S4").astype(float)
+        longs, lats = (array.ravel() for array in numpy.meshgrid(numpy.arange(0, 10, .125), numpy.arange(0, 5, .125)))
+        cells = shapely.box(longs, lats, longs + .125, lats + .125)
+        areas = shapely.area(shapely.intersection(cells, shapely.Point(5, 2.5).buffer(2, quad_segs=64)))
+        return numpy.sort(values).sum() + numpy.outer(areas, areas).sum()
+
+    return measure(workload, repeat, memory=False)[0]
+
+
+def run(case: GoldenCase, data_folder: str = SYNTHETIC_DATA_FOLDER, repeat: int = 2,
+        memory: bool = True) -> tuple[dict[str, DataFrame], dict[str, float], dict[str, float]]:
+    """
+    Run the method for a case, timing its stages and tracing their peak memory.
+
+    Like eocalc.benchmark.measure(), timing runs are not traced and the peaks are taken from
+    an extra, traced run after them. The fastest timed run counts per stage, so with two or more
+    runs, first-run costs like imports and reading files not yet cached by the system are left out.
+
+    Parameters
+    ----------
+    case: GoldenCase
+        Case to run.
+    data_folder: str
+        Directory with (or for) synthetic monthly files, defaults to SYNTHETIC_DATA_FOLDER.
+    repeat: int
+        Number of timed runs, the fastest counts per stage. Defaults to 2.
+    memory: bool
+        Whether to trace the peak memory, defaults to True.
+
+    Returns
+    -------
+    tuple
+        Results of the last run, seconds and peak memory [MB] per stage (and "total"), peaks
+        are empty if not traced.
+    """
+    from eocalc.batch import load_regions
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+    region = load_regions([os.path.join(GOLDEN_REGIONS_FOLDER, f"{case.region}.geo.json")])[case.region]
+    if case.dataset != "clipped":
+        generate(case.period.start, case.period.end, data_folder)
+
+    def calculator() -> TropomiMonthlyMeanAggregator:
+        calc = TropomiMonthlyMeanAggregator()
+        calc._assure_data_availability = (lambda day: GOLDEN_CLIPPED_FILE) if case.dataset == "clipped" \
+            else (lambda day: temis_file(data_folder, day))
+        return calc
+
+    seconds: dict[str, float] = {}
+    for _ in range(repeat):
+        handle = RunHandle()
+        results = calculator().run(region, case.period, Pollutant.NO2, handle=handle)
+        seconds = {stage: min(seconds.get(stage, float("inf")), value) for stage, value in handle.timings.items()}
+
+    peaks: dict[str, float] = {}
+    if memory:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        try:
+            handle = _TracedHandle()
+            calculator().run(region, case.period, Pollutant.NO2, handle=handle)
+            peaks = handle.peaks
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+
+    return results, seconds, peaks
+
+
+def reference(results: dict[str, DataFrame]) -> dict[str, numpy.ndarray]:
+    """
+    Extract what is kept of results as reference: the GNFR table and the grid's global cell
+    indices (see eocalc.weighting.GridSpec) with area [km²], emissions [kg] and uncertainties [%].
+
+    Parameters
+    ----------
+    results: dict
+        As returned by TropomiMonthlyMeanAggregator.run().
+
+    Returns
+    -------
+    dict
+        Arrays "totals", "cells" and "grid", grid rows sorted by cell.
+    """
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+    grid = results[TropomiMonthlyMeanAggregator.GRIDDED_EMISSIONS_KEY]
+    cells = TropomiMonthlyMeanAggregator._grid_cells(grid)
+    order = numpy.argsort(cells, kind="stable")
+    return {"totals": results[TropomiMonthlyMeanAggregator.TOTAL_EMISSIONS_KEY].to_numpy(dtype=float),
+            "cells": cells[order], "grid": grid.iloc[:, :4].to_numpy(dtype=float)[order]}
+
+
+def compare(results: dict[str, DataFrame], expected: dict[str, numpy.ndarray],
+            tolerance: float = GOLDEN_TOLERANCE) -> list[str]:
+    """
+    Compare results with a reference.
+
+    Parameters
+    ----------
+    results: dict
+        As returned by TropomiMonthlyMeanAggregator.run().
+    expected: dict
+        As returned by reference(), e.g. loaded from file.
+    tolerance: float
+        Relative tolerance, defaults to GOLDEN_TOLERANCE.
+
+    Returns
+    -------
+    list
+        Description of each difference found, empty if there are none.
+    """
+    from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+    actual = reference(results)
+    problems = []
+
+    def close(first, second, absolute):
+        return numpy.isclose(first, second, rtol=tolerance, atol=numpy.array(absolute), equal_nan=True)
+
+    if actual["totals"].shape != expected["totals"].shape:
+        problems.append(f"GNFR table has shape {actual['totals'].shape} instead of {expected['totals'].shape}")
+    elif not (same := close(actual["totals"], expected["totals"], GOLDEN_TOTALS_ABSOLUTE_TOLERANCE)).all():
+        rows = numpy.flatnonzero(~same.all(axis=1))
+        problems.append(f"GNFR table differs in rows {rows.tolist()}: {actual['totals'][rows].tolist()} instead of "
+                        f"{expected['totals'][rows].tolist()}")
+
+    if not numpy.array_equal(actual["cells"], expected["cells"]):
+        missing, extra = numpy.setdiff1d(expected["cells"], actual["cells"]), numpy.setdiff1d(actual["cells"],
+                                                                                              expected["cells"])
+        problems.append(f"Grid has {len(actual['cells'])} cells instead of {len(expected['cells'])}, "
+                        f"{len(missing)} missing and {len(extra)} extra")
+    else:
+        different = ~close(actual["grid"], expected["grid"], GOLDEN_GRID_ABSOLUTE_TOLERANCE)
+        for column in numpy.flatnonzero(different.any(axis=0)):
+            name = results[TropomiMonthlyMeanAggregator.GRIDDED_EMISSIONS_KEY].columns[column]
+            problems.append(f"Grid column '{name}' differs in {different[:, column].sum()} of {len(different)} cells")
+
+    return problems
+
+
+def over_budget(seconds: dict[str, float], peaks: dict[str, float], expected: dict, calibration: float,
+                time_budget: float = GOLDEN_TIME_BUDGET, memory_budget: float = GOLDEN_MEMORY_BUDGET) -> list[str]:
+    """
+    Check stage timings and memory peaks against the reference's.
+
+    Parameters
+    ----------
+    seconds: dict
+        Seconds per stage, as returned by run().
+    peaks: dict
+        Peak memory [MB] per stage, as returned by run(), stages not traced are not checked.
+    expected: dict
+        Reference performance with "calibration" [s], "seconds" and "memory [MB]" per stage.
+    calibration: float
+        Seconds calibrate() takes on this machine now, reference seconds are scaled accordingly.
+    time_budget: float
+        Factor on the reference seconds, defaults to GOLDEN_TIME_BUDGET.
+    memory_budget: float
+        Factor on the reference peaks, defaults to GOLDEN_MEMORY_BUDGET.
+
+    Returns
+    -------
+    list
+        Description of each stage over budget, empty if there are none.
+    """
+    problems = []
+    scale = calibration / expected["calibration"]
+    for stage, reference_seconds in expected["seconds"].items():
+        budget = max(reference_seconds * scale * time_budget, GOLDEN_MINIMUM_SECONDS)
+        if seconds.get(stage, 0) > budget:
+            problems.append(f"Stage '{stage}' took {seconds[stage]:.2f}s, budget is {budget:.2f}s")
+    for stage, reference_peak in expected["memory [MB]"].items():
+        budget = max(reference_peak * memory_budget, GOLDEN_MINIMUM_MEMORY)
+        if peaks.get(stage, 0) > budget:
+            problems.append(f"Stage '{stage}' allocated {peaks[stage]:.1f} MB, budget is {budget:.1f} MB")
+    return problems
+
+
+def record(selected: list[GoldenCase] = None, folder: str = GOLDEN_FOLDER, data_folder: str = SYNTHETIC_DATA_FOLDER,
+           repeat: int = 3, report: Callable = None):
+    """
+    Run cases and write their results and performance as new references. Only do this after
+    checking that changed results are intended, and on an otherwise idle machine.
+
+    Parameters
+    ----------
+    selected: list
+        Cases to record, defaults to None, i.e. all cases().
+    folder: str
+        Directory to write references to, defaults to GOLDEN_FOLDER.
+    data_folder: str
+        Directory with (or for) synthetic monthly files, defaults to SYNTHETIC_DATA_FOLDER.
+    repeat: int
+        Number of timed runs per case, see run(). Defaults to 3.
+    report: Callable
+        Called with each case once recorded, e.g. print. Defaults to None.
+    """
+    os.makedirs(folder, exist_ok=True)
+    performance = load_performance(folder)
+    performance["calibration"] = calibrate()
+    for case in cases() if selected is None else selected:
+        results, seconds, peaks = run(case, data_folder, repeat)
+        numpy.savez_compressed(os.path.join(folder, f"{case.name}.npz"), **reference(results))
+        performance["cases"][case.name] = {"seconds": seconds, "memory [MB]": peaks}
+        if report is not None:
+            report(case)
+
+    with open(os.path.join(folder, GOLDEN_PERFORMANCE_FILE), 'w') as file:
+        json.dump(performance, file, indent=1, sort_keys=True)
+
+
+def load_reference(case: GoldenCase, folder: str = GOLDEN_FOLDER) -> dict[str, numpy.ndarray]:
+    """Load a case's reference results as written by record(), see reference()."""
+    with numpy.load(os.path.join(folder, f"{case.name}.npz")) as arrays:
+        return dict(arrays)
+
+
+def load_performance(folder: str = GOLDEN_FOLDER) -> dict:
+    """Load the reference performance of all cases as written by record(), empty if there is none yet."""
+    file = os.path.join(folder, GOLDEN_PERFORMANCE_FILE)
+    if not os.path.isfile(file):
+        return {"calibration": float("nan"), "cases": {}}
+    with open(file, 'r') as performance:
+        return json.load(performance)
+
+
+def check(case: GoldenCase, folder: str = GOLDEN_FOLDER, data_folder: str = SYNTHETIC_DATA_FOLDER,
+          calibration: float = None, budgets: bool = True) -> list[str]:
+    """
+    Run a case and compare its results and performance with the references.
+
+    Parameters
+    ----------
+    case: GoldenCase
+        Case to check.
+    folder: str
+        Directory with the references, defaults to GOLDEN_FOLDER.
+    data_folder: str
+        Directory with (or for) synthetic monthly files, defaults to SYNTHETIC_DATA_FOLDER.
+    calibration: float
+        Seconds calibrate() takes on this machine, defaults to None, i.e. calibrate now.
+    budgets: bool
+        Whether to check time and memory budgets, defaults to True.
+
+    Returns
+    -------
+    list
+        Description of each problem found, empty if there are none.
+    """
+    results, seconds, peaks = run(case, data_folder, memory=budgets)
+    problems = compare(results, load_reference(case, folder))
+    if budgets:
+        calibration = calibrate() if calibration is None else calibration
+        performance = load_performance(folder)
+        expected = {**performance["cases"][case.name], "calibration": performance["calibration"]}
+        problems += over_budget(seconds, peaks, expected, calibration)
+    return problems
+
+
+def main(argv: list[str] = None) -> int:
+    """Command line entry point, see "python -m eocalc.golden --help"."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m eocalc.golden", description=__doc__)
+    parser.add_argument("-k", "--keyword", default="", help="only use cases with this in their name")
+    parser.add_argument("--record", action="store_true", help="write new references instead of checking")
+    parser.add_argument("--no-budgets", action="store_true", help="skip checking time and memory budgets")
+    parser.add_argument("--folder", default=GOLDEN_FOLDER, help="directory with the references")
+    parser.add_argument("--data", default=SYNTHETIC_DATA_FOLDER, help="directory with (or for) synthetic files")
+    arguments = parser.parse_args(argv)
+
+    selected = [case for case in cases() if arguments.keyword in case.name]
+    if arguments.record:
+        record(selected, arguments.folder, arguments.data, report=lambda case: print(f"{case.name}: recorded"))
+        return 0
+
+    calibration = None if arguments.no_budgets else calibrate()
+    failed = 0
+    for case in selected:
+        start = time.perf_counter()
+        problems = check(case, arguments.folder, arguments.data, calibration, not arguments.no_budgets)
+        failed += bool(problems)
+        print(f"{case.name}: {'FAILED' if problems else 'ok'} ({time.perf_counter() - start:.1f}s)")
+        for problem in problems:
+            print(f"  {problem}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Compare calculated emissions with bottom-up inventory reports by region, year and GNFR sector."""
+
+from __future__ import annotations
+
+import calendar
+from typing import TYPE_CHECKING
+
+import numpy
+
+from eocalc.context import Pollutant, GNFR
+from eocalc.methods.base import DateRange, EmissionTotals, EOEmissionCalculator
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+# Key columns of inventory tables, in index order
+INVENTORY_KEYS = ["pollutant", "region", "year", "sector"]
+# Value columns of inventory tables and comparisons' sides
+INVENTORY_VALUES = ["Value [kt]", "Umin [%]", "Umax [%]"]
+# Names used for the "Totals" row of GNFR tables in inventory reports, besides "Totals" itself
+TOTALS_ALIASES = ("TOTAL", "NATIONAL_TOTAL", "NATIONAL TOTAL")
+# Table names returned by tables()
+COMPARISON_TABLES = ("ratio", "difference", "overlap")
+
+
+def load_inventory(files: str | list[str], columns: dict[str, str] = None, uncertainty: float = 0) -> DataFrame:
+    """
+    Load bottom-up inventory tables into one indexed table.
+
+    Files are CSV or Parquet (by file name ending) in long format, with one row per pollutant,
+    region, year and sector. Sectors are GNFR names (like "A_PublicPower"), their letters (like
+    "A") or "Totals" (or one of TOTALS_ALIASES), pollutants are Pollutant names.
+
+    Parameters
+    ----------
+    files: str or list
+        Files to load, rows appearing in more than one file count once, the last one wins.
+    columns: dict
+        Maps column names used in the files to INVENTORY_KEYS and INVENTORY_VALUES, e.g.
+        {"country": "region", "emissions": "Value [kt]"}. Defaults to None, i.e. files use these.
+    uncertainty: float
+        Uncertainty [%] assumed for rows without any, defaults to 0. Rows with a lower uncertainty
+        only use it as upper uncertainty, too.
+
+    Returns
+    -------
+    DataFrame
+        Values [kt] and uncertainties [%] indexed by INVENTORY_KEYS, sorted. Pollutants are given
+        by their Pollutant name, sectors by their GNFR name or "Totals".
+    """
+    from pandas import read_csv, read_parquet, concat
+
+    parts = []
+    for file in [files] if isinstance(files, str) else files:
+        part = read_parquet(file) if str(file).endswith((".parquet", ".pq")) else read_csv(file)
+        part = part.rename(columns=columns or {})
+        missing = [column for column in INVENTORY_KEYS + INVENTORY_VALUES[:1] if column not in part.columns]
+        if missing:
+            raise ValueError(f"Inventory file {file} lacks columns {missing}!")
+        parts.append(part)
+
+    table = concat(parts, ignore_index=True)
+    table["Umin [%]"] = table["Umin [%]"].fillna(uncertainty) if "Umin [%]" in table.columns else float(uncertainty)
+    table["Umax [%]"] = table["Umax [%]"].fillna(table["Umin [%]"]) if "Umax [%]" in table.columns \
+        else table["Umin [%]"]
+    table["pollutant"] = _parse_pollutants(table["pollutant"])
+    table["sector"] = _parse_sectors(table["sector"])
+    table["region"] = table["region"].astype(str)
+    table["year"] = table["year"].astype(int)
+
+    table = table.drop_duplicates(subset=INVENTORY_KEYS, keep="last")
+    return table.set_index(INVENTORY_KEYS)[INVENTORY_VALUES].astype(float).sort_index()
+
+
+def calculated(results: dict[tuple[str, DateRange], DataFrame | dict | EmissionTotals],
+               pollutant: Pollutant) -> DataFrame:
+    """
+    Turn calculation results into a table like load_inventory() creates, per calendar year.
+
+    Periods covering a calendar year exactly are taken as they are. Otherwise, periods within a
+    year (like months) are added up and kept if their days add up to the whole year, their
+    uncertainties are combined using IPCC Guidelines formula 6.3 (assuming independent periods).
+    Periods spanning more than one year are left out.
+
+    Parameters
+    ----------
+    results: dict
+        Results by region name and period, each a GNFR table, a dict as returned by run() or
+        EmissionTotals (e.g. from run_totals_many(), only giving the "Totals" row).
+    pollutant: Pollutant
+        Pollutant the results are for.
+
+    Returns
+    -------
+    DataFrame
+        Values [kt] and uncertainties [%] indexed by INVENTORY_KEYS, sorted. Sectors without
+        values (NaN) are left out.
+    """
+    from pandas import DataFrame
+
+    rows = []
+    for (region, period), result in results.items():
+        if isinstance(result, EmissionTotals):
+            sectors = [("Totals", result.value, result.umin, result.umax)]
+        else:
+            table = result[EOEmissionCalculator.TOTAL_EMISSIONS_KEY] if isinstance(result, dict) else result
+            sectors = [(sector, *values) for sector, values in zip(table.index, table.to_numpy(dtype=float))]
+        if period.start.year == period.end.year:
+            rows += [(region, period.start.year, str(sector), value, umin, umax, len(period))
+                     for sector, value, umin, umax in sectors if not numpy.isnan(value)]
+
+    keys = ["region", "year", "sector"]
+    table = DataFrame(rows, columns=keys + INVENTORY_VALUES + ["days"])
+
+    # Prefer whole years, otherwise need all days of the year
+    length = numpy.array([366 if calendar.isleap(year) else 365 for year in table["year"]], dtype=int)
+    whole = table["days"].to_numpy() == length
+    table = table[whole | ~table.assign(whole=whole).groupby(keys)["whole"].transform("any").to_numpy()]
+    table = table[table.groupby(keys)["days"].transform("sum").to_numpy() == length[table.index]]
+
+    # Combine uncertainties per year: sqrt(sum of (value * uncertainty)²) / sum of |values|
+    table = table.assign(absolute=table["Value [kt]"].abs(),
+                         **{column: (table["Value [kt]"] * table[column]) ** 2 for column in INVENTORY_VALUES[1:]})
+    table = table.groupby(keys).sum()
+    for column in INVENTORY_VALUES[1:]:
+        table[column] = numpy.divide(table[column] ** 0.5, table["absolute"],
+                                     out=numpy.zeros(len(table)), where=table["absolute"].to_numpy() > 0)
+
+    table = table.reset_index().assign(pollutant=pollutant.name)
+    return table.set_index(INVENTORY_KEYS)[INVENTORY_VALUES].astype(float).sort_index()
+
+
+def compare(calculation: DataFrame, inventory: DataFrame) -> DataFrame:
+    """
+    Join calculated values with inventory values, deriving ratio, difference and overlap.
+
+    Both sides' uncertainties give an interval [value * (1 - Umin), value * (1 + Umax)] each.
+    The overlap is the length of the intervals' intersection relative to their union (1 for
+    identical intervals, 0 for disjoint ones), consistent rows have intersecting intervals.
+
+    Parameters
+    ----------
+    calculation: DataFrame
+        Calculated values, as created by calculated().
+    inventory: DataFrame
+        Reported values, as created by load_inventory().
+
+    Returns
+    -------
+    DataFrame
+        One row per key present on both sides, with each side's values and uncertainties, the
+        ratio calculated / reported [1], the difference calculated - reported [kt], the overlap
+        [1] and whether both are consistent.
+    """
+    joined = calculation.join(inventory, how="inner", lsuffix=" calculated", rsuffix=" reported")
+    calculated_value, reported_value = joined["Value [kt] calculated"], joined["Value [kt] reported"]
+
+    def interval(side: str) -> tuple:
+        value = joined[f"Value [kt] {side}"]
+        bounds = (value * (1 - joined[f"Umin [%] {side}"] / 100), value * (1 + joined[f"Umax [%] {side}"] / 100))
+        return numpy.minimum(*bounds), numpy.maximum(*bounds)
+
+    (low, high), (other_low, other_high) = interval("calculated"), interval("reported")
+    intersection = numpy.minimum(high, other_high) - numpy.maximum(low, other_low)
+    union = numpy.maximum(high, other_high) - numpy.minimum(low, other_low)
+
+    joined["Ratio [1]"] = numpy.divide(calculated_value, reported_value, out=numpy.full(len(joined), numpy.nan),
+                                       where=reported_value.to_numpy() != 0)
+    joined["Difference [kt]"] = calculated_value - reported_value
+    joined["Overlap [1]"] = numpy.divide(numpy.maximum(intersection, 0), union, out=numpy.ones(len(joined)),
+                                         where=union.to_numpy() > 0)
+    joined["Consistent"] = intersection.to_numpy() >= 0
+    return joined
+
+
+def tables(comparison: DataFrame) -> dict[str, DataFrame]:
+    """
+    Arrange a comparison as wide tables, one per COMPARISON_TABLES entry.
+
+    Parameters
+    ----------
+    comparison: DataFrame
+        As created by compare().
+
+    Returns
+    -------
+    dict
+        Ratios, differences [kt] and overlaps with one row per pollutant, region and year and
+        one column per sector (GNFR order, "Totals" last), NaN where either side has no value.
+    """
+    columns = {"ratio": "Ratio [1]", "difference": "Difference [kt]", "overlap": "Overlap [1]"}
+    order = [sector.name for sector in GNFR] + ["Totals"]
+    result = {}
+    for name in COMPARISON_TABLES:
+        wide = comparison[columns[name]].unstack("sector")
+        result[name] = wide[[sector for sector in order if sector in wide.columns]]
+    return result
+
+
+def _parse_pollutants(pollutants) -> list[str]:
+    """Turn pollutant names into their Pollutant name."""
+    result = []
+    for pollutant in pollutants:
+        if str(pollutant).strip() not in Pollutant.__members__:
+            raise ValueError(f"Unknown pollutant '{pollutant}'!")
+        result.append(Pollutant[str(pollutant).strip()].name)
+    return result
+
+
+def _parse_sectors(sectors) -> list[str]:
+    """Turn sector names or letters into GNFR names, or "Totals" for any totals alias."""
+    by_name = {**{sector.name.upper(): sector.name for sector in GNFR},
+               **{sector.name.split("_")[0].upper(): sector.name for sector in GNFR},
+               **{alias: "Totals" for alias in TOTALS_ALIASES + ("TOTALS",)}}
+    result = []
+    for sector in sectors:
+        key = str(sector).strip().upper()
+        if key.startswith("GNFR."):
+            key = key[len("GNFR."):]
+        if key not in by_name:
+            raise ValueError(f"Unknown GNFR sector '{sector}'!")
+        result.append(by_name[key])
+    return result
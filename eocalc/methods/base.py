@@ -1,39 +1,107 @@
 # -*- coding: utf-8 -*-
 """Space emission calculator base classes and definitions."""
 
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
 from enum import Enum, auto
+from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Union
+from functools import lru_cache, wraps
+from typing import Union, TYPE_CHECKING
 import math
-
-import numpy as np
-from shapely.geometry import MultiPolygon
-from shapely.ops import transform
-from pyproj import Transformer, CRS
-from pandas import DataFrame, Series
-from geopandas import GeoDataFrame
+import time
+import threading
 
 from eocalc.context import Pollutant, GNFR
 
+# Heavy dependencies are imported where needed only, so importing methods stays cheap
+if TYPE_CHECKING:
+    import numpy as np
+    from shapely.geometry import MultiPolygon
+    from pyproj import Transformer
+    from pandas import DataFrame, Series
+    from geopandas import GeoDataFrame
+
+# Maximum area of regions outside their parent or shared with siblings in run_hierarchy(), relative to the parent [1]
+HIERARCHY_AREA_TOLERANCE = 1e-9
+
 
 class Status(Enum):
     """Represent state of calculator."""
 
     READY = auto()
     RUNNING = auto()
+    CANCELLED = auto()
+
+
+class RunCancelled(Exception):
+    """Raised from within a calculation run once it got cancelled via its RunHandle."""
+
+
+class RunHandle:
+    """
+    Track a single calculation run: its state, progress, time spent per stage and cancellation.
+    Pass a handle to any of the EOEmissionCalculator.TRACKED_METHODS of a calculator as keyword
+    argument "handle" to follow or cancel the run from other threads. A handle is meant for a
+    single run, create a new one for the next.
+    """
+
+    def __init__(self):
+        self.state = Status.READY
+        self.progress = 0
+        self.timings: dict[str, float] = {}  # Seconds spent per stage, "total" for the whole run
+        self.error: Exception = None  # Exception the run ended with, if any
+        self._cancelled = threading.Event()
+        self._lap = time.perf_counter()
+
+    def __repr__(self) -> str:
+        return f"RunHandle({self.state.name}, {self.progress}%)"
+
+    @property
+    def cancelled(self) -> bool:
+        """Check if the run was asked to stop."""
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Ask the run to stop. It will raise RunCancelled at the next progress update or stage."""
+        self._cancelled.set()
+
+    def check(self):
+        """Raise RunCancelled if the run was asked to stop."""
+        if self.cancelled:
+            raise RunCancelled("Run cancelled!")
+
+    def lap(self, stage: str):
+        """Record time since the previous lap (or the run's start) as spent on stage, then check for cancellation."""
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0) + now - self._lap
+        self._lap = now
+        self.check()
 
 
 class DateRange:
-    """Represent a time span between two dates. Includes both start and end date."""
+    """
+    Represent a time span between two dates. Includes both start and end date. Immutable,
+    create a new instance instead of changing start or end.
+    """
+
+    __slots__ = ("start", "end")
 
     def __init__(self, start: Union[date, str], end: Union[date, str]):
-        self.start = start
-        self.end = end
+        start, end = (value if isinstance(value, date) else date.fromisoformat(value) for value in (start, end))
+        if end < start:
+            raise ValueError(f"Invalid date range, end ({end}) cannot be before start ({start})!")
+
+        object.__setattr__(self, "start", start)
+        object.__setattr__(self, "end", end)
 
     def __str__(self) -> str:
         return f"[{self.start} to {self.end}, {len(self)} days]"
 
+    def __repr__(self) -> str:
+        return f"DateRange('{self.start}', '{self.end}')"
+
     def __eq__(self, other: object) -> bool:
         return isinstance(other, type(self)) and (self.start, self.end) == (other.start, other.end)
 
@@ -46,31 +114,213 @@ class DateRange:
     def __iter__(self):
         yield from (self.start + timedelta(days=count) for count in range(len(self)))
 
+    def __contains__(self, day: date) -> bool:
+        return self.start <= day <= self.end
+
     def __setattr__(self, key, value):
-        super.__setattr__(self, key, value if isinstance(value, date) else date.fromisoformat(value))
+        raise AttributeError(f"Cannot set {key}, {type(self).__name__} is immutable!")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"Cannot delete {key}, {type(self).__name__} is immutable!")
 
-        if hasattr(self, "start") and hasattr(self, "end") and self.end < self.start:
-            raise ValueError(f"Invalid date range, end ({self.end}) cannot be before start ({self.start})!")
+    def __reduce__(self):
+        return type(self), (self.start, self.end)
+
+    def days(self) -> np.ndarray:
+        """
+        Get all days of the period at once.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of numpy.datetime64 days, in chronological order.
+        """
+        import numpy as np
+
+        return np.arange(np.datetime64(self.start, "D"), np.datetime64(self.end, "D") + 1)
+
+    def months(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Group the period's days by calendar month.
+
+        Returns
+        -------
+        tuple
+            Array of numpy.datetime64 months touched by the period, in chronological order, and
+            array with the number of the period's days falling into each of these months.
+        """
+        import numpy as np
+
+        months = np.arange(np.datetime64(self.start, "M"), np.datetime64(self.end, "M") + 1)
+        firsts = np.maximum(months.astype("datetime64[D]"), np.datetime64(self.start, "D"))
+        lasts = np.minimum((months + 1).astype("datetime64[D]") - 1, np.datetime64(self.end, "D"))
+        return months, (lasts - firsts).astype(int) + 1
+
+    def month_index(self) -> np.ndarray:
+        """
+        Map each of the period's days to its calendar month.
+
+        Returns
+        -------
+        numpy.ndarray
+            Position of each day's month in the array returned by months(), one per day.
+        """
+        import numpy as np
+
+        return (self.days().astype("datetime64[M]") - np.datetime64(self.start, "M")).astype(int)
+
+    def intersection(self, other: DateRange) -> Union[DateRange, None]:
+        """
+        Find days shared with other period.
+
+        Parameters
+        ----------
+        other: DateRange
+            Period to intersect with.
+
+        Returns
+        -------
+        DateRange
+            Period covering the days in both periods, None if there are no such days.
+        """
+        start, end = max(self.start, other.start), min(self.end, other.end)
+        return DateRange(start, end) if start <= end else None
+
+    def split_months(self) -> list[DateRange]:
+        """
+        Split period at calendar month borders.
+
+        Returns
+        -------
+        list
+            One period per calendar month touched, in chronological order. First and last
+            period might not cover the full month.
+        """
+        months, counts = self.months()
+        firsts = [max(month.astype("datetime64[D]").astype(date), self.start) for month in months]
+        return [DateRange(first, first + timedelta(days=int(count) - 1)) for first, count in zip(firsts, counts)]
+
+
+@dataclass(frozen=True)
+class EmissionTotals:
+    """Represent total emissions for a region and period, i.e. the "Totals" row of the GNFR table."""
+
+    value: float  # Total emissions [kt]
+    umin: float  # Lower uncertainty [%]
+    umax: float  # Upper uncertainty [%]
+
+    @classmethod
+    def from_table(cls, table: DataFrame) -> "EmissionTotals":
+        """
+        Extract totals from GNFR table.
+
+        Parameters
+        ----------
+        table: DataFrame
+            Table as created by EOEmissionCalculator._create_gnfr_table() and filled by a method.
+
+        Returns
+        -------
+        EmissionTotals
+            Values of the table's "Totals" row.
+        """
+        return cls(*(float(x) for x in table.loc["Totals"]))
+
+
+@lru_cache(maxsize=None)
+def _prepared_coverage(method: type):
+    from shapely.prepared import prep
+
+    return prep(method.coverage())
+
+
+_transformers = threading.local()
+
+
+def _equal_area_transformer() -> Transformer:
+    from pyproj import Transformer, CRS
+
+    # Transformers are expensive to create and should not be shared between threads
+    if not hasattr(_transformers, "equal_area"):
+        # EPSG:4326 is the shapely default (WGS84), EPSG:8857 is the Equal earth projection
+        _transformers.equal_area = Transformer.from_crs(CRS("EPSG:4326"), CRS("EPSG:8857"), always_xy=True)
+    return _transformers.equal_area
+
+
+def _tracked(method):
+    """Wrap run method, so each call gets its own RunHandle. Nested calls share the outer call's handle."""
+    @wraps(method)
+    def wrapper(self, *args, handle: RunHandle = None, **kwargs):
+        current = getattr(self._runs, "handle", None)
+        if current is not None and handle in (None, current):
+            return method(self, *args, **kwargs)
+
+        handle = RunHandle() if handle is None else handle
+        handle.check()
+        self._runs.handle = self._last_run = handle
+        handle.state, handle.progress = Status.RUNNING, 0
+        start = handle._lap = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+            handle.state = Status.READY
+            return result
+        except RunCancelled as cancelled:
+            handle.state, handle.error = Status.CANCELLED, cancelled
+            raise
+        except Exception as error:
+            handle.state, handle.error = Status.READY, error
+            raise
+        finally:
+            handle.timings["total"] = time.perf_counter() - start
+            self._runs.handle = current
+
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def _gnfr_table_template(pollutant: Pollutant) -> DataFrame:
+    import numpy as np
+    from pandas import DataFrame
+
+    cols = [f"{pollutant.name} emissions [kt]", "Umin [%]", "Umax [%]"]
+    return DataFrame(index=list(GNFR) + ["Totals"], columns=cols, data=np.nan)
 
 
 class EOEmissionCalculator(ABC):
-    """Base class for all emission calculation methods to implement."""
+    """
+    Base class for all emission calculation methods to implement.
+
+    Each call of one of the TRACKED_METHODS is a run with its own RunHandle, so a single instance
+    (and its caches) can serve many concurrent runs. Subclasses' implementations of these are
+    wrapped automatically, they accept a keyword argument "handle" and report via self._progress,
+    which goes to the handle of the run in the current thread.
+    """
 
     # Key to use for the total emission breakdown in result dict
     TOTAL_EMISSIONS_KEY = "totals"
     # Key to use for the spatial gridded emissions in result dict
     GRIDDED_EMISSIONS_KEY = "grid"
+    # Methods that make up a run and get their own RunHandle
+    TRACKED_METHODS = ("run", "run_totals", "run_totals_many", "run_hierarchy")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        for name in cls.TRACKED_METHODS:
+            if name in vars(cls) and not getattr(vars(cls)[name], "__isabstractmethod__", False):
+                setattr(cls, name, _tracked(vars(cls)[name]))
 
     def __init__(self):
         super().__init__()
 
-        self._state = Status.READY
-        self._progress = 0
+        self._runs = threading.local()
+        self._last_run = RunHandle()
 
     @property
     def state(self) -> Status:
         """
-        Check on the status of the calculator.
+        Check on the status of the calculator, i.e. of the run in the current thread or of the
+        run started last. Use a RunHandle to follow a specific run.
 
         Returns
         -------
@@ -78,12 +328,13 @@ class EOEmissionCalculator(ABC):
             Current state of the calculation method.
 
         """
-        return self._state
+        return self._run.state
 
     @property
     def progress(self) -> int:
         """
-        Check on the progress of the calculator after calling run().
+        Check on the progress of the calculator after calling run(), i.e. of the run in the current
+        thread or of the run started last. Use a RunHandle to follow a specific run.
 
         Returns
         -------
@@ -91,7 +342,33 @@ class EOEmissionCalculator(ABC):
             Progress in percent.
 
         """
-        return self._progress
+        return self._run.progress
+
+    @property
+    def _run(self) -> RunHandle:
+        return getattr(self._runs, "handle", None) or self._last_run
+
+    @property
+    def _state(self) -> Status:
+        return self._run.state
+
+    @_state.setter
+    def _state(self, state: Status):
+        self._run.state = state
+
+    @property
+    def _progress(self) -> int:
+        return self._run.progress
+
+    @_progress.setter
+    def _progress(self, progress: int):
+        """Report progress of the current run, raises RunCancelled if it got cancelled."""
+        self._run.progress = progress
+        self._run.check()
+
+    def _lap(self, stage: str):
+        """Record time spent on a stage of the current run, see RunHandle.lap()."""
+        self._run.lap(stage)
 
     @staticmethod
     @abstractmethod
@@ -136,7 +413,7 @@ class EOEmissionCalculator(ABC):
             If this method support emission estimation for given area.
 
         """
-        return cls.coverage().contains(region)
+        return _prepared_coverage(cls).contains(region)
 
     @staticmethod
     @abstractmethod
@@ -221,15 +498,106 @@ class EOEmissionCalculator(ABC):
         """
         pass
 
+    @staticmethod
+    def returns_tables() -> bool:
+        """
+        Check whether run() returns emission tables, see TOTAL_EMISSIONS_KEY and GRIDDED_EMISSIONS_KEY.
+        Batches and the service need them, methods only simulating a workload do not return any.
+
+        Returns
+        -------
+        bool
+            If this method's runs return the emission values as tables, defaults to True.
+
+        """
+        return True
+
+    @classmethod
+    def prefetch(cls, period: DateRange):
+        """
+        Make sure all data needed to run the method for given period is available locally. Allows
+        for downloading shared data once, before running many calculations in parallel. Methods
+        not depending on external data do not need to override this.
+
+        Parameters
+        ----------
+        period : DateRange
+            Time span to get data for.
+
+        """
+        pass
+
+    @_tracked
+    def run_totals(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> EmissionTotals:
+        """
+        Run method for given input and only return the total emission values. Methods
+        may override this to skip creating the grid and tables where possible.
+
+        Parameters
+        ----------
+        region : MultiPolygon
+            Area to calculate emissions for.
+        period : DateRange
+            Time span to cover.
+        pollutant : Pollutant
+            Air pollutant to calculate emissions for.
+
+        Returns
+        -------
+        EmissionTotals
+            The total emission value and its uncertainties.
+
+        """
+        return EmissionTotals.from_table(self.run(region, period, pollutant)[self.TOTAL_EMISSIONS_KEY])
+
+    @_tracked
+    def run_hierarchy(self, regions: dict[str, MultiPolygon], parents: dict[str, str], period: DateRange,
+                      pollutant: Pollutant) -> dict[str, DataFrame]:
+        """
+        Run method for a tree of nested regions, e.g. a state within a country within a continent,
+        and return the total emission tables. Children need to lie within their parent and must not
+        overlap each other. Methods may override this to derive parents from their children instead
+        of running each region on its own, results need to be the same.
+
+        Parameters
+        ----------
+        regions : dict
+            Areas to calculate emissions for, by name.
+        parents : dict
+            Name of each region's parent region, regions without parent are roots.
+        period : DateRange
+            Time span to cover.
+        pollutant : Pollutant
+            Air pollutant to calculate emissions for.
+
+        Returns
+        -------
+        dict
+            GNFR tables by region name, see run().
+        """
+        children = self._hierarchy(regions, parents)
+        tables = {}
+        for name in children:
+            tables[name] = self.run(regions[name], period, pollutant)[self.TOTAL_EMISSIONS_KEY]
+        return tables
+
     def _validate(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant):
         """Check inputs to run() method. Raise ValueError in case of a problem."""
+        self._validate_region(region)
+        self._validate_period(period)
+        self._validate_pollutant(pollutant)
+
+    def _validate_region(self, region: MultiPolygon):
+        """Check region given to run() method, see _validate()."""
+        from shapely.ops import transform
+
         if not self.covers(region):
             raise ValueError("Region not covered by emission estimation method!")
-        # EPSG:4326 is the shapely default (WGS84), EPSG:8857 is the Equal earth projection
-        projection = Transformer.from_crs(CRS("EPSG:4326"), CRS("EPSG:8857"), always_xy=True).transform
-        if transform(projection, region).area / 10**6 < self.minimum_area_size():
+        if transform(_equal_area_transformer().transform, region).area / 10**6 < self.minimum_area_size():
             raise ValueError("Region too small!")
 
+    def _validate_period(self, period: DateRange):
+        """Check period given to run() method, see _validate()."""
         if len(period) < self.minimum_period_length():
             raise ValueError(f"Time span {period} too short (minimum is {self.minimum_period_length()} days)!")
         if period.start < self.earliest_start_date():
@@ -237,9 +605,52 @@ class EOEmissionCalculator(ABC):
         if period.end > self.latest_end_date():
             raise ValueError(f"Method cannot be used for period ending on {period.end}!")
 
+    def _validate_pollutant(self, pollutant: Pollutant):
+        """Check pollutant given to run() method, see _validate()."""
         if not self.supports(pollutant):
             raise ValueError(f"Pollutant {pollutant.name} not supported!")
 
+    @staticmethod
+    def _hierarchy(regions: dict[str, MultiPolygon], parents: dict[str, str]) -> dict[str, list[str]]:
+        """
+        Check tree of regions given to run_hierarchy(). Raise ValueError in case of a problem.
+
+        Returns
+        -------
+        dict
+            Names of each region's children, ordered such that children come before their parents.
+        """
+        from shapely.ops import unary_union
+
+        for child, parent in parents.items():
+            if child not in regions or parent not in regions:
+                raise ValueError(f"Region {child if child not in regions else parent} of hierarchy not given!")
+
+        children: dict[str, list[str]] = {}
+
+        def visit(name: str, path: tuple):
+            if name in path:
+                raise ValueError(f"Region hierarchy has a cycle: {' > '.join(path + (name,))}!")
+            if name in children:
+                return
+            for child in (child for child, parent in parents.items() if parent == name):
+                visit(child, path + (name,))
+            children[name] = [child for child, parent in parents.items() if parent == name]
+
+        for name in regions:
+            visit(name, ())
+
+        for name, names in children.items():
+            if names:
+                union = unary_union([regions[child] for child in names])
+                tolerance = HIERARCHY_AREA_TOLERANCE * regions[name].area
+                if union.difference(regions[name]).area > tolerance:
+                    raise ValueError(f"Children of region {name} need to lie within it!")
+                if sum(regions[child].area for child in names) - union.area > tolerance:
+                    raise ValueError(f"Children of region {name} must not overlap!")
+
+        return children
+
     @staticmethod
     def _create_gnfr_table(pollutant: Pollutant) -> DataFrame:
         """
@@ -257,9 +668,37 @@ class EOEmissionCalculator(ABC):
         DataFrame
             Table to be filled by calculation methods.
         """
-        cols = [f"{pollutant.name} emissions [kt]", "Umin [%]", "Umax [%]"]
-        return DataFrame(index=list(GNFR), columns=cols, data=np.nan).append(
-            DataFrame(index=["Totals"], columns=cols, data=np.nan))
+        return _gnfr_table_template(pollutant).copy()
+
+    @staticmethod
+    def _fill_gnfr_table(table: DataFrame, sectors: np.ndarray) -> DataFrame:
+        """
+        Fill all GNFR sector rows at once and derive the "Totals" row from them. Totals are the
+        sum of the sector values, uncertainties are combined using _combine_uncertainties().
+
+        Parameters
+        ----------
+        table : DataFrame
+            Table as created by _create_gnfr_table(), will be changed in place.
+        sectors : numpy.ndarray
+            Array of shape (number of GNFR sectors, 3) with emission values and min/max uncertainties.
+
+        Returns
+        -------
+        DataFrame
+            The table given, filled.
+        """
+        import numpy as np
+
+        if np.shape(sectors) != (len(GNFR), 3):
+            raise ValueError(f"Sector values need to have shape {(len(GNFR), 3)}, got {np.shape(sectors)}!")
+
+        table.iloc[:len(GNFR)] = sectors
+        values = table.iloc[:len(GNFR), 0]
+        table.loc["Totals"] = [values.sum(),
+                               EOEmissionCalculator._combine_uncertainties(values, table.iloc[:len(GNFR), 1]),
+                               EOEmissionCalculator._combine_uncertainties(values, table.iloc[:len(GNFR), 2])]
+        return table
 
     @staticmethod
     def _combine_uncertainties(values: Series, uncertainties: Series) -> float:
@@ -320,6 +759,8 @@ class EOEmissionCalculator(ABC):
         GeoDataFrame
             Data frame with cell features spanning the full region. Will contain at least one row.
         """
+        from geopandas import GeoDataFrame
+
         grid = {"type": "FeatureCollection", "features": []}
 
         min_long, min_lat, max_long, max_lat = region.bounds if not snap else (
@@ -344,3 +785,38 @@ class EOEmissionCalculator(ABC):
                 })
 
         return GeoDataFrame.from_features(grid, crs=crs)
+
+    @staticmethod
+    def _create_tiles(region: MultiPolygon, size: float) -> list[MultiPolygon]:
+        """
+        Split given region into tiles. Tile corners snap to multiples of the tile size, so if
+        the size is a multiple of a method's cell size, no cell will be split between tiles.
+        Tiles not overlapping the region are dropped.
+
+        Parameters
+        ----------
+        region: MultiPolygon
+            Area to split.
+        size: float
+            Tile width and height [degrees].
+
+        Returns
+        -------
+        list
+            Parts of the region, one per tile, bottom left to top right.
+        """
+        from shapely.geometry import MultiPolygon, Polygon
+
+        if size <= 0:
+            raise ValueError(f"Tile size needs to be positive, got {size}!")
+
+        tiles = []
+        for box in EOEmissionCalculator._create_grid(region, size, size, snap=True).geometry:
+            part = region.intersection(box)
+            parts = part.geoms if hasattr(part, "geoms") else [part]
+            polygons = [p for g in parts for p in (g.geoms if isinstance(g, MultiPolygon) else [g])
+                        if isinstance(p, Polygon) and not p.is_empty]
+            if polygons:
+                tiles.append(MultiPolygon(polygons))
+
+        return tiles
@@ -1,27 +1,84 @@
 # -*- coding: utf-8 -*-
 """Dummy emission calculator."""
 
+from __future__ import annotations
+
+import random
 import time
+from dataclasses import dataclass
 from datetime import date
-
-from shapely.geometry import MultiPolygon, shape
+from typing import Sequence, TYPE_CHECKING
 
 from eocalc.context import Pollutant
-from eocalc.methods.base import Status, EOEmissionCalculator
+from eocalc.methods.base import EOEmissionCalculator
+
+if TYPE_CHECKING:
+    from shapely.geometry import MultiPolygon
+
+# Interval of progress updates (and cancellation checks) within stages [s]
+DUMMY_TICK = .05
+# Memory pages are touched in steps of this size, so allocations are actually committed [bytes]
+DUMMY_PAGE_SIZE = 4096
+
+
+class DummyFailure(Exception):
+    """Raised from within a dummy run when one of its stages fails on purpose."""
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Represent one stage of a dummy workload."""
+
+    name: str
+    duration: float  # Wall time the stage takes [s]
+    cpu: float = 0.  # Share of the duration spent busy in Python (holding the GIL), sleeping otherwise [1]
+    memory: int = 0  # Memory held during the stage [bytes]
+    failure: float = 0.  # Probability of the stage raising DummyFailure at its end [1]
+
+    def __post_init__(self):
+        if self.duration < 0 or self.memory < 0:
+            raise ValueError(f"Stage '{self.name}' needs a non-negative duration and memory!")
+        if not 0 <= self.cpu <= 1 or not 0 <= self.failure <= 1:
+            raise ValueError(f"Stage '{self.name}' needs CPU share and failure probability between 0 and 1!")
+
+
+# Workload of a run unless given otherwise, sleeps 0.9 s in total
+DUMMY_PROFILE = (Stage("prepare", .3), Stage("calculate", .3), Stage("finish", .3))
 
 
 class DummyEOEmissionCalculator(EOEmissionCalculator):
-    """Implement an emission calculator in the laziest way possible."""
+    """
+    Implement an emission calculator in the laziest way possible.
+
+    Runs follow a workload profile of stages instead of calculating anything, e.g. to compare
+    thread, process and asyncio based schedulers on a controlled mix of CPU bound and waiting work.
+    """
+
+    def __init__(self, profile: Sequence[Stage] = DUMMY_PROFILE, seed: int = None):
+        """
+        Create calculator.
 
-    def __init__(self):
+        Parameters
+        ----------
+        profile: sequence of Stage
+            Stages each run goes through, in order. Defaults to DUMMY_PROFILE.
+        seed: int
+            Seed for stage failures, defaults to None, i.e. different for each run. With a seed,
+            all runs fail (or not) alike.
+        """
         super().__init__()
 
+        self._profile = tuple(profile)
+        self._seed = seed
+
     @staticmethod
     def minimum_area_size() -> int:
         return 0
 
     @staticmethod
     def coverage() -> MultiPolygon:
+        from shapely.geometry import shape
+
         return shape({'type': 'MultiPolygon',
                       'coordinates': [[[[-180., -90.], [180., -90.], [180., 90.], [-180., 90.], [-180., -90.]]]]})
 
@@ -41,14 +98,33 @@ class DummyEOEmissionCalculator(EOEmissionCalculator):
     def supports(pollutant: Pollutant) -> bool:
         return pollutant is not None
 
+    @staticmethod
+    def returns_tables() -> bool:
+        return False  # Runs return 42
+
     def run(self, region=None, period=None, pollutant=None):
-        self._state = Status.RUNNING
-        self._progress = 20
-        time.sleep(.3)
-        self._progress = 50
-        time.sleep(.3)
-        self._progress = 80
-        time.sleep(.3)
-        self._progress = 0
-        self._state = Status.READY
+        chance = random.Random(self._seed)
+        total = sum(stage.duration for stage in self._profile)
+        done = 0.
+
+        for stage in self._profile:
+            memory = bytearray(stage.memory)
+            memory[::DUMMY_PAGE_SIZE] = b"\1" * len(range(0, stage.memory, DUMMY_PAGE_SIZE))
+
+            start = time.perf_counter()
+            while (elapsed := time.perf_counter() - start) < stage.duration:
+                tick = min(DUMMY_TICK, stage.duration - elapsed)
+                busy_until = time.perf_counter() + tick * stage.cpu
+                while time.perf_counter() < busy_until:
+                    pass
+                time.sleep(max(0., start + elapsed + tick - time.perf_counter()))
+                self._progress = int(100 * (done + min(time.perf_counter() - start, stage.duration)) / total)
+
+            del memory
+            done += stage.duration
+            self._lap(stage.name)
+            if chance.random() < stage.failure:
+                raise DummyFailure(f"Stage '{stage.name}' failed on purpose!")
+
+        self._progress = 100
         return 42
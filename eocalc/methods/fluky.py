@@ -1,30 +1,68 @@
 # -*- coding: utf-8 -*-
 """Random emission calculator."""
 
-import random
-from datetime import date
+from __future__ import annotations
 
-from shapely.geometry import MultiPolygon, shape
-from pandas import DataFrame
-from geopandas import GeoDataFrame, overlay
+import hashlib
+from datetime import date
+from typing import TYPE_CHECKING
 
 from eocalc.context import Pollutant, GNFR
 from eocalc.methods.base import DateRange
-from eocalc.methods.base import Status, EOEmissionCalculator
+from eocalc.methods.base import EOEmissionCalculator
 
+if TYPE_CHECKING:
+    import numpy
+    from shapely.geometry import MultiPolygon
+    from pandas import DataFrame
 
-class RandomEOEmissionCalculator(EOEmissionCalculator):
-    """Implement the emission calculator returning random non-sense."""
+# Width and height of the random grid's cells [degrees]
+RANDOM_CELL_SIZE = .1
+# Uncertainty given for each random cell [%]
+RANDOM_CELL_UNCERTAINTY = 42
+# Share of per-day values missing at random, like days without valid satellite data [1]
+RANDOM_GAP_SHARE = .1
 
-    def __init__(self):
+
+class RandomEOEmissionCalculator(EOEmissionCalculator):
+    """
+    Implement the emission calculator returning random non-sense.
+
+    All values of a run are drawn at once from a numpy Generator. With a seed, results only
+    depend on the seed, region, period and pollutant, so they are reproducible, also when runs
+    share the instance concurrently. Meant as a fast stand-in for real methods, e.g. to load test
+    caches, schedulers and serializers.
+    """
+
+    def __init__(self, seed: int = None, daily: bool = False, clip: bool = True):
+        """
+        Create calculator.
+
+        Parameters
+        ----------
+        seed: int
+            Seed for the random values, defaults to None, i.e. different values each run.
+        daily: bool
+            Whether the grid comes with per-day emission columns (some missing) and cell centers,
+            laid out like the TEMIS methods' grids. Defaults to False, i.e. cell totals only.
+        clip: bool
+            Whether to clip the grid to the region. Otherwise, all cells intersecting the region
+            are returned as they are, skipping the (expensive) overlay. Defaults to True.
+        """
         super().__init__()
 
+        self._seed = seed
+        self._daily = daily
+        self._clip = clip
+
     @staticmethod
     def minimum_area_size() -> int:
         return 1
 
     @staticmethod
     def coverage() -> MultiPolygon:
+        from shapely.geometry import shape
+
         return shape({'type': 'MultiPolygon',
                       'coordinates': [[[[-180., -90.], [180., -90.], [180., 90.], [-180., 90.], [-180., -90.]]]]})
 
@@ -45,29 +83,62 @@ class RandomEOEmissionCalculator(EOEmissionCalculator):
         return pollutant is not None
 
     def run(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> dict[str, DataFrame]:
+        import numpy
+        import shapely
+        from pandas import DataFrame, concat
+        from geopandas import GeoDataFrame, overlay
+
         self._validate(region, period, pollutant)
-        self._state = Status.RUNNING
-        self._progress = 0
+        generator = self._generator(region, period, pollutant)
 
-        # Generate data frame with random emission values per GNFR sector
-        data = self._create_gnfr_table(pollutant)
-        for sector in GNFR:
-            data.loc[sector] = [random.random()*100, random.random()*18, random.random()*22]
-        # Add totals row at the bottom
-        data.loc["Totals"] = data.sum(axis=0)
+        # Generate data frame with random emission values per GNFR sector, totals row is added at the bottom
+        data = self._fill_gnfr_table(self._create_gnfr_table(pollutant),
+                                     generator.random((len(GNFR), 3)) * [100, 18, 22])
 
         self._progress = 50
 
-        # Generate bogus grid with random emission values
-        geo_data = self._create_grid(region, .1, .1, snap=False)
-        geo_data = overlay(geo_data, GeoDataFrame({'geometry': [region]}, crs="EPSG:4326"), how='intersection')
-        geo_data.insert(0, "Area [km²]", geo_data.to_crs(epsg=8857).area / 10 ** 6)  # Equal earth projection
-        geo_data.insert(1, f"Total {pollutant.name} emissions [kg]", [random.random()*100 for _ in range(len(geo_data))])
-        geo_data.insert(2, "Umin [%]", 42)
-        geo_data.insert(3, "Umax [%]", 42)
+        # Generate bogus grid with random emission values, cells bottom left to top right like _create_grid()
+        min_long, min_lat, max_long, max_lat = region.bounds
+        lats = min_lat + numpy.arange(max(1, numpy.ceil((max_lat - min_lat) / RANDOM_CELL_SIZE))) * RANDOM_CELL_SIZE
+        longs = min_long + numpy.arange(max(1, numpy.ceil((max_long - min_long) / RANDOM_CELL_SIZE))) * RANDOM_CELL_SIZE
+        lats, longs = (array.ravel() for array in numpy.meshgrid(lats, longs, indexing="ij"))
+        geo_data = GeoDataFrame(geometry=shapely.box(longs, lats, longs + RANDOM_CELL_SIZE, lats + RANDOM_CELL_SIZE),
+                                crs="EPSG:4326")
+        if self._daily:
+            geo_data.insert(0, "Center latitude [°]", [f"{lat}" for lat in lats + RANDOM_CELL_SIZE / 2])
+            geo_data.insert(1, "Center longitude [°]", [f"{long}" for long in longs + RANDOM_CELL_SIZE / 2])
+        if self._clip:
+            geo_data = overlay(geo_data, GeoDataFrame({'geometry': [region]}, crs="EPSG:4326"), how='intersection')
+        else:
+            geo_data = geo_data[shapely.intersects(region, geo_data.geometry.to_numpy())].reset_index(drop=True)
+
+        areas = geo_data.to_crs(epsg=8857).area / 10 ** 6  # Equal earth projection
+        if self._daily:
+            # Day columns go in front of the center columns, like for the TEMIS methods' grids
+            values = generator.lognormal(0, 1, (len(geo_data), len(period))) * areas.to_numpy()[:, numpy.newaxis]
+            values[generator.random(values.shape) < RANDOM_GAP_SHARE] = numpy.nan
+            columns = [f"{day} {pollutant.name} emissions [kg]" for day in numpy.datetime_as_string(period.days())]
+            days = DataFrame(values, columns=columns, index=geo_data.index)
+            geo_data = GeoDataFrame(concat([days, geo_data], axis=1), crs=geo_data.crs)
+            totals, missing = numpy.nansum(values, axis=1), numpy.isnan(values).sum(axis=1)
+        else:
+            totals, missing = generator.random(len(geo_data)) * 100, 0
+        geo_data.insert(0, "Area [km²]", areas)
+        geo_data.insert(1, f"Total {pollutant.name} emissions [kg]", totals)
+        geo_data.insert(2, "Umin [%]", RANDOM_CELL_UNCERTAINTY)
+        geo_data.insert(3, "Umax [%]", RANDOM_CELL_UNCERTAINTY)
         geo_data.insert(4, "Number of values [1]", len(period))
-        geo_data.insert(5, "Missing values [1]", 0)
+        geo_data.insert(5, "Missing values [1]", missing)
 
         self._progress = 100
-        self._state = Status.READY
         return {self.TOTAL_EMISSIONS_KEY: data, self.GRIDDED_EMISSIONS_KEY: geo_data}
+
+    def _generator(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> numpy.random.Generator:
+        """Create generator for a run, seeded by the calculator's seed and the run's input if a seed is set."""
+        import numpy
+
+        if self._seed is None:
+            return numpy.random.default_rng()
+        region_key = int.from_bytes(hashlib.sha256(region.wkb).digest()[:8], "little")
+        return numpy.random.default_rng([self._seed, region_key, period.start.toordinal(), period.end.toordinal(),
+                                         pollutant.value])
@@ -1,42 +1,110 @@
 # -*- coding: utf-8 -*-
 """Emission calculators based on TEMIS data (temis.nl)"""
+from __future__ import annotations
+
+import math
 import os.path
-import shutil
-import gzip
 import threading
+from collections import OrderedDict
 from datetime import date, timedelta
-from urllib.request import urlretrieve
-
-import numpy
-from pandas import DataFrame, Series
-from shapely.geometry import MultiPolygon, shape
-from geopandas import GeoDataFrame, overlay
+from typing import Iterator, TYPE_CHECKING
 
 from eocalc.context import Pollutant
-from eocalc.methods.base import EOEmissionCalculator, DateRange, Status
+from eocalc.methods.base import EOEmissionCalculator, EmissionTotals, DateRange
+
+# Heavy dependencies are imported by the stages needing them only, see eocalc.methods.base
+if TYPE_CHECKING:
+    import numpy
+    from pandas import DataFrame
+    from shapely.geometry import MultiPolygon
+    from geopandas import GeoDataFrame
+    from eocalc.weighting import WeightCache
+    from eocalc.proxies import SectorProxies
+    from eocalc.corrections import Correction
+    from eocalc.montecarlo import MonteCarlo
 
 # Local directory we use to store downloaded and decompressed data
 LOCAL_DATA_FOLDER = "data/methods/temis/tropomi/no2/monthly_mean"
 # Online resource used to download TEMIS data on demand
 TEMIS_DOWNLOAD_URL = "https://d1qb6yzwaaq4he.cloudfront.net/tropomi/no2/%s/%s/no2_%s.asc.gz"
+# Local directory we use to store downloaded and decompressed daily data
+LOCAL_DAILY_DATA_FOLDER = "data/methods/temis/tropomi/no2/daily"
+# Online resource used to download daily TEMIS data on demand
+TEMIS_DAILY_DOWNLOAD_URL = "https://d1qb6yzwaaq4he.cloudfront.net/tropomi/no2/%s/%s/%s/no2_%s.asc.gz"
 # TEMIS TOMS file format cell width and height [degrees]
 TEMIS_BIN_WIDTH = 0.125
 # TEMIS TOMS file format number of four digit values per line [1]
 TEMIS_VALUES_PER_ROW = 20
+# TEMIS TOMS file format number of characters per value [1]
+TEMIS_VALUE_WIDTH = 4
 # TEMIS TOMS file invalid value placeholder
 TEMIS_NAN_VALUE = -999
 # Uncertainty value assumed per cell (TODO Use a proper/realistic value here!)
 TEMIS_CELL_UNCERTAINTY = 1000
+# Default number of decoded files kept in memory by TemisDataCache [1]
+TEMIS_CACHE_SIZE = 24
+# Internal storage modes for raw TEMIS values in run(): as float64, as float32 or as int16
+TEMIS_STORAGE_MODES = ("float64", "float32", "int16")
+# Placeholder for invalid values in int16 storage mode (raw values are four digits only)
+TEMIS_INT16_NAN = -32768
+# Cells per side of the largest blocks of an adaptive grid, a power of two (64 cells are 8 degrees) [1]
+TEMIS_BLOCK_SIZE = 64
+
+# Only download one file at a time, so concurrent runs do not fetch the same file twice
+_download_lock = threading.Lock()
 
 
 class TropomiMonthlyMeanAggregator(EOEmissionCalculator):
 
+    def __init__(self, cache: TemisDataCache = None, weights: WeightCache = None, proxies: SectorProxies = None,
+                 correction: Correction = None, storage: str = "float64", uncertainty: MonteCarlo = None):
+        """
+        Create calculator.
+
+        Parameters
+        ----------
+        cache: TemisDataCache
+            Decoded TEMIS files to share, defaults to None, i.e. parse files on each run.
+        weights: WeightCache
+            Area weights to share in run_totals_many(), defaults to a cache persisted in the local default folder.
+        proxies: SectorProxies
+            Proxies to split emissions across GNFR sectors in run(), defaults to None, i.e. only fill the totals.
+        correction: Correction
+            Factors per day and latitude applied to the daily values, e.g. for the pollutant's lifetime
+            and diurnal variation, defaults to None, i.e. no correction.
+        storage: str
+            How run() keeps values internally, one of TEMIS_STORAGE_MODES. Compact modes keep raw
+            values per month as float32 or int16 and per-day grid columns as float32, halving the
+            grid's memory. Raw values are exact in both, float32 per-day columns deviate by less
+            than 2e-7 (relative) from float64 ones and totals, summed in float64, by less than 1e-6.
+            run_totals_many() keeps the values read per month in the storage mode, too, but sums
+            them in float64, so its results are the same in all modes. TropomiDailyAggregator
+            streams the days without keeping them and only supports "float64". Defaults to "float64".
+        uncertainty: MonteCarlo
+            Simulation deriving the uncertainties of totals (the totals row of run()'s table and
+            run_totals_many()) from percentiles instead of error propagation, e.g. for spatially
+            correlated errors. Sector rows keep propagated uncertainties. Defaults to None, i.e.
+            propagate errors only.
+        """
+        if storage not in TEMIS_STORAGE_MODES:
+            raise ValueError(f"Storage mode needs to be one of {TEMIS_STORAGE_MODES}, got '{storage}'!")
+        super().__init__()
+
+        self._cache = cache
+        self._weights = weights
+        self._proxies = proxies
+        self._correction = correction
+        self._storage = storage
+        self._monte_carlo = uncertainty
+
     @staticmethod
     def minimum_area_size() -> int:
         return 10**4
 
     @staticmethod
     def coverage() -> MultiPolygon:
+        from shapely.geometry import shape
+
         return shape({'type': 'MultiPolygon',
                       'coordinates': [[[[-180., -60.], [180., -60.], [180., 60.], [-180., 60.], [-180., -60.]]]]})
 
@@ -56,50 +124,491 @@ class TropomiMonthlyMeanAggregator(EOEmissionCalculator):
     def supports(pollutant: Pollutant) -> bool:
         return pollutant == Pollutant.NO2
 
-    def run(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> dict[str, DataFrame]:
+    @classmethod
+    def prefetch(cls, period: DateRange):
+        for month in period.split_months():
+            cls._assure_data_availability(month.start)
+
+    def run(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant, tile_size: float = None,
+            workers: int = 1, output: str = None, adaptive: bool = False,
+            simplify: float = None) -> dict[str, DataFrame]:
+        """
+        Run method for given input and return the derived emission values.
+
+        Large regions can be processed in tiles of tile_size x tile_size degrees, each tile is then
+        read, clipped and aggregated on its own, using up to the given number of worker threads.
+        The tile size needs to be a multiple of TEMIS_BIN_WIDTH, so no cell is split between tiles.
+        Tiles only read their own bounding box, thus only the tiles processed at a time hold per-day
+        values. Use a TemisDataCache to parse each file once for all tiles. If an output file is
+        given, the full grid rows are streamed to that GeoParquet file tile by tile and the grid
+        returned only keeps the per-cell summary columns (no per-day columns). Otherwise, all tiles'
+        rows are returned, so peak memory is only bounded if an output file is given.
+
+        If adaptive, only cells on the region's boundary are clipped and returned as single cells,
+        cells inside are merged into blocks of up to TEMIS_BLOCK_SIZE x TEMIS_BLOCK_SIZE cells (see
+        _process_tile_adaptive()). This is much faster for large regions and gives the same table,
+        as it is still derived from the single cells. Defaults to False, i.e. a grid of single cells.
+
+        If simplify is given, the region is simplified for the TEMIS cell size before it is tiled and
+        clipped, changing its area by at most that fraction (see RegionRegistry.simplify()). This
+        speeds up clipping detailed regions. Defaults to None, i.e. the region is used as given.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        import numpy
+        from pandas import concat
+        from geopandas import GeoDataFrame
+        from eocalc.weighting import GridSpec
+        from eocalc.regions import RegionRegistry
+
         self._validate(region, period, pollutant)
-        self._state = Status.RUNNING
-        self._progress = 0  # TODO Update progress below!
+        if simplify is not None:
+            region = RegionRegistry.simplify(region, TEMIS_BIN_WIDTH, simplify)
+        steps = None if tile_size is None else tile_size / TEMIS_BIN_WIDTH  # Cells per tile side
+        if steps is not None and (steps < 1 or not math.isclose(steps, round(steps))):
+            raise ValueError(f"Tile size needs to be a multiple of {TEMIS_BIN_WIDTH}°, got {tile_size}!")
+
+        # 1. Read raw TEMIS data for the region's bounding box, only once per month, tiles read their own below
+        months = None if tile_size is not None else self._read_months(region, period)
+        # Correction factors per day and latitude band, e.g. for pollutant lifetime and diurnal variation
+        factors = None if self._correction is None else self._correction.for_period(period, GridSpec(TEMIS_BIN_WIDTH))
+        self._lap("read")
+
+        # 2. Process region (as a whole or tile by tile), write full rows to disk if requested
+        tiles = [region] if tile_size is None else self._create_tiles(region, tile_size)
+        parts: dict[int, GeoDataFrame] = {}
+        if output:
+            from eocalc.results import GridWriter
+        writer = GridWriter(output) if output else None
+
+        cells: dict[int, tuple[numpy.ndarray, ...]] = {}
+
+        def process(tile: MultiPolygon):
+            window, values = (region, months) if months is not None else (tile, self._read_months(tile, period))
+            method = self._process_tile_adaptive if adaptive else self._process_tile
+            return method(tile, window, values, factors, period, pollutant)
+
+        def collect(futures: dict):
+            for future, index in futures.items():
+                part = future.result()
+                if adaptive:
+                    part, cells[index] = part
+                if writer:
+                    writer.write(part)
+                    part = part.drop(columns=part.columns[-(len(period) + 3):-3])
+                parts[index] = part
+            self._progress = int(100 * len(parts) / len(tiles))
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = {}
+                for index, tile in enumerate(tiles):
+                    pending[executor.submit(process, tile)] = index
+                    if len(pending) >= workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect({future: pending.pop(future) for future in done})
+                collect(pending)
+        finally:
+            if writer:
+                writer.close()
+
+        grid = GeoDataFrame(concat([parts[index] for index in sorted(parts)], ignore_index=True), crs="EPSG:4326")
+        self._lap("grid")
+
+        # 3. Add GNFR table incl. uncertainties
+        if adaptive:
+            table = self._create_cell_table(*(numpy.concatenate(arrays) for arrays in
+                                              zip(*(cells[index] for index in sorted(cells)))), pollutant)
+        else:
+            table = self._create_table(grid, pollutant)
+        self._lap("table")
 
+        return {self.TOTAL_EMISSIONS_KEY: table, self.GRIDDED_EMISSIONS_KEY: grid}
+
+    def run_totals(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> EmissionTotals:
+        return self.run_totals_many({"region": region}, [period], pollutant)[("region", period)]
+
+    def run_totals_many(self, regions: dict[str, MultiPolygon], periods: list[DateRange],
+                        pollutant: Pollutant) -> dict[tuple[str, DateRange], EmissionTotals]:
+        """
+        Calculate total emissions for all combinations of regions and periods at once. Each month
+        of data is read only once, cells are weighted by the area of each region they overlap and
+        months by the number of days each period has in them, see eocalc.weighting.
+
+        Parameters
+        ----------
+        regions: dict
+            Areas to calculate emissions for, by name.
+        periods: list
+            Time spans to cover.
+        pollutant: Pollutant
+            Air pollutant to calculate emissions for.
+
+        Returns
+        -------
+        dict
+            Total emission values and their uncertainties by region name and period.
+        """
+        import numpy
+        from eocalc.weighting import GridSpec, WeightCache, Aggregation, day_weights, aggregate, contributions
+
+        # Validate each input once, checking a region's area is expensive
+        for region in regions.values():
+            self._validate_region(region)
+        for period in periods:
+            self._validate_period(period)
+        self._validate_pollutant(pollutant)
+
+        # 1. Find each region's share of the cells (cached), only keep the cells covered by any region
+        if self._weights is None:
+            self._weights = WeightCache()
+        weights, cells = self._weights.get(list(regions.values()), GridSpec(TEMIS_BIN_WIDTH)).compress()
+        self._lap("weights")
+
+        # 2. Read TEMIS data for these cells once per month needed by any period, kept as set by the storage mode
+        months = numpy.unique(numpy.concatenate([period.months()[0] for period in periods]))
+        values = numpy.array([self._read_raw_cells(cells, month.astype("datetime64[D]").astype(date))
+                              for month in months])
+        self._lap("read")
+        self._progress = 50
+
+        # 3. Sum up all combinations at once in float64 (raw values are exact in all modes), area cancels out
+        # for the uncertainties
+        values = self._to_kg_per_km2(self._decode(values.reshape(len(months), len(cells))).astype(float))
+        parts = []  # Cells' contributions and uncertainties, only needed for simulations
+        if self._correction is None:
+            result = aggregate(values, weights, day_weights(periods, months), TEMIS_CELL_UNCERTAINTY)
+            if self._monte_carlo is not None:
+                parts.append(contributions(values, weights, day_weights(periods, months), TEMIS_CELL_UNCERTAINTY))
+        else:
+            # Factors differ per day and latitude band, so aggregate period by period: each month's
+            # values are scaled by their days' factor sum, uncertainties such that the squares match
+            bands = cells // GridSpec(TEMIS_BIN_WIDTH).columns
+            results = []
+            for period in periods:
+                sums, squares = self._correction.month_sums(period, months, GridSpec(TEMIS_BIN_WIDTH))
+                sums, squares = sums[:, bands], squares[:, bands]
+                uncertainties = TEMIS_CELL_UNCERTAINTY * numpy.divide(squares ** 0.5, sums, out=numpy.zeros_like(sums),
+                                                                      where=sums > 0)
+                results.append(aggregate(values * sums, weights, numpy.ones((1, len(months))), uncertainties))
+                if self._monte_carlo is not None:
+                    parts.append(contributions(values * sums, weights, numpy.ones((1, len(months))), uncertainties))
+            result = Aggregation(numpy.vstack([part.totals for part in results]),
+                                 numpy.vstack([part.uncertainties for part in results]))
+        self._lap("aggregate")
+
+        # 4. Optionally replace propagated uncertainties by simulated ones, columns are periods x regions
+        umin = umax = result.uncertainties
+        if self._monte_carlo is not None:
+            umin, umax = self._monte_carlo.bounds(cells[parts[0][0]], numpy.hstack([part[1] for part in parts]),
+                                                  numpy.hstack([part[2] for part in parts]), GridSpec(TEMIS_BIN_WIDTH),
+                                                  parts[0][3])
+            umin, umax = umin.reshape(len(periods), len(regions)), umax.reshape(len(periods), len(regions))
+            self._lap("simulate")
+
+        self._progress = 100
+        return {(name, period): EmissionTotals(float(result.totals[row, column] / 10**6),
+                                               float(umin[row, column]), float(umax[row, column]))
+                for column, name in enumerate(regions) for row, period in enumerate(periods)}
+
+    def run_hierarchy(self, regions: dict[str, MultiPolygon], parents: dict[str, str], period: DateRange,
+                      pollutant: Pollutant) -> dict[str, DataFrame]:
+        """
+        Run method for a tree of nested regions, see EOEmissionCalculator.run_hierarchy(). Only leaf
+        regions and the parts of parents not covered by their children are gridded and clipped,
+        each tree's data is read once. Parents are then derived from the per-cell emissions of their
+        parts: cells split across children are merged again, so totals, uncertainties and sectors
+        are the same as for running each region on its own (up to rounding of the clipped cell
+        areas, about 1e-9 relative). No grids are returned.
+        """
+        import numpy
+        from shapely.geometry import box
+        from shapely.ops import unary_union
+        from eocalc.weighting import GridSpec
+
+        children = self._hierarchy(regions, parents)
+        for region in regions.values():
+            self._validate(region, period, pollutant)
+        factors = None if self._correction is None else self._correction.for_period(period, GridSpec(TEMIS_BIN_WIDTH))
+
+        def root(name: str) -> str:
+            return name if name not in parents else root(parents[name])
+
+        # 1. Grid and clip each leaf and each parent's remainder once, reading data per tree only
+        bounds: dict[str, list[tuple]] = {}
+        for name, region in regions.items():
+            bounds.setdefault(root(name), []).append(region.bounds)
+        windows = {name: box(*numpy.min(boxes, axis=0)[:2], *numpy.max(boxes, axis=0)[2:])
+                   for name, boxes in bounds.items()}
+        months = {name: self._read_months(window, period) for name, window in windows.items()}
+        self._lap("read")
+
+        cells: dict[str, tuple[numpy.ndarray, ...]] = {}
+        for count, (name, names) in enumerate(children.items()):
+            part = regions[name]
+            if names:
+                part = part.difference(unary_union([regions[child] for child in names]))
+                if part.geom_type == "GeometryCollection":  # Only keep areas, not lines left along borders
+                    part = unary_union([geometry for geometry in part.geoms
+                                        if geometry.geom_type in ("Polygon", "MultiPolygon")])
+            if part.area > 0:
+                grid = self._process_tile(part, windows[root(name)], months[root(name)], factors, period, pollutant)
+                found = (self._grid_cells(grid), grid.iloc[:, 1].to_numpy(), grid.iloc[:, 2].to_numpy())
+            else:
+                found = (numpy.empty(0, dtype=int), numpy.empty(0), numpy.empty(0))
+
+            # 2. Add up parts per cell, cells share uncertainties as they have the same daily values
+            found = [numpy.concatenate(arrays) for arrays in zip(found, *(cells[child] for child in names))]
+            unique, first, positions = numpy.unique(found[0], return_index=True, return_inverse=True)
+            cells[name] = (unique, numpy.bincount(positions, weights=found[1], minlength=len(unique)), found[2][first])
+            self._progress = int(100 * (count + 1) / len(children))
+        self._lap("grid")
+
+        # 3. Add GNFR tables incl. uncertainties
+        tables = {name: self._create_cell_table(*cells[name], pollutant) for name in regions}
+        self._lap("table")
+        return tables
+
+    def _process_tile(self, tile: MultiPolygon, region: MultiPolygon, months: numpy.ndarray, factors: numpy.ndarray,
+                      period: DateRange, pollutant: Pollutant) -> GeoDataFrame:
+        """
+        Create clipped grid with per-day emission columns for (part of) the region given, from values
+        with one month per row. Factors, if given, have one row per day and one column per global
+        latitude band (see Correction.for_period()).
+        """
         # 1. Overlay area given with cells matching the TEMIS data set
-        grid = self._create_grid(region, TEMIS_BIN_WIDTH, TEMIS_BIN_WIDTH, snap=True, include_center_cols=True)
+        grid = self._create_grid(tile, TEMIS_BIN_WIDTH, TEMIS_BIN_WIDTH, snap=True, include_center_cols=True)
+        return self._clip_grid(grid, tile, region, months, factors, period, pollutant)
+
+    def _process_tile_adaptive(self, tile: MultiPolygon, region: MultiPolygon, months: numpy.ndarray,
+                               factors: numpy.ndarray, period: DateRange,
+                               pollutant: Pollutant) -> tuple[GeoDataFrame, tuple[numpy.ndarray, ...]]:
+        """
+        Create clipped grid like _process_tile(), but only clip the cells on the tile's boundary.
+        Cells fully inside are found via _quadtree() and calculated without any geometry operation,
+        then merged into square blocks of cells. Block rows have the summed area, emissions, values
+        and missing values of their cells, uncertainties combined from them and the block's center.
+
+        Returns
+        -------
+        tuple
+            Grid of blocks and boundary cells, plus global cell index (see eocalc.weighting.GridSpec),
+            emissions [kg] and uncertainties [%] of each single cell, e.g. for _create_cell_table().
+        """
+        import numpy
+        import shapely
+        from pandas import DataFrame, concat
+        from geopandas import GeoDataFrame, GeoSeries
+        from eocalc.weighting import GridSpec
 
-        # 2. Read TEMIS data into the grid, use cache to avoid re-reading the file for each day individually
-        cache: dict[str, list[float]] = {}
-        for column, day in enumerate(period):
-            month_cache_key = f"{day:%Y-%m}"
-            if month_cache_key not in cache.keys():
-                concentrations = self._read_toms_data(region, self._assure_data_availability(day))
-                # value [1/cm²] * TEMIS scale [1] / Avogadro constant [1] * NO2 molecule weight [g] / to [kg] * to [km²]
-                cache[month_cache_key] = [x * 10**13 / (6.022 * 10**23) * 46.01 / 1000 * 10**10 for x in concentrations]
-                # TODO Correct for pollutant atmosphere lifetime and diurnal variation: pollutant.atmo_lifetime(day, latitude) * pollutant.diurnal_variation(day, instrument)
+        spec = GridSpec(TEMIS_BIN_WIDTH)
+        blocks, boundary = self._quadtree(tile, TEMIS_BLOCK_SIZE)
 
-            # Here, values are actually [kg/km²], but the area [km²] cancels out below
-            grid.insert(column, f"{day} {pollutant.name} emissions [kg]", cache[month_cache_key])
+        # 1. Clip boundary cells as usual
+        lats, longs = -90 + boundary[:, 0] * TEMIS_BIN_WIDTH, -180 + boundary[:, 1] * TEMIS_BIN_WIDTH
+        grid = GeoDataFrame({"Center latitude [°]": [f"{lat}" for lat in lats + TEMIS_BIN_WIDTH / 2],
+                             "Center longitude [°]": [f"{long}" for long in longs + TEMIS_BIN_WIDTH / 2]},
+                            geometry=shapely.box(longs, lats, longs + TEMIS_BIN_WIDTH, lats + TEMIS_BIN_WIDTH),
+                            crs="EPSG:4326")
+        grid = self._clip_grid(grid, tile, region, months, factors, period, pollutant)
+        found = [(self._grid_cells(grid), grid.iloc[:, 1].to_numpy(), grid.iloc[:, 2].to_numpy())]
+
+        # 2. Expand blocks to their cells, block by block, and look them up in the month data
+        sizes = blocks[:, 2] ** 2
+        offsets = numpy.arange(sizes.sum()) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+        rows = numpy.repeat(blocks[:, 0], sizes) + offsets // numpy.repeat(blocks[:, 2], sizes)
+        columns = numpy.repeat(blocks[:, 1], sizes) + offsets % numpy.repeat(blocks[:, 2], sizes)
+        window = self._window_columns(region)
+        cells = (rows - self._window_rows(region)[0]) * numpy.count_nonzero(window) + columns - numpy.argmax(window)
+        values = self._decode(months[:, cells][period.month_index()])
+        if factors is not None:
+            values = values * factors[:, rows].astype(values.dtype)
+
+        # 3. Cells in a row all have the same area, which is exactly the area overlay() would give them
+        bands = numpy.unique(rows)
+        areas = GeoSeries(shapely.box(-180, -90 + bands * TEMIS_BIN_WIDTH, -180 + TEMIS_BIN_WIDTH,
+                                      -90 + (bands + 1) * TEMIS_BIN_WIDTH), crs="EPSG:4326").to_crs(epsg=8857)
+        areas = (areas.area.to_numpy() / 10 ** 6)[numpy.searchsorted(bands, rows)]
+        daily = values * (areas * self._to_kg_per_km2(1)).astype(values.dtype)
+        totals = numpy.nansum(daily, axis=0, dtype=float)
+        absolutes = numpy.nansum(numpy.abs(daily), axis=0, dtype=float)
+        squares = numpy.nansum((daily.astype(float) * TEMIS_CELL_UNCERTAINTY) ** 2, axis=0)
+        uncertainties = numpy.divide(squares ** 0.5, absolutes, out=numpy.zeros(len(cells)), where=absolutes > 0)
+        found.append((rows * spec.columns + columns, totals, uncertainties))
+
+        # 4. Sum up cells per block (cells are ordered block by block), block rows come first
+        def per_block(array: numpy.ndarray) -> numpy.ndarray:
+            starts = numpy.cumsum(sizes) - sizes
+            return numpy.add.reduceat(array, starts, axis=-1) if len(starts) else array[..., :0].astype(float)
+
+        missing = numpy.isnan(daily)
+        block_daily = per_block(numpy.where(missing, 0, daily))
+        block_daily[per_block(~missing) == 0] = numpy.nan
+        block_absolutes, block_squares = per_block(numpy.abs(totals)), per_block((totals * uncertainties) ** 2)
+        lats, longs = -90 + blocks[:, 0] * TEMIS_BIN_WIDTH, -180 + blocks[:, 1] * TEMIS_BIN_WIDTH
+        heights = blocks[:, 2] * TEMIS_BIN_WIDTH
+
+        columns = [f"{day} {pollutant.name} emissions [kg]" for day in numpy.datetime_as_string(period.days())]
+        block_grid = DataFrame(block_daily.T, columns=columns)
+        block_grid.insert(0, "Area [km²]", per_block(areas))
+        block_grid.insert(1, f"Total {pollutant.name} emissions [kg]", per_block(totals))
+        block_grid.insert(2, "Umin [%]", numpy.divide(block_squares ** 0.5, block_absolutes,
+                                                      out=numpy.zeros(len(blocks)), where=block_absolutes > 0))
+        block_grid.insert(3, "Umax [%]", block_grid["Umin [%]"])
+        block_grid.insert(4, "Number of values [1]", len(period) * sizes)
+        block_grid.insert(5, "Missing values [1]", per_block(missing).sum(axis=0).astype(int))
+        block_grid["Center latitude [°]"] = [f"{lat}" for lat in lats + heights / 2]
+        block_grid["Center longitude [°]"] = [f"{long}" for long in longs + heights / 2]
+        block_grid = GeoDataFrame(block_grid, geometry=shapely.box(longs, lats, longs + heights, lats + heights),
+                                  crs="EPSG:4326")
+
+        grid = GeoDataFrame(concat([block_grid, grid], ignore_index=True), crs="EPSG:4326")
+        return grid, tuple(numpy.concatenate(arrays) for arrays in zip(*found))
+
+    @staticmethod
+    def _quadtree(tile: MultiPolygon, size: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Cover tile with square blocks of cells fully inside it and single cells on its boundary.
+        Blocks start at size x size cells, aligned to multiples of size, and are split into four
+        recursively where they reach beyond the tile, so the number of geometries tested grows
+        with the boundary's length rather than the tile's area.
+
+        Parameters
+        ----------
+        tile: MultiPolygon
+            Area to cover.
+        size: int
+            Number of cells per side of the largest blocks, a power of two.
+
+        Returns
+        -------
+        tuple
+            Global row, column and number of cells per side of each block, as array of shape
+            (number of blocks, 3), and global row and column of each boundary cell, as array
+            of shape (number of cells, 2). Rows count from the south, columns from the west.
+        """
+        import numpy
+        import shapely
+
+        if size < 1 or size & (size - 1):
+            raise ValueError(f"Block size needs to be a power of two, got {size}!")
+
+        min_long, min_lat, max_long, max_lat = tile.bounds
+        rows = numpy.arange(math.floor((min_lat + 90) / TEMIS_BIN_WIDTH / size) * size,
+                            math.ceil((max_lat + 90) / TEMIS_BIN_WIDTH), size)
+        columns = numpy.arange(math.floor((min_long + 180) / TEMIS_BIN_WIDTH / size) * size,
+                               math.ceil((max_long + 180) / TEMIS_BIN_WIDTH), size)
+        rows, columns = (array.ravel() for array in numpy.meshgrid(rows, columns, indexing="ij"))
+        shapely.prepare(tile)
+
+        blocks, boundary = [], []
+        while len(rows):
+            lats, longs = -90 + rows * TEMIS_BIN_WIDTH, -180 + columns * TEMIS_BIN_WIDTH
+            boxes = shapely.box(longs, lats, longs + size * TEMIS_BIN_WIDTH, lats + size * TEMIS_BIN_WIDTH)
+            # Boxes only sharing an edge with the tile hold none of its area, and may lie outside its window
+            inside = shapely.covers(tile, boxes)
+            touching = shapely.intersects(tile, boxes) & ~shapely.touches(tile, boxes)
+            blocks.append(numpy.column_stack([rows[inside], columns[inside], numpy.full(inside.sum(), size)]))
+            rows, columns = rows[touching & ~inside], columns[touching & ~inside]
+            if size == 1:
+                boundary.append(numpy.column_stack([rows, columns]))
+                break
+            size //= 2
+            rows = numpy.concatenate([rows, rows, rows + size, rows + size])
+            columns = numpy.concatenate([columns, columns + size, columns, columns + size])
+
+        return (numpy.concatenate(blocks).astype(int) if blocks else numpy.empty((0, 3), dtype=int),
+                numpy.concatenate(boundary).astype(int) if boundary else numpy.empty((0, 2), dtype=int))
+
+    def _clip_grid(self, grid: GeoDataFrame, tile: MultiPolygon, region: MultiPolygon, months: numpy.ndarray,
+                   factors: numpy.ndarray, period: DateRange, pollutant: Pollutant) -> GeoDataFrame:
+        """Add per-day emission columns to grid cells with center columns, clip to tile, see _process_tile()."""
+        import numpy
+        from pandas import DataFrame, concat
+        from geopandas import GeoDataFrame, overlay
+
+        # 2. Look up the tile's cells in the month data read for the whole region
+        cells = self._cell_indices(grid, region)
+        # Here, values are actually raw TEMIS values, converted to [kg] along with the area below
+        columns = [f"{day} {pollutant.name} emissions [kg]" for day in numpy.datetime_as_string(period.days())]
+        values = self._decode(months[:, cells][period.month_index()])
+        if factors is not None:
+            bands = ((grid["Center latitude [°]"].astype(float) + 90) // TEMIS_BIN_WIDTH).astype(int).to_numpy()
+            values = values * factors[:, bands].astype(values.dtype)
+        days = DataFrame(values.T, columns=columns, index=grid.index)
+        grid = GeoDataFrame(concat([days, grid], axis=1), crs=grid.crs)
 
         # 3. Clip to actual region and add a data frame column with each cell's size
-        grid = overlay(grid, GeoDataFrame({"geometry": [region]}, crs="EPSG:4326"), how="intersection")
+        grid = overlay(grid, GeoDataFrame({"geometry": [tile]}, crs="EPSG:4326"), how="intersection")
         grid.insert(0, "Area [km²]", grid.to_crs(epsg=8857).area / 10 ** 6)  # Equal earth projection
 
-        # 4. Update emission columns by multiplying with the area value and sum it all up
-        grid.iloc[:, -(len(period)+3):-3] = grid.iloc[:, -(len(period)+3):-3].mul(grid["Area [km²]"], axis=0)
-        grid.insert(1, f"Total {pollutant.name} emissions [kg]", grid.iloc[:, -(len(period)+3):-3].sum(axis=1))
+        # 4. Update emission columns by converting to [kg/km²] and multiplying with the area value, sum it all up
+        daily = grid.iloc[:, -(len(period)+3):-3].to_numpy()
+        daily = daily * (grid["Area [km²]"].to_numpy() * self._to_kg_per_km2(1)).astype(daily.dtype)[:, numpy.newaxis]
+        grid.iloc[:, -(len(period)+3):-3] = daily
+        grid.insert(1, f"Total {pollutant.name} emissions [kg]", numpy.nansum(daily, axis=1, dtype=float))
         grid.insert(2, "Umin [%]", self._calculate_row_uncertainties(grid, period))
         grid.insert(3, "Umax [%]", grid["Umin [%]"])
         grid.insert(4, "Number of values [1]", len(period))
         grid.insert(5, "Missing values [1]", grid.iloc[:, -(len(period)+3):-3].isna().sum(axis=1))
 
-        # 5. Add GNFR table incl. uncertainties
+        return grid
+
+    def _create_table(self, grid: GeoDataFrame, pollutant: Pollutant) -> DataFrame:
+        """
+        Create GNFR table from clipped grid with emissions [kg] and uncertainties [%] in columns 1 and 2.
+        If proxies are set, the sector rows are filled by splitting each cell's emissions. The totals
+        row is always derived from the grid directly, the sectors share the cells' errors.
+        """
+        return self._create_cell_table(self._grid_cells(grid), grid.iloc[:, 1].to_numpy(),
+                                       grid.iloc[:, 2].to_numpy(), pollutant)
+
+    def _create_cell_table(self, cells: numpy.ndarray, totals: numpy.ndarray, uncertainties: numpy.ndarray,
+                           pollutant: Pollutant) -> DataFrame:
+        """Create GNFR table like _create_table() from global cell indices, emissions [kg] and uncertainties [%]."""
+        from pandas import Series
+
         table = self._create_gnfr_table(pollutant)
-        total_uncertainty = self._combine_uncertainties(grid.iloc[:, 1], grid.iloc[:, 2])
-        table.iloc[-1] = [grid.iloc[:, 1].sum() / 10**6, total_uncertainty, total_uncertainty]
+        if self._proxies is not None:
+            from eocalc.weighting import GridSpec
 
-        self._state = Status.READY
-        return {self.TOTAL_EMISSIONS_KEY: table, self.GRIDDED_EMISSIONS_KEY: grid}
+            sectors = self._proxies.split(cells, totals, uncertainties, GridSpec(TEMIS_BIN_WIDTH))
+            self._fill_gnfr_table(table, sectors * [10**-6, 1, 1])
+
+        umin = umax = self._combine_uncertainties(Series(totals), Series(uncertainties))
+        if self._monte_carlo is not None:
+            from eocalc.weighting import GridSpec
+
+            umin, umax = self._monte_carlo.bounds(cells, totals, uncertainties, GridSpec(TEMIS_BIN_WIDTH))
+        table.iloc[-1] = [totals.sum() / 10**6, umin, umax]
+        return table
+
+    @staticmethod
+    def _grid_cells(grid: GeoDataFrame) -> numpy.ndarray:
+        """Find global cell index (see eocalc.weighting.GridSpec) of each row in a clipped grid."""
+        from eocalc.weighting import GridSpec
+
+        return GridSpec(TEMIS_BIN_WIDTH).cells(grid["Center longitude [°]"].astype(float),
+                                               grid["Center latitude [°]"].astype(float))
+
+    @staticmethod
+    def _cell_indices(grid: GeoDataFrame, region: MultiPolygon) -> numpy.ndarray:
+        """Find position of each grid cell in the flat array returned by _read_toms_array() for region."""
+        import numpy
+
+        min_lat = region.bounds[1] - region.bounds[1] % TEMIS_BIN_WIDTH
+        min_long = region.bounds[0] - region.bounds[0] % TEMIS_BIN_WIDTH
+        longs = numpy.arange(-180, 180, TEMIS_BIN_WIDTH)
+        width = numpy.count_nonzero((min_long <= longs) & (longs < region.bounds[2]))
+
+        rows = (grid["Center latitude [°]"].astype(float) - TEMIS_BIN_WIDTH / 2 - min_lat) / TEMIS_BIN_WIDTH
+        columns = (grid["Center longitude [°]"].astype(float) - TEMIS_BIN_WIDTH / 2 - min_long) / TEMIS_BIN_WIDTH
+        return (rows.round().astype(int) * width + columns.round().astype(int)).to_numpy()
 
     @staticmethod
     def _read_toms_data(region: MultiPolygon, file: str) -> list[float]:
         # TODO Make this work with regions wrapping around to long < -180 or long > 180? TODO more stuff!
+        import numpy
+
         min_lat, max_lat = region.bounds[1] - region.bounds[1] % TEMIS_BIN_WIDTH, region.bounds[3]
         min_long, max_long = region.bounds[0] - region.bounds[0] % TEMIS_BIN_WIDTH,  region.bounds[2]
 
@@ -120,19 +629,196 @@ class TropomiMonthlyMeanAggregator(EOEmissionCalculator):
 
         return result
 
+    @staticmethod
+    def _read_toms_array(region: MultiPolygon, file: str) -> numpy.ndarray:
+        """
+        Read TOMS file values for the region's bounding box into a flat array. Works like
+        _read_toms_data(), i.e. returns the same values in the same order (bottom left to top
+        right, row by row), but parses whole latitude blocks at once. Invalid values are NaN.
+
+        Parameters
+        ----------
+        region: MultiPolygon
+            Area to read values for, only its bounds are used.
+        file: str
+            TOMS format file to read.
+
+        Returns
+        -------
+        numpy.ndarray
+            One-dimensional array of raw file values, one per cell [1e13 molecules/cm²].
+        """
+        import numpy
+
+        min_lat, max_lat = region.bounds[1] - region.bounds[1] % TEMIS_BIN_WIDTH, region.bounds[3]
+        columns = TropomiMonthlyMeanAggregator._window_columns(region)
+
+        rows = [values[columns] for _, values in TropomiMonthlyMeanAggregator._read_toms_rows(file, min_lat, max_lat)]
+        return numpy.concatenate(rows) if rows else numpy.empty(0)
+
+    @staticmethod
+    def _read_toms_grid(file: str) -> numpy.ndarray:
+        """
+        Read all TOMS file values into a global array with one row per latitude (south to north)
+        and one column per longitude (west to east). Latitudes missing in the file are NaN.
+
+        Parameters
+        ----------
+        file: str
+            TOMS format file to read.
+
+        Returns
+        -------
+        numpy.ndarray
+            Two-dimensional float32 array of raw file values [1e13 molecules/cm²].
+        """
+        import numpy
+
+        grid = numpy.full((round(180 / TEMIS_BIN_WIDTH), round(360 / TEMIS_BIN_WIDTH)), numpy.nan, dtype=numpy.float32)
+        for lat, values in TropomiMonthlyMeanAggregator._read_toms_rows(file, -90, 90):
+            grid[round((lat + 90) / TEMIS_BIN_WIDTH)] = values
+
+        return grid
+
+    @staticmethod
+    def _window(grid: numpy.ndarray, region: MultiPolygon) -> numpy.ndarray:
+        """Cut region's bounding box from global array created by _read_toms_grid(), result matches _read_toms_array()."""
+        import numpy
+
+        return grid[TropomiMonthlyMeanAggregator._window_rows(region)]\
+            [:, TropomiMonthlyMeanAggregator._window_columns(region)].ravel().astype(float)
+
+    @staticmethod
+    def _window_rows(region: MultiPolygon) -> numpy.ndarray:
+        """Select latitude rows of the region's bounding box, bottom to top, same logic as in _read_toms_array()."""
+        import numpy
+
+        min_lat, max_lat = region.bounds[1] - region.bounds[1] % TEMIS_BIN_WIDTH, region.bounds[3]
+        lats = numpy.arange(-90, 90, TEMIS_BIN_WIDTH)
+        return numpy.flatnonzero((min_lat <= lats) & (lats < max_lat))
+
+    @staticmethod
+    def _window_columns(region: MultiPolygon) -> numpy.ndarray:
+        """Select longitude columns of the region's bounding box, same logic as in _read_toms_data()."""
+        import numpy
+
+        min_long, max_long = region.bounds[0] - region.bounds[0] % TEMIS_BIN_WIDTH, region.bounds[2]
+        longs = numpy.arange(-180, 180, TEMIS_BIN_WIDTH)
+
+        return (min_long <= longs) & (longs < max_long)
+
+    @staticmethod
+    def _read_toms_rows(file: str, min_lat: float, max_lat: float) -> Iterator[tuple[float, numpy.ndarray]]:
+        """Yield lower latitude edge and all values of each latitude block in range, invalid values are NaN."""
+        import numpy
+
+        block: list[str] = []
+        lat = -91
+
+        def parse():
+            values = numpy.frombuffer("".join(block).encode(), dtype=f"S{TEMIS_VALUE_WIDTH}").astype(float)
+            values = values[:round(360 / TEMIS_BIN_WIDTH)]
+            values[values <= TEMIS_NAN_VALUE] = numpy.nan
+            block.clear()
+            return lat, values
+
+        with open(file, 'r') as data:
+            for line in data:
+                if line.startswith("lat="):
+                    if block:
+                        yield parse()
+                    lat = float(line.split('=')[1]) - TEMIS_BIN_WIDTH / 2
+                elif min_lat <= lat < max_lat and line[:4].strip().lstrip('-').isdigit():
+                    block.append(line.rstrip("\r\n"))
+            if block:
+                yield parse()
+
+    def _read_raw(self, region: MultiPolygon, day: date) -> numpy.ndarray:
+        """Read raw values for the region's bounding box like _read_values(), typed as set by the storage mode."""
+        import numpy
+
+        file = self._assure_data_availability(day)
+        return self._encode(self._read_toms_array(region, file) if self._cache is None
+                            else self._cache.window(region, file))
+
+    def _read_months(self, region: MultiPolygon, period: DateRange) -> numpy.ndarray:
+        """Read raw values for the region's bounding box like _read_raw(), one row per month in period."""
+        import numpy
+
+        return numpy.array([self._read_raw(region, month.start) for month in period.split_months()])
+
+    def _encode(self, values: numpy.ndarray) -> numpy.ndarray:
+        """Type raw values (invalid ones NaN) as set by the storage mode, reverted by _decode()."""
+        import numpy
+
+        if self._storage == "int16":
+            return numpy.where(numpy.isnan(values), TEMIS_INT16_NAN, values).astype(numpy.int16)
+        return values.astype(self._storage)
+
+    def _decode(self, raw: numpy.ndarray) -> numpy.ndarray:
+        """Turn values read by _read_raw() into floats, invalid values are NaN, float32 for compact storage modes."""
+        import numpy
+
+        if raw.dtype == numpy.int16:
+            return numpy.where(raw == TEMIS_INT16_NAN, numpy.float32(numpy.nan), raw.astype(numpy.float32))
+        return raw
+
+    def _read_values(self, region: MultiPolygon, day: date) -> numpy.ndarray:
+        """Read values [kg/km²] for the region's bounding box from the file covering given day, use cache if set."""
+        file = self._assure_data_availability(day)
+        values = self._read_toms_array(region, file) if self._cache is None else self._cache.window(region, file)
+        return self._to_kg_per_km2(values)
+
+    def _read_raw_cells(self, cells: numpy.ndarray, day: date) -> numpy.ndarray:
+        """
+        Read raw values for given global cells (see eocalc.weighting.GridSpec) from the file covering
+        given day, typed as set by the storage mode like _read_raw().
+        """
+        import numpy
+
+        file = self._assure_data_availability(day)
+        if self._cache is not None:
+            return self._encode(self._cache.get(file).ravel()[cells])
+        if len(cells) == 0:
+            return self._encode(numpy.empty(0))
+
+        # Only parse the latitude rows needed
+        columns = round(360 / TEMIS_BIN_WIDTH)
+        first, last = cells.min() // columns, cells.max() // columns
+        block = numpy.full((last - first + 1, columns), numpy.nan)
+        for lat, values in self._read_toms_rows(file, first * TEMIS_BIN_WIDTH - 90, (last + 1) * TEMIS_BIN_WIDTH - 90):
+            block[round((lat + 90) / TEMIS_BIN_WIDTH) - first] = values
+
+        return self._encode(block.ravel()[cells - first * columns])
+
+    @staticmethod
+    def _to_kg_per_km2(values):
+        """Convert TEMIS values [1e13 molecules/cm²] to NO2 mass per area [kg/km²], works on scalars and arrays."""
+        # value [1/cm²] * TEMIS scale [1] / Avogadro constant [1] * NO2 molecule weight [g] / to [kg] * to [km²]
+        return values * 10**13 / (6.022 * 10**23) * 46.01 / 1000 * 10**10
+
     @staticmethod
     def _assure_data_availability(day: date) -> str:
+        file = f"{LOCAL_DATA_FOLDER}/no2_{day:%Y%m}.asc"
+        return TropomiMonthlyMeanAggregator._fetch_data(
+            TEMIS_DOWNLOAD_URL % (f"{day:%Y}", f"{day:%m}", f"{day:%Y%m}"), file)
+
+    @staticmethod
+    def _fetch_data(url: str, file: str) -> str:
+        import gzip
+        import shutil
+        from urllib.request import urlretrieve
+
         def is_gz_file(filepath):
             with open(filepath, 'rb') as testfile:
                 return testfile.read(2) == b'\x1f\x8b'  # gzip 'magic number'
 
-        file = f"{LOCAL_DATA_FOLDER}/no2_{day:%Y%m}.asc"
-
-        with threading.Lock():
+        with _download_lock:
             if not os.path.isfile(f"{file}"):
+                os.makedirs(os.path.dirname(file), exist_ok=True)
                 if not os.path.isfile(f"{file}.original.gz"):
                     # TODO Handle HTTP errors
-                    urlretrieve(TEMIS_DOWNLOAD_URL % (f"{day:%Y}", f"{day:%m}", f"{day:%Y%m}"), f"{file}.original.gz")
+                    urlretrieve(url, f"{file}.original.gz")
 
                 # TODO Test this on different platforms, behaviours seem to differ!
                 with gzip.open(f"{file}.original.gz", 'rb') as compressed:
@@ -151,8 +837,195 @@ class TropomiMonthlyMeanAggregator(EOEmissionCalculator):
 
     def _calculate_row_uncertainties(self, grid, period) -> list[float]:
         # TODO It would be great to make this faster using clever iteration/numpy/CPython
+        from pandas import Series
+
         uncertainties = Series([TEMIS_CELL_UNCERTAINTY] * len(period))
         return [
             self._combine_uncertainties(row[-(len(period) + 3):-3], uncertainties)
             for _, row in grid.iterrows()
         ]
+
+
+class TropomiDailyAggregator(TropomiMonthlyMeanAggregator):
+    """
+    Aggregate daily TEMIS data. Days are streamed one at a time and only running per-cell sums
+    are kept, so memory use does not depend on the period length. The grid returned has no
+    per-day columns for that reason.
+    """
+
+    def __init__(self, cache: TemisDataCache = None, weights: WeightCache = None, proxies: SectorProxies = None,
+                 correction: Correction = None, storage: str = "float64", uncertainty: MonteCarlo = None):
+        """Create calculator, see TropomiMonthlyMeanAggregator. Days are not kept, so storage needs to be "float64"."""
+        if storage != "float64":
+            raise ValueError(f"Daily data is streamed, storage mode needs to be 'float64', got '{storage}'!")
+        super().__init__(cache, weights, proxies, correction, storage, uncertainty)
+
+    def run(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> dict[str, DataFrame]:
+        import numpy
+        from geopandas import GeoDataFrame, overlay
+
+        self._validate(region, period, pollutant)
+
+        # 1. Overlay area given with cells matching the TEMIS data set
+        grid = self._create_grid(region, TEMIS_BIN_WIDTH, TEMIS_BIN_WIDTH, snap=True, include_center_cols=True)
+
+        # 2. Stream the period day by day, only keeping the running sums per cell
+        totals, absolutes, squares, counts = self._accumulate(self._stream_days(region, period), len(grid))
+        self._lap("read")
+
+        # Here, values are actually [kg/km²], the area [km²] is applied after clipping below
+        grid.insert(0, f"Total {pollutant.name} emissions [kg]", totals)
+        grid.insert(1, "Umin [%]", numpy.divide(squares ** 0.5, absolutes, out=numpy.zeros(len(grid)),
+                                                where=absolutes > 0))
+        grid.insert(2, "Umax [%]", grid["Umin [%]"])
+        grid.insert(3, "Number of values [1]", len(period))
+        grid.insert(4, "Missing values [1]", len(period) - counts)
+
+        # 3. Clip to actual region and add a data frame column with each cell's size
+        grid = overlay(grid, GeoDataFrame({"geometry": [region]}, crs="EPSG:4326"), how="intersection")
+        grid.insert(0, "Area [km²]", grid.to_crs(epsg=8857).area / 10 ** 6)  # Equal earth projection
+        grid.iloc[:, 1] = grid.iloc[:, 1] * grid["Area [km²]"]
+        self._lap("grid")
+
+        # 4. Add GNFR table incl. uncertainties
+        table = self._create_table(grid, pollutant)
+        self._lap("table")
+
+        self._progress = 100
+        return {self.TOTAL_EMISSIONS_KEY: table, self.GRIDDED_EMISSIONS_KEY: grid}
+
+    def run_totals(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> EmissionTotals:
+        # The monthly implementation reads data per month, so fall back to streaming the days in run()
+        return EOEmissionCalculator.run_totals(self, region, period, pollutant)
+
+    def run_totals_many(self, regions: dict[str, MultiPolygon], periods: list[DateRange],
+                        pollutant: Pollutant) -> dict[tuple[str, DateRange], EmissionTotals]:
+        # Same as above, run each combination on its own
+        return {(name, period): self.run_totals(region, period, pollutant)
+                for name, region in regions.items() for period in periods}
+
+    def run_hierarchy(self, regions: dict[str, MultiPolygon], parents: dict[str, str], period: DateRange,
+                      pollutant: Pollutant) -> dict[str, DataFrame]:
+        # Parts are processed from data read per month, so fall back to running each region on its own
+        return EOEmissionCalculator.run_hierarchy(self, regions, parents, period, pollutant)
+
+    @classmethod
+    def prefetch(cls, period: DateRange):
+        for day in period:
+            cls._assure_data_availability(day)
+
+    def _stream_days(self, region: MultiPolygon, period: DateRange) -> Iterator[numpy.ndarray]:
+        """Yield one array of cell values [kg/km²] per day in period, reading the files lazily, corrected if set."""
+        import numpy
+        from eocalc.weighting import GridSpec
+
+        if self._correction is not None:
+            factors = self._correction.for_period(period, GridSpec(TEMIS_BIN_WIDTH))[:, self._window_rows(region)]
+        for count, day in enumerate(period):
+            values = self._read_values(region, day)
+            if self._correction is not None:
+                values = (values.reshape(factors.shape[1], -1) * factors[count][:, numpy.newaxis]).ravel()
+            yield values
+            self._progress = int(100 * (count + 1) / len(period))
+
+    @staticmethod
+    def _accumulate(days: Iterator[numpy.ndarray], size: int) -> tuple[numpy.ndarray, ...]:
+        """
+        Consume daily cell values and reduce them to per-cell running sums.
+
+        Parameters
+        ----------
+        days: Iterator[numpy.ndarray]
+            Cell values per day, invalid values are NaN.
+        size: int
+            Number of cells.
+
+        Returns
+        -------
+        tuple
+            Arrays of value sums, absolute value sums, squared uncertainty sums and valid value counts.
+        """
+        import numpy
+
+        totals, absolutes, squares = numpy.zeros(size), numpy.zeros(size), numpy.zeros(size)
+        counts = numpy.zeros(size, dtype=int)
+
+        for values in days:
+            valid = ~numpy.isnan(values)
+            values = numpy.where(valid, values, 0)
+            totals += values
+            absolutes += numpy.abs(values)
+            squares += (values * TEMIS_CELL_UNCERTAINTY) ** 2
+            counts += valid
+
+        return totals, absolutes, squares, counts
+
+    @staticmethod
+    def _assure_data_availability(day: date) -> str:
+        file = f"{LOCAL_DAILY_DATA_FOLDER}/no2_{day:%Y%m%d}.asc"
+        return TropomiMonthlyMeanAggregator._fetch_data(
+            TEMIS_DAILY_DOWNLOAD_URL % (f"{day:%Y}", f"{day:%m}", f"{day:%d}", f"{day:%Y%m%d}"), file)
+
+
+class TemisDataCache:
+    """
+    Keep decoded TEMIS files in memory, so each file is parsed only once and can be shared
+    between runs, calculators and threads. Concurrent requests for a file not loaded yet are
+    coalesced into a single load. Once more than max_files are held, the least recently used
+    file is dropped. Each file takes about 16 MB.
+    """
+
+    def __init__(self, max_files: int = TEMIS_CACHE_SIZE):
+        self._max_files = max_files
+        self._grids: OrderedDict[str, numpy.ndarray] = OrderedDict()
+        self._loading: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._grids)
+
+    def get(self, file: str) -> numpy.ndarray:
+        """
+        Get decoded file, load it if needed.
+
+        Parameters
+        ----------
+        file: str
+            TOMS format file to get values for.
+
+        Returns
+        -------
+        numpy.ndarray
+            Global array as created by TropomiMonthlyMeanAggregator._read_toms_grid(), do not change.
+        """
+        while True:
+            with self._lock:
+                if file in self._grids:
+                    self._grids.move_to_end(file)
+                    self.hits += 1
+                    return self._grids[file]
+                loading = self._loading.get(file)
+                if loading is None:
+                    loading = self._loading[file] = threading.Event()
+                    self.misses += 1
+                    break
+            loading.wait()  # Someone else is loading the file, check again once done
+
+        try:
+            grid = TropomiMonthlyMeanAggregator._read_toms_grid(file)
+            grid.setflags(write=False)
+            with self._lock:
+                self._grids[file] = grid
+                while len(self._grids) > self._max_files:
+                    self._grids.popitem(last=False)
+            return grid
+        finally:
+            with self._lock:
+                del self._loading[file]
+            loading.set()
+
+    def window(self, region: MultiPolygon, file: str) -> numpy.ndarray:
+        """Get values for the region's bounding box, like TropomiMonthlyMeanAggregator._read_toms_array()."""
+        return TropomiMonthlyMeanAggregator._window(self.get(file), region)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Discover emission calculation methods without importing them, select methods applicable to given input."""
+
+from __future__ import annotations
+
+import os
+import ast
+import importlib
+import importlib.util
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from eocalc.context import Pollutant
+
+if TYPE_CHECKING:
+    import numpy
+    from shapely.geometry import MultiPolygon
+    from eocalc.methods.base import DateRange
+
+# Package to look for emission calculation methods in
+METHODS_PACKAGE = "eocalc.methods"
+# Name of the class all emission calculation methods derive from
+BASE_CLASS = "EOEmissionCalculator"
+
+
+@dataclass(frozen=True)
+class MethodSpec:
+    """Point to an emission calculation method, allows for importing it on demand."""
+
+    name: str  # Class name
+    module: str  # Fully qualified name of the module defining the class
+
+    def load(self) -> type:
+        """
+        Import the method's module and get the class.
+
+        Returns
+        -------
+        type
+            The EOEmissionCalculator subclass.
+        """
+        return getattr(importlib.import_module(self.module), self.name)
+
+
+_specs: dict[str, dict[str, MethodSpec]] = {}
+_lock = threading.Lock()
+
+
+def discover(package: str = METHODS_PACKAGE) -> dict[str, MethodSpec]:
+    """
+    Find all non-abstract EOEmissionCalculator subclasses defined in the package's modules.
+
+    Modules are parsed, not imported, so neither the methods nor their dependencies are
+    loaded. Only direct base class names are followed, i.e. methods need to derive from
+    EOEmissionCalculator or from another method found in the package. Results are cached.
+
+    Parameters
+    ----------
+    package: str
+        Fully qualified name of the package to search. Defaults to METHODS_PACKAGE.
+
+    Returns
+    -------
+    dict
+        Method specs by class name, in alphabetical order.
+    """
+    with _lock:
+        if package not in _specs:
+            _specs[package] = _scan(package)
+
+        return dict(_specs[package])
+
+
+def load(name: str, package: str = METHODS_PACKAGE) -> type:
+    """
+    Import emission calculation method by class name. Raise KeyError if there is no such method.
+
+    Parameters
+    ----------
+    name: str
+        Class name as found by discover().
+    package: str
+        Fully qualified name of the package to search. Defaults to METHODS_PACKAGE.
+
+    Returns
+    -------
+    type
+        The EOEmissionCalculator subclass.
+    """
+    specs = discover(package)
+    if name not in specs:
+        raise KeyError(f"Unknown method '{name}', use one of {sorted(specs)}!")
+
+    return specs[name].load()
+
+
+class CapabilityIndex:
+    """
+    Index emission calculation methods by supported pollutant, availability window and coverage,
+    so the methods applicable to many regions can be found without checking every combination.
+
+    Coverage geometries are kept in an STRtree, each is only built once when the index is created.
+    Availability windows are taken from the methods at that time, too, so long-living processes
+    should create a new index once in a while. Region size is not considered, see
+    EOEmissionCalculator._validate() for the full check of the inputs.
+    """
+
+    def __init__(self, methods: list[type] = None):
+        """
+        Create index.
+
+        Parameters
+        ----------
+        methods: list
+            EOEmissionCalculator subclasses to index. Defaults to all methods found by discover().
+        """
+        import numpy
+        from shapely import STRtree
+
+        self.methods = [spec.load() for spec in discover().values()] if methods is None else list(methods)
+        self._pollutants = {pollutant: numpy.array([method.supports(pollutant) for method in self.methods], dtype=bool)
+                            for pollutant in Pollutant}
+        self._starts = numpy.array([method.earliest_start_date() for method in self.methods], dtype="datetime64[D]")
+        self._ends = numpy.array([method.latest_end_date() for method in self.methods], dtype="datetime64[D]")
+        self._lengths = numpy.array([method.minimum_period_length() for method in self.methods], dtype=int)
+        self._tree = STRtree([method.coverage() for method in self.methods])
+
+    def __len__(self) -> int:
+        return len(self.methods)
+
+    def query(self, region: MultiPolygon, period: DateRange, pollutant: Pollutant) -> list[type]:
+        """
+        Find methods applicable to given input.
+
+        Parameters
+        ----------
+        region: MultiPolygon
+            Area to calculate emissions for.
+        period: DateRange
+            Time span to cover.
+        pollutant: Pollutant
+            Air pollutant to calculate emissions for.
+
+        Returns
+        -------
+        list
+            Methods supporting the pollutant, available for the full period and covering the
+            region, in index order.
+        """
+        return self.query_many({None: region}, period, pollutant)[None]
+
+    def query_many(self, regions: dict, period: DateRange, pollutant: Pollutant) -> dict:
+        """
+        Find methods applicable to each of the regions given, all at once.
+
+        Parameters
+        ----------
+        regions: dict
+            Areas to calculate emissions for, by name.
+        period: DateRange
+            Time span to cover.
+        pollutant: Pollutant
+            Air pollutant to calculate emissions for.
+
+        Returns
+        -------
+        dict
+            List of applicable methods (see query()) per region name.
+        """
+        import numpy
+
+        applicable = self._pollutants[pollutant] & (self._lengths <= len(period)) & \
+            (self._starts <= numpy.datetime64(period.start, "D")) & (self._ends >= numpy.datetime64(period.end, "D"))
+        return {name: [self.methods[index] for index in indices]
+                for name, indices in zip(regions, self._covering(list(regions.values()), applicable))}
+
+    def covering(self, regions: dict) -> dict:
+        """
+        Find methods covering each of the regions given, like calling EOEmissionCalculator.covers() for each.
+
+        Parameters
+        ----------
+        regions: dict
+            Areas to check, by name.
+
+        Returns
+        -------
+        dict
+            List of methods covering the region per region name, in index order.
+        """
+        import numpy
+
+        return {name: [self.methods[index] for index in indices] for name, indices in
+                zip(regions, self._covering(list(regions.values()), numpy.ones(len(self.methods), dtype=bool)))}
+
+    def _covering(self, regions: list, candidates: numpy.ndarray) -> list[list[int]]:
+        """Query tree for all regions at once, only keep candidate methods, return method indices per region."""
+        import numpy
+
+        covered = numpy.zeros((len(regions), len(self.methods)), dtype=bool)
+        if regions and candidates.any():
+            # The tree returns pairs of region and method indices, "within" is the inverse of "contains"
+            pairs = self._tree.query(numpy.array(regions, dtype=object), predicate="within")
+            covered[pairs[0], pairs[1]] = True
+
+        return [numpy.flatnonzero(row).tolist() for row in covered & candidates]
+
+
+def _scan(package: str) -> dict[str, MethodSpec]:
+    directory = os.path.dirname(importlib.util.find_spec(package).origin)
+
+    classes: dict[str, ast.ClassDef] = {}
+    modules: dict[str, str] = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".py") and not file.startswith("_"):
+            with open(os.path.join(directory, file), 'r', encoding="utf-8") as source:
+                tree = ast.parse(source.read(), filename=file)
+            for node in tree.body:
+                if isinstance(node, ast.ClassDef):
+                    classes[node.name] = node
+                    modules[node.name] = f"{package}.{file[:-3]}"
+
+    # Track abstract methods down the class hierarchy, a class is a method if none are left
+    abstract: dict[str, set[str]] = {}
+
+    def abstract_methods(name: str) -> set[str]:
+        if name not in abstract:
+            abstract[name] = set()  # Guard against cyclic (i.e. broken) class hierarchies
+            defined = {item.name: _is_abstract(item) for item in classes[name].body
+                       if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))}
+            inherited = set().union(*(abstract_methods(base) for base in _base_names(classes[name]) if base in classes))
+            abstract[name] = {method for method in inherited if method not in defined} | \
+                {method for method, is_abstract in defined.items() if is_abstract}
+        return abstract[name]
+
+    def derives(name: str, visited: frozenset = frozenset()) -> bool:
+        return any(base == BASE_CLASS or (base in classes and base not in visited and derives(base, visited | {name}))
+                   for base in _base_names(classes[name]))
+
+    return {name: MethodSpec(name, modules[name]) for name in sorted(classes)
+            if derives(name) and not abstract_methods(name)}
+
+
+def _base_names(node: ast.ClassDef) -> list[str]:
+    return [base.id if isinstance(base, ast.Name) else base.attr for base in node.bases
+            if isinstance(base, (ast.Name, ast.Attribute))]
+
+
+def _is_abstract(function: ast.FunctionDef) -> bool:
+    return any(getattr(decorator, "id", getattr(decorator, "attr", None)) == "abstractmethod"
+               for decorator in function.decorator_list)
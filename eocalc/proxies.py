@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Split gridded emission totals across GNFR sectors using local proxy data."""
+
+from __future__ import annotations
+
+import os
+import json
+import math
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy
+
+from eocalc.context import GNFR
+from eocalc.weighting import GridSpec, SparseMatrix
+
+# Local directory with proxy files and the sector configuration
+LOCAL_PROXIES_FOLDER = "data/proxies"
+# Local directory we use to store proxies aligned to a grid
+LOCAL_CACHE_FOLDER = "data/cache/proxies"
+# File name endings of proxy rasters (ESRI ASCII grid format)
+RASTER_FILE_SUFFIXES = (".asc",)
+# File name endings of proxy point lists (CSV with columns longitude, latitude and weight)
+POINTS_FILE_SUFFIXES = (".csv",)
+# Sector emissions are assigned to if no proxy has a value in a cell
+DEFAULT_FALLBACK_SECTOR = GNFR.M_Other
+
+
+@dataclass(frozen=True)
+class Proxy:
+    """Represent the spatial distribution of a sector's emissions, read from a local file."""
+
+    file: str  # Raster (see RASTER_FILE_SUFFIXES) or point list (see POINTS_FILE_SUFFIXES)
+    uncertainty: float = 0  # Uncertainty of the distribution [%]
+
+
+class SectorProxies:
+    """
+    Split emissions per grid cell across GNFR sectors, proportional to each sector's proxy value
+    in the cell. Sectors without proxy get nothing, emissions in cells no proxy has a value for go
+    to the fallback sector.
+
+    Proxies are aligned to a grid once (by summing up their values per grid cell), then kept in
+    memory and as files in a local cache folder. The cache is invalidated when a proxy file changes.
+    Safe to share between threads and calculators.
+    """
+
+    def __init__(self, proxies: dict[GNFR, Proxy], fallback: GNFR = DEFAULT_FALLBACK_SECTOR,
+                 cache_folder: str = LOCAL_CACHE_FOLDER):
+        """
+        Create sector proxies.
+
+        Parameters
+        ----------
+        proxies: dict
+            Proxy per sector, multiple sectors can use the same file.
+        fallback: GNFR
+            Sector for emissions in cells without any proxy value. Defaults to DEFAULT_FALLBACK_SECTOR.
+        cache_folder: str
+            Directory to persist aligned proxies in, None to only keep them in memory.
+        """
+        for proxy in proxies.values():
+            if not str(proxy.file).endswith(RASTER_FILE_SUFFIXES + POINTS_FILE_SUFFIXES):
+                raise ValueError(f"Proxy file {proxy.file} needs to end on one of "
+                                 f"{RASTER_FILE_SUFFIXES + POINTS_FILE_SUFFIXES}!")
+
+        self.proxies = dict(proxies)
+        self.fallback = fallback
+        self._cache_folder = cache_folder
+        self._aligned: dict[str, tuple[numpy.ndarray, numpy.ndarray]] = {}
+        self._matrices: dict[GridSpec, SparseMatrix] = {}  # Proxies don't change once loaded
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, file: str = f"{LOCAL_PROXIES_FOLDER}/sectors.json", **kwargs) -> SectorProxies:
+        """
+        Load sector proxies from JSON file like {"F_RoadTransport": {"file": "roads.asc", "uncertainty": 20}}.
+        Files are relative to the configuration file, an optional key "fallback" names the fallback sector.
+
+        Parameters
+        ----------
+        file: str
+            Configuration file to read.
+        kwargs:
+            Passed on to the constructor.
+
+        Returns
+        -------
+        SectorProxies
+            Proxies as configured.
+        """
+        with open(file, 'r') as config_file:
+            config = json.load(config_file)
+
+        folder = os.path.dirname(file)
+        if "fallback" in config:
+            kwargs.setdefault("fallback", GNFR[config.pop("fallback")])
+        return cls({GNFR[sector]: Proxy(os.path.join(folder, entry["file"]), entry.get("uncertainty", 0))
+                    for sector, entry in config.items()}, **kwargs)
+
+    def aligned(self, grid: GridSpec) -> SparseMatrix:
+        """
+        Get all proxies aligned to grid.
+
+        Parameters
+        ----------
+        grid: GridSpec
+            Grid to align proxies to.
+
+        Returns
+        -------
+        SparseMatrix
+            Matrix of shape (number of GNFR sectors, number of grid cells) with the proxy value sums,
+            rows in GNFR order. Rows of sectors without proxy are empty. Built once per grid.
+        """
+        with self._lock:
+            if grid in self._matrices:
+                return self._matrices[grid]
+
+        rows, columns, data = [], [], []
+        for sector, proxy in self.proxies.items():
+            cells, values = self._align(proxy.file, grid)
+            rows.append(numpy.full(len(cells), list(GNFR).index(sector)))
+            columns.append(cells)
+            data.append(values)
+
+        matrix = SparseMatrix(numpy.concatenate(rows) if rows else [], numpy.concatenate(columns) if columns else [],
+                              numpy.concatenate(data) if data else [], (len(GNFR), len(grid)))
+        with self._lock:
+            return self._matrices.setdefault(grid, matrix)
+
+    def split(self, cells: numpy.ndarray, totals: numpy.ndarray, uncertainties: numpy.ndarray,
+              grid: GridSpec) -> numpy.ndarray:
+        """
+        Split emissions per cell across sectors and sum them up.
+
+        Sector shares are the proxy values' shares in each cell. Uncertainties of the cells and
+        of the proxies are combined per cell and sector (IPCC Guidelines formula 6.4 for products),
+        then per sector (formula 6.3), assuming independent cells.
+
+        Parameters
+        ----------
+        cells: numpy.ndarray
+            Grid cell index of each value, see GridSpec. The same cell might appear more than once.
+        totals: numpy.ndarray
+            Emissions per value.
+        uncertainties: numpy.ndarray
+            Uncertainty per value [%].
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (number of GNFR sectors, 3) with emission sums (same unit as totals) and
+            min/max uncertainties per sector, in GNFR order, ready for EOEmissionCalculator._fill_gnfr_table().
+        """
+        cells = numpy.asarray(cells, dtype=int)
+        totals, uncertainties = numpy.nan_to_num(totals), numpy.nan_to_num(uncertainties)
+
+        # 1. Look up proxy values of the cells given, one row per sector
+        aligned = self.aligned(grid)
+        unique, positions = numpy.unique(cells, return_inverse=True)
+        found = numpy.searchsorted(unique, aligned.columns)
+        matches = found < len(unique)
+        matches[matches] = unique[found[matches]] == aligned.columns[matches]
+        proxies = numpy.zeros((len(GNFR), len(unique)))
+        proxies[aligned.rows[matches], found[matches]] = aligned.data[matches]
+
+        # 2. Derive sector shares per cell, cells without proxy values go to the fallback sector
+        sums = proxies.sum(axis=0)
+        proxies[list(GNFR).index(self.fallback), sums <= 0] = 1
+        shares = (proxies / proxies.sum(axis=0))[:, positions]
+
+        # 3. Sum up per sector, propagating uncertainties
+        values = shares * totals
+        proxy_uncertainties = numpy.array([self.proxies[sector].uncertainty if sector in self.proxies else 0
+                                           for sector in GNFR])[:, numpy.newaxis]
+        squares = (values ** 2 * (uncertainties ** 2 + proxy_uncertainties ** 2)).sum(axis=1)
+        absolutes = numpy.abs(values).sum(axis=1)
+        combined = numpy.divide(squares ** 0.5, absolutes, out=numpy.zeros(len(GNFR)), where=absolutes > 0)
+
+        return numpy.column_stack([values.sum(axis=1), combined, combined])
+
+    def _align(self, file: str, grid: GridSpec) -> tuple[numpy.ndarray, numpy.ndarray]:
+        stat = os.stat(file)
+        key = hashlib.sha256(f"{os.path.abspath(file)}-{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest()
+        key = f"{key}-{grid.cell_size}"
+        cache = f"{self._cache_folder}/{key}.npz" if self._cache_folder else None
+
+        with self._lock:
+            if key in self._aligned:
+                return self._aligned[key]
+            if cache and os.path.isfile(cache):
+                with numpy.load(cache) as cached:
+                    self._aligned[key] = cached["cells"], cached["values"]
+                return self._aligned[key]
+
+        longs, lats, values = read_points(file) if str(file).endswith(POINTS_FILE_SUFFIXES) else \
+            _raster_points(*read_raster(file), grid)
+        aligned = align(longs, lats, values, grid)
+
+        if cache:
+            os.makedirs(self._cache_folder, exist_ok=True)
+            temporary = f"{cache}.{threading.get_ident()}.tmp"
+            with open(temporary, 'wb') as cached:
+                numpy.savez(cached, cells=aligned[0], values=aligned[1])
+            os.replace(temporary, cache)
+        with self._lock:
+            self._aligned[key] = aligned
+        return aligned
+
+
+def align(longs: numpy.ndarray, lats: numpy.ndarray, values: numpy.ndarray,
+          grid: GridSpec) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Sum up point values per grid cell.
+
+    Parameters
+    ----------
+    longs: numpy.ndarray
+        Point longitudes [degrees].
+    lats: numpy.ndarray
+        Point latitudes [degrees].
+    values: numpy.ndarray
+        Point values, missing values (NaN) and points outside the grid are ignored.
+    grid: GridSpec
+        Grid to align values to.
+
+    Returns
+    -------
+    tuple
+        Sorted array of cells with values (see GridSpec) and array with the value sum per cell.
+    """
+    cells, values = grid.cells(longs, lats), numpy.asarray(values, dtype=float)
+    valid = (cells >= 0) & ~numpy.isnan(values)
+
+    cells, positions = numpy.unique(cells[valid], return_inverse=True)
+    return cells, numpy.bincount(positions, weights=values[valid], minlength=len(cells))
+
+
+def read_raster(file: str) -> tuple[numpy.ndarray, float, float, float]:
+    """
+    Read raster in ESRI ASCII grid format.
+
+    Parameters
+    ----------
+    file: str
+        File to read.
+
+    Returns
+    -------
+    tuple
+        Values (rows south to north, missing values are NaN), longitude and latitude of the
+        lower left corner [degrees] and cell size [degrees].
+    """
+    header = {}
+    with open(file, 'r') as raster:
+        while len(header) < 6:
+            position = raster.tell()
+            line = raster.readline()
+            key, _, value = line.strip().partition(" ")
+            if not line or not key[:1].isalpha():
+                raster.seek(position)
+                break
+            header[key.lower()] = float(value)
+        values = numpy.loadtxt(raster, ndmin=2).reshape(int(header["nrows"]), int(header["ncols"]))
+
+    size = header["cellsize"]
+    long = header["xllcorner"] if "xllcorner" in header else header["xllcenter"] - size / 2
+    lat = header["yllcorner"] if "yllcorner" in header else header["yllcenter"] - size / 2
+    if "nodata_value" in header:
+        values[values == header["nodata_value"]] = numpy.nan
+
+    return values[::-1], long, lat, size
+
+
+def read_points(file: str) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Read point list from CSV file with header and columns longitude, latitude and weight.
+
+    Parameters
+    ----------
+    file: str
+        File to read.
+
+    Returns
+    -------
+    tuple
+        Arrays of longitudes [degrees], latitudes [degrees] and weights.
+    """
+    points = numpy.genfromtxt(file, delimiter=",", names=True, ndmin=1)
+    return points["longitude"], points["latitude"], points["weight"]
+
+
+def _raster_points(values: numpy.ndarray, long: float, lat: float, size: float,
+                   grid: GridSpec) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Turn raster cells into points, cells larger than grid cells are split evenly into sub-cell points."""
+    splits = max(math.ceil(size / grid.cell_size - 1e-9), 1)
+    offsets = (numpy.arange(splits) + .5) * size / splits
+    rows, columns = numpy.nonzero(~numpy.isnan(values))
+
+    longs = (long + columns * size)[:, numpy.newaxis, numpy.newaxis] + offsets[numpy.newaxis, numpy.newaxis, :]
+    lats = (lat + rows * size)[:, numpy.newaxis, numpy.newaxis] + offsets[numpy.newaxis, :, numpy.newaxis]
+    longs, lats = numpy.broadcast_arrays(longs, lats)
+    weights = numpy.broadcast_to((values[rows, columns] / splits ** 2)[:, numpy.newaxis, numpy.newaxis], longs.shape)
+
+    return longs.ravel(), lats.ravel(), weights.ravel()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Load, validate and cache regions to calculate emissions for."""
+
+from __future__ import annotations
+
+import os
+import json
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from shapely.geometry import MultiPolygon
+
+# Local directory with region GeoJSON files
+LOCAL_REGIONS_FOLDER = "data/regions"
+# Local directory we use to store parsed and simplified regions
+LOCAL_CACHE_FOLDER = "data/cache/regions"
+# File name endings of region files
+REGION_FILE_SUFFIXES = (".geo.json", ".geojson")
+# Default maximum relative area error allowed for simplified regions [1]
+MAX_AREA_ERROR = 0.001
+# Simplification tolerances tried per cell size, coarsest first [1]
+TOLERANCE_STEPS = (1 / 2, 1 / 4, 1 / 8, 1 / 16, 1 / 32)
+
+
+class RegionRegistry:
+    """
+    Provide regions from a directory of GeoJSON files, each file holding one feature.
+
+    Regions are parsed and validated only once, then kept in memory and as WKB in a local cache.
+    On request, simplified versions matching a calculation method's cell size are derived, so
+    operations like clipping do not need to work on vertex detail the grid cannot resolve.
+    """
+
+    def __init__(self, directory: str = LOCAL_REGIONS_FOLDER, cache_folder: str = LOCAL_CACHE_FOLDER):
+        self._directory = directory
+        self._cache_folder = cache_folder
+        self._regions: dict[tuple, MultiPolygon] = {}
+        self._lock = threading.RLock()
+
+    def names(self) -> list[str]:
+        """
+        List regions available.
+
+        Returns
+        -------
+        list
+            Region names, i.e. file names without suffix, in alphabetical order.
+        """
+        return sorted(file[:-len(suffix)] for file in os.listdir(self._directory)
+                      for suffix in REGION_FILE_SUFFIXES if file.endswith(suffix))
+
+    def get(self, name: str, cell_size: float = None, max_area_error: float = MAX_AREA_ERROR) -> MultiPolygon:
+        """
+        Get region by name.
+
+        Parameters
+        ----------
+        name: str
+            Region name as listed by names().
+        cell_size: float
+            Cell width and height of the method the region is meant for [degrees]. If given,
+            the simplest version of the region staying within the area error bound is returned.
+            Defaults to None, i.e. the region as given in the file.
+        max_area_error: float
+            Maximum area of the symmetric difference between simplified and original region,
+            relative to the original region's area [1]. Defaults to MAX_AREA_ERROR.
+
+        Returns
+        -------
+        MultiPolygon
+            Region geometry, valid and always a MultiPolygon.
+        """
+        key = (name, cell_size, max_area_error if cell_size else None)
+        with self._lock:
+            if key not in self._regions:
+                self._regions[key] = self._load(name) if cell_size is None else \
+                    self._load_simplified(name, cell_size, max_area_error)
+
+            return self._regions[key]
+
+    def _load(self, name: str) -> MultiPolygon:
+        from shapely import wkb
+        from shapely.geometry import shape
+
+        source = self._source_file(name)
+        cache = f"{self._cache_folder}/{name}.wkb"
+
+        if self._is_cache_valid(cache, source):
+            with open(cache, 'rb') as cached:
+                return wkb.loads(cached.read())
+
+        with open(source, 'r') as geojson_file:
+            region = self.validate(shape(json.load(geojson_file)["geometry"]), name)
+
+        self._write_cache(cache, region)
+        return region
+
+    def _load_simplified(self, name: str, cell_size: float, max_area_error: float) -> MultiPolygon:
+        from shapely import wkb
+
+        cache = f"{self._cache_folder}/{name}-{cell_size}-{max_area_error}.wkb"
+
+        if self._is_cache_valid(cache, self._source_file(name)):
+            with open(cache, 'rb') as cached:
+                return wkb.loads(cached.read())
+
+        region = self.simplify(self.get(name), cell_size, max_area_error)
+        self._write_cache(cache, region)
+        return region
+
+    def _source_file(self, name: str) -> str:
+        for suffix in REGION_FILE_SUFFIXES:
+            if os.path.isfile(f"{self._directory}/{name}{suffix}"):
+                return f"{self._directory}/{name}{suffix}"
+
+        raise KeyError(f"Unknown region '{name}', no such file in {self._directory}!")
+
+    @staticmethod
+    def _is_cache_valid(cache: str, source: str) -> bool:
+        return os.path.isfile(cache) and os.path.getmtime(cache) >= os.path.getmtime(source)
+
+    def _write_cache(self, cache: str, region: MultiPolygon):
+        from shapely import wkb
+
+        os.makedirs(self._cache_folder, exist_ok=True)
+        with open(f"{cache}.tmp", 'wb') as cached:
+            cached.write(wkb.dumps(region))
+        os.replace(f"{cache}.tmp", cache)
+
+    @staticmethod
+    def validate(region, name: str = "region") -> MultiPolygon:
+        """
+        Check region geometry. Raise ValueError in case of a problem.
+
+        Parameters
+        ----------
+        region:
+            Geometry to check, needs to be a valid and non-empty (multi-)polygon.
+        name: str
+            Name to use in error messages.
+
+        Returns
+        -------
+        MultiPolygon
+            The region, polygons are converted to multi-polygons.
+        """
+        from shapely.geometry import MultiPolygon, Polygon
+
+        if not isinstance(region, (Polygon, MultiPolygon)):
+            raise ValueError(f"Geometry of {name} needs to be a (multi-)polygon, got {region.geom_type}!")
+        if region.is_empty or not region.is_valid:
+            raise ValueError(f"Geometry of {name} is empty or invalid!")
+
+        return region if isinstance(region, MultiPolygon) else MultiPolygon([region])
+
+    @staticmethod
+    def simplify(region: MultiPolygon, cell_size: float, max_area_error: float = MAX_AREA_ERROR) -> MultiPolygon:
+        """
+        Simplify region as much as possible for given cell size, keeping the area error bounded.
+
+        Parameters
+        ----------
+        region: MultiPolygon
+            Area to simplify.
+        cell_size: float
+            Cell width and height of the grid the region will be clipped with [degrees].
+        max_area_error: float
+            Maximum area of the symmetric difference between simplified and original region,
+            relative to the original region's area [1].
+
+        Returns
+        -------
+        MultiPolygon
+            Simplified region, or the original one if no simplification stays within bounds.
+        """
+        from shapely.geometry import MultiPolygon, Polygon
+
+        for step in TOLERANCE_STEPS:
+            simplified = region.simplify(cell_size * step, preserve_topology=True)
+            if isinstance(simplified, Polygon):
+                simplified = MultiPolygon([simplified])
+            if isinstance(simplified, MultiPolygon) and simplified.is_valid and \
+                    region.symmetric_difference(simplified).area <= max_area_error * region.area:
+                return simplified
+
+        return region
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Persist and load emission calculation results."""
+
+import re
+import json
+
+import numpy
+from geopandas import GeoDataFrame, GeoSeries
+from pandas import DataFrame, concat
+
+from eocalc.context import GNFR
+from eocalc.methods.base import EOEmissionCalculator
+
+# GeoParquet specification version written to the file metadata
+GEOPARQUET_VERSION = "1.0.0"
+# Name of the list column holding all per-day emission values in files written
+DAILY_COLUMN = "Daily emissions [kg]"
+# Schema metadata key used to store the names of the per-day columns and the totals table
+METADATA_KEY = "eocalc"
+# File name endings of files to be written in Arrow IPC format, all other files will be Parquet
+ARROW_FILE_SUFFIXES = (".arrow", ".feather", ".ipc")
+# Per-day grid columns are named like "2018-08-01 NO2 emissions [kg]"
+DAY_COLUMN_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} ")
+
+
+def save(results: dict[str, DataFrame], file: str):
+    """
+    Write results of an emission calculation to file.
+
+    Files ending on one of ARROW_FILE_SUFFIXES are written in Arrow IPC format, all others
+    as GeoParquet. Geometries are stored as WKB, all per-day emission columns of the grid are
+    stored as a single fixed-size list column, the totals table is kept in the file metadata.
+    Requires pyarrow to be installed.
+
+    Parameters
+    ----------
+    results: dict
+        The emission values as returned by EOEmissionCalculator.run().
+    file: str
+        File to write to.
+    """
+    import pyarrow  # Optional dependency, only needed when writing results
+
+    grid = results[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY]
+    totals = results.get(EOEmissionCalculator.TOTAL_EMISSIONS_KEY)
+    table = _to_arrow(grid)
+    table = table.replace_schema_metadata({**table.schema.metadata, **_metadata(grid, totals)})
+
+    if str(file).endswith(ARROW_FILE_SUFFIXES):
+        with pyarrow.ipc.new_file(file, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, file)
+
+
+def load(file: str) -> dict[str, DataFrame]:
+    """
+    Read results of an emission calculation from file written by save() or GridWriter.
+
+    Parameters
+    ----------
+    file: str
+        File to read from, format is detected from the file name ending.
+
+    Returns
+    -------
+    dict
+        The emission values, grid and (if available) totals, like returned by EOEmissionCalculator.run().
+    """
+    import pyarrow
+
+    if str(file).endswith(ARROW_FILE_SUFFIXES):
+        with pyarrow.memory_map(str(file)) as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+    else:
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(file)
+
+    metadata = json.loads(table.schema.metadata[METADATA_KEY.encode()])
+    geometry = json.loads(table.schema.metadata[b"geo"])["primary_column"]
+
+    parts = []
+    for name, column in zip(table.column_names, table.columns):
+        if name == DAILY_COLUMN:
+            values = column.combine_chunks().flatten().to_numpy(zero_copy_only=False)
+            parts.append(DataFrame(values.reshape(len(table), len(metadata["days"])), columns=metadata["days"]))
+        elif name == geometry:
+            parts.append(GeoSeries.from_wkb(column.to_numpy(zero_copy_only=False), crs=metadata["crs"]).rename(name))
+        else:
+            parts.append(column.to_pandas().rename(name))
+
+    results = {EOEmissionCalculator.GRIDDED_EMISSIONS_KEY:
+               GeoDataFrame(concat(parts, axis=1), geometry=geometry, crs=metadata["crs"])}
+    if metadata.get("totals"):
+        totals = metadata["totals"]
+        results[EOEmissionCalculator.TOTAL_EMISSIONS_KEY] = DataFrame(
+            totals["data"], columns=totals["columns"],
+            index=[GNFR[name] if name in GNFR.__members__ else name for name in totals["index"]])
+
+    return results
+
+
+def _day_columns(grid: DataFrame) -> list[str]:
+    return [column for column in grid.columns if DAY_COLUMN_PATTERN.match(str(column))]
+
+
+def _to_arrow(grid: GeoDataFrame):
+    """Convert grid to Arrow table, collapsing per-day columns into one list column at their position."""
+    import pyarrow
+
+    days = _day_columns(grid)
+    names, arrays = [], []
+    for column in grid.columns:
+        if column == grid.geometry.name:
+            arrays.append(pyarrow.array(grid.geometry.to_wkb(), type=pyarrow.binary()))
+        elif column in days:
+            if column != days[0]:
+                continue
+            values = numpy.ascontiguousarray(grid[days].to_numpy(dtype=float)).ravel()
+            arrays.append(pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(values), len(days)))
+            column = DAILY_COLUMN
+        else:
+            arrays.append(pyarrow.array(grid[column]))
+        names.append(column)
+
+    geo = {"version": GEOPARQUET_VERSION, "primary_column": grid.geometry.name,
+           "columns": {grid.geometry.name: {"encoding": "WKB", "geometry_types": [],
+                                            "crs": grid.crs.to_json_dict() if grid.crs else None}}}
+    return pyarrow.Table.from_arrays(arrays, names=names, metadata={"geo": json.dumps(geo)})
+
+
+def _metadata(grid: GeoDataFrame, totals: DataFrame = None) -> dict[str, str]:
+    metadata = {"days": _day_columns(grid), "crs": grid.crs.to_string() if grid.crs else None, "totals": None}
+    if totals is not None:
+        metadata["totals"] = {"index": [str(name) for name in totals.index], "columns": list(totals.columns),
+                              "data": totals.to_numpy(dtype=float).tolist()}
+
+    return {METADATA_KEY: json.dumps(metadata)}
+
+
+class GridWriter:
+    """
+    Write gridded emission results to a GeoParquet file, one row group per call to write().
+
+    Allows for streaming large grids to disk part by part, e.g. tile by tile, without ever
+    holding the full grid in memory. All parts need to have the same columns. The file has
+    the same layout as the ones written by save(), but comes without totals. Requires
+    pyarrow to be installed.
+    """
+
+    def __init__(self, file: str):
+        import pyarrow.parquet  # Optional dependency, only needed when writing results
+
+        self._parquet = pyarrow.parquet
+        self._file = file
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, grid: GeoDataFrame):
+        """
+        Append grid rows to the file.
+
+        Parameters
+        ----------
+        grid: GeoDataFrame
+            Rows to add.
+        """
+        table = _to_arrow(grid)
+
+        if self._writer is None:
+            schema = table.schema.with_metadata({**table.schema.metadata, **_metadata(grid)})
+            self._writer = self._parquet.ParquetWriter(self._file, schema)
+
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        """Finish writing the file. No file is created if no rows were written."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
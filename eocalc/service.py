@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Serve emission calculations via a local HTTP/JSON interface, keeping data warm in memory."""
+
+import json
+import time
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy
+from shapely.geometry import shape
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, EOEmissionCalculator, EmissionTotals
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TropomiDailyAggregator, TemisDataCache
+from eocalc.weighting import WeightCache
+
+# Default address to listen on, only local connections are accepted
+DEFAULT_HOST = "127.0.0.1"
+# Default port to listen on
+DEFAULT_PORT = 8042
+# Number of most recent requests to derive latency metrics from
+LATENCY_WINDOW = 1000
+
+
+class EmissionService:
+    """
+    Run emission calculation methods on request. Each method is instantiated once and kept
+    for the whole life time of the service. TEMIS based methods share a WeightCache, the monthly
+    ones also share a TemisDataCache, while daily ones get their own. Thus, decoded data, area
+    weights, prepared coverage geometries and transformers stay warm between requests. By
+    default, all methods returning emission tables are served, see batch.find_methods().
+
+    Endpoints:
+        GET /methods lists the methods available,
+        GET /metrics reports request counts, latencies and cache statistics,
+        POST /run calculates emissions, expects a JSON object with keys "method" (class name),
+        "region" (GeoJSON geometry or feature), "period" ("START:END" or object with "start"
+        and "end"), "pollutant" (name) and optionally "grid" (boolean, defaults to false).
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 calculators: dict[str, EOEmissionCalculator] = None):
+        if calculators is None:
+            from eocalc.batch import find_methods
+
+            self.cache, self.weights = TemisDataCache(), WeightCache()
+            calculators = {}
+            for name, method in find_methods().items():
+                if issubclass(method, TropomiDailyAggregator):
+                    # Long daily periods would evict all warm monthly files from a shared cache
+                    calculators[name] = method(cache=TemisDataCache(), weights=self.weights)
+                elif issubclass(method, TropomiMonthlyMeanAggregator):
+                    calculators[name] = method(cache=self.cache, weights=self.weights)
+                else:
+                    calculators[name] = method()
+        else:
+            temis = [calculator for calculator in calculators.values()
+                     if isinstance(calculator, TropomiMonthlyMeanAggregator)]
+            self.cache = next((calculator._cache for calculator in temis), None)
+            self.weights = next((calculator._weights for calculator in temis), None)
+
+        self.calculators = calculators
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counts = {"requests": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL the service is reachable at."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "EmissionService":
+        """Start serving requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve requests in the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving requests and release the port."""
+        if self._thread:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def run(self, request: dict) -> dict:
+        """
+        Handle a calculation request.
+
+        Parameters
+        ----------
+        request: dict
+            Decoded JSON body of a POST /run request.
+
+        Returns
+        -------
+        dict
+            Response with totals, GNFR table and optionally the grid as GeoJSON.
+        """
+        if request.get("method") not in self.calculators:
+            raise ValueError(f"Unknown method {request.get('method')}, use one of {sorted(self.calculators)}!")
+        if "region" not in request or "period" not in request or "pollutant" not in request:
+            raise ValueError("Request needs to specify region, period and pollutant!")
+
+        calculator = self.calculators[request["method"]]
+        geometry = request["region"].get("geometry", request["region"])
+        period = request["period"]
+        period = DateRange(*period.split(":")) if isinstance(period, str) else DateRange(period["start"], period["end"])
+        try:
+            pollutant = Pollutant[request["pollutant"]]
+        except KeyError:
+            raise ValueError(f"Unknown pollutant {request['pollutant']}!")
+
+        if not request.get("grid", False):
+            return {"totals": vars(calculator.run_totals(shape(geometry), period, pollutant))}
+
+        from eocalc.results import _day_columns
+
+        results = calculator.run(shape(geometry), period, pollutant)
+        table = results[EOEmissionCalculator.TOTAL_EMISSIONS_KEY]
+        grid = results[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY]
+        return {"totals": vars(EmissionTotals.from_table(table)),
+                "table": {"index": [str(name) for name in table.index], "columns": list(table.columns),
+                          "data": table.to_numpy(dtype=float).tolist()},
+                "grid": json.loads(grid.drop(columns=_day_columns(grid)).to_json())}
+
+    def metrics(self) -> dict:
+        """
+        Report service statistics.
+
+        Returns
+        -------
+        dict
+            Request and error counts, latency statistics in seconds over the most recent
+            requests, and data cache statistics if available.
+        """
+        with self._lock:
+            latencies = numpy.array(self._latencies)
+            metrics = dict(self._counts)
+
+        if len(latencies):
+            metrics["latency"] = {"mean": latencies.mean(), "p50": numpy.percentile(latencies, 50),
+                                  "p95": numpy.percentile(latencies, 95), "max": latencies.max()}
+        if self.cache is not None:
+            metrics["cache"] = {"files": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses}
+        if self.weights is not None:
+            metrics["weights"] = {"regions": len(self.weights), "hits": self.weights.hits,
+                                  "misses": self.weights.misses}
+
+        return metrics
+
+    def _record(self, seconds: float, error: bool):
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts["errors"] += int(error)
+            self._latencies.append(seconds)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/methods":
+            self._respond(200, {"methods": sorted(service.calculators)})
+        elif self.path == "/metrics":
+            self._respond(200, service.metrics())
+        else:
+            self._respond(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/run":
+            return self._respond(404, {"error": f"Unknown path {self.path}"})
+
+        service, start = self.server.service, time.perf_counter()
+        try:
+            response, status = service.run(json.loads(self.rfile.read(int(self.headers["Content-Length"])))), 200
+        except (ValueError, TypeError, AttributeError) as error:
+            response, status = {"error": str(error)}, 400
+        except Exception as error:
+            response, status = {"error": f"{type(error).__name__}: {error}"}, 500
+
+        seconds = time.perf_counter() - start
+        service._record(seconds, status != 200)
+        self._respond(status, {**response, "metrics": {"seconds": seconds}})
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep quiet, see GET /metrics for what is going on
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m eocalc.service", description=__doc__)
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    arguments = parser.parse_args()
+
+    service = EmissionService(arguments.host, arguments.port)
+    print(f"Serving emission calculations at {service.url}, press Ctrl+C to stop")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.stop()
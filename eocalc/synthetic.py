@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic, full-size TEMIS TOMS files to work with offline: python -m eocalc.synthetic"""
+
+from __future__ import annotations
+
+import os
+import bz2
+import gzip
+import lzma
+from datetime import date
+
+import numpy
+
+from eocalc.corrections import day_length
+from eocalc.methods.naive import TEMIS_BIN_WIDTH, TEMIS_VALUES_PER_ROW, TEMIS_VALUE_WIDTH, TEMIS_NAN_VALUE
+
+# Local directory we write synthetic monthly files to, same layout as the downloaded ones
+SYNTHETIC_DATA_FOLDER = "data/synthetic/temis/tropomi/no2/monthly_mean"
+# Seed used if none is given, so everyone generates the same files
+SYNTHETIC_SEED = 2018
+# Number of point-like emission hot spots (cities, industrial areas, power plants) [1]
+SYNTHETIC_SOURCES = 500
+# Seasonal amplitude of the columns, highest in the hemisphere's winter [1]
+SYNTHETIC_SEASONALITY = .35
+# Share of cells missing at random, e.g. due to persistent cloud cover [1]
+SYNTHETIC_GAP_SHARE = .02
+# Cells with shorter mid-month day length have no retrieval, i.e. are missing (polar night) [h]
+SYNTHETIC_MINIMUM_DAY_LENGTH = 6
+# Compressions supported when writing files, mapped to the function opening such files
+COMPRESSIONS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+# Options used when writing compressed files, moderate levels: the highest take ten times as long for a few percent
+COMPRESSION_OPTIONS = {"gz": {"compresslevel": 6}, "bz2": {}, "xz": {"preset": 1}}
+
+
+def synthetic_columns(month: date, seed: int = SYNTHETIC_SEED) -> numpy.ndarray:
+    """
+    Create a realistic looking global field of monthly mean tropospheric NO2 columns.
+
+    Columns are a latitude dependent background plus Gaussian hot spots, both following the
+    seasons, with multiplicative and additive noise (so a few values are negative, as in the
+    real data). Cells in polar night and a small share of random cells are missing. Hot spots
+    only depend on the seed, noise and gaps on seed and month, so results are reproducible.
+
+    Parameters
+    ----------
+    month: date
+        Any day of the month to create columns for.
+    seed: int
+        Seed for the random number generators, defaults to SYNTHETIC_SEED.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (1440, 2880), rows south to north, columns west to east, integer values
+        [1e13 molecules/cm²] as float, missing values are NaN. Same layout as created by
+        TropomiMonthlyMeanAggregator._read_toms_grid().
+    """
+    lats = -90 + (numpy.arange(round(180 / TEMIS_BIN_WIDTH)) + .5) * TEMIS_BIN_WIDTH
+    longs = -180 + (numpy.arange(round(360 / TEMIS_BIN_WIDTH)) + .5) * TEMIS_BIN_WIDTH
+
+    # 1. Hot spots, mostly in the northern mid-latitudes, summed up as separable Gaussians
+    sources = numpy.random.default_rng(seed)
+    northern = sources.random(SYNTHETIC_SOURCES) < .7
+    source_lats = numpy.where(northern, sources.uniform(20, 58, SYNTHETIC_SOURCES),
+                              sources.uniform(-40, 20, SYNTHETIC_SOURCES))
+    source_longs = sources.uniform(-180, 180, SYNTHETIC_SOURCES)
+    widths = sources.lognormal(numpy.log(.4), .5, SYNTHETIC_SOURCES)  # [degrees]
+    peaks = sources.lognormal(numpy.log(150), 1, SYNTHETIC_SOURCES)
+
+    distances = (longs[:, numpy.newaxis] - source_longs + 180) % 360 - 180  # Wrap around the date line
+    spots = (numpy.exp(-((lats[:, numpy.newaxis] - source_lats) / widths) ** 2 / 2) * peaks) @ \
+        numpy.exp(-(distances / widths) ** 2 / 2).T
+
+    # 2. Background and seasons, each hemisphere peaks in its winter
+    background = 15 + 45 * numpy.exp(-((lats - 45) / 18) ** 2) + 10 * numpy.exp(-((lats + 25) / 15) ** 2)
+    seasons = 1 + SYNTHETIC_SEASONALITY * numpy.cos(2 * numpy.pi * (month.month - 1) / 12) * \
+        numpy.clip(lats / 30, -1, 1)
+    columns = (background[:, numpy.newaxis] + spots) * seasons[:, numpy.newaxis]
+
+    # 3. Noise and gaps
+    noise = numpy.random.default_rng([seed, month.year, month.month])
+    columns = columns * noise.lognormal(0, .15, columns.shape) + noise.normal(0, 8, columns.shape)
+    columns = numpy.clip(numpy.round(columns), TEMIS_NAN_VALUE + 1, 10 ** TEMIS_VALUE_WIDTH - 1)
+
+    middle = numpy.array([numpy.datetime64(month.replace(day=15), "D")])
+    columns[day_length(middle, lats)[0] < SYNTHETIC_MINIMUM_DAY_LENGTH] = numpy.nan
+    columns[noise.random(columns.shape) < SYNTHETIC_GAP_SHARE] = numpy.nan
+
+    return columns
+
+
+def write_toms_file(file: str, columns: numpy.ndarray, month: date, compression: str = None):
+    """
+    Write global columns in the TEMIS TOMS format, as read by TropomiMonthlyMeanAggregator.
+
+    Parameters
+    ----------
+    file: str
+        File to write, parent directories are created as needed.
+    columns: numpy.ndarray
+        Values as created by synthetic_columns(), NaN is written as TEMIS_NAN_VALUE.
+    month: date
+        Any day of the month the values are for, only used in the file header.
+    compression: str
+        One of COMPRESSIONS to compress the file, defaults to None, i.e. plain text.
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Compression needs to be one of {tuple(COMPRESSIONS)}, got '{compression}'!")
+
+    rows, width = columns.shape
+    values = numpy.where(numpy.isnan(columns), TEMIS_NAN_VALUE, columns).astype(int)
+    # Right-aligned values of fixed width can be viewed as whole lines of the file
+    text = numpy.char.rjust(values.astype(f"S{TEMIS_VALUE_WIDTH}"), TEMIS_VALUE_WIDTH)
+    lines = text.view(f"S{TEMIS_VALUE_WIDTH * TEMIS_VALUES_PER_ROW}").reshape(rows, -1)
+
+    header = (f"Synthetic TROPOMI monthly-mean tropospheric NO2 columns, version 1.0\n"
+              f"Year {month.year} Month {month.month:2d}, units: 1e13 molecules/cm2, undef={TEMIS_NAN_VALUE}\n"
+              f"Longitudes: {width:5d} bins centered on {180 - TEMIS_BIN_WIDTH / 2:.4f} W to "
+              f"{180 - TEMIS_BIN_WIDTH / 2:.4f} E  ({TEMIS_BIN_WIDTH:.3f} degree steps)\n"
+              f"Latitudes : {rows:5d} bins centered on {90 - TEMIS_BIN_WIDTH / 2:8.4f} S to "
+              f"{90 - TEMIS_BIN_WIDTH / 2:8.4f} N  ({TEMIS_BIN_WIDTH:.3f} degree steps)\n")
+
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    temporary = f"{file}.{os.getpid()}.tmp"
+    with COMPRESSIONS[compression](temporary, 'wb', **COMPRESSION_OPTIONS[compression]) if compression else \
+            open(temporary, 'wb') as output:
+        output.write(header.encode())
+        for row in range(rows):
+            output.write(f"lat={-90 + (row + .5) * TEMIS_BIN_WIDTH:10.4f}\n".encode())
+            output.write(b"\n".join(lines[row]) + b"\n")
+    os.replace(temporary, file)
+
+
+def temis_file(folder: str, month: date, compression: str = None) -> str:
+    """Name of the monthly file in folder, named like the downloaded ones plus the compression's suffix."""
+    return f"{folder}/no2_{month:%Y%m}.asc" + (f".{compression}" if compression else "")
+
+
+def generate(start: date, end: date, folder: str = SYNTHETIC_DATA_FOLDER, compression: str = None,
+             seed: int = SYNTHETIC_SEED, overwrite: bool = False) -> list[str]:
+    """
+    Write synthetic monthly files for all months from start to end.
+
+    Parameters
+    ----------
+    start: date
+        Any day of the first month.
+    end: date
+        Any day of the last month.
+    folder: str
+        Directory to write files to, defaults to SYNTHETIC_DATA_FOLDER.
+    compression: str
+        One of COMPRESSIONS, defaults to None, i.e. plain text files.
+    seed: int
+        Seed, see synthetic_columns().
+    overwrite: bool
+        Whether to re-create existing files, defaults to False.
+
+    Returns
+    -------
+    list
+        File per month, in chronological order.
+    """
+    months = numpy.arange(numpy.datetime64(start, "M"), numpy.datetime64(end, "M") + 1)
+
+    files = []
+    for month in months.astype("datetime64[D]").tolist():
+        files.append(temis_file(folder, month, compression))
+        if overwrite or not os.path.isfile(files[-1]):
+            write_toms_file(files[-1], synthetic_columns(month, seed), month, compression)
+
+    return files
+
+
+def main(argv: list[str] = None) -> int:
+    """Command line entry point, see "python -m eocalc.synthetic --help"."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m eocalc.synthetic", description=__doc__)
+    parser.add_argument("start", type=date.fromisoformat, help="any day of the first month, like 2019-01-01")
+    parser.add_argument("end", type=date.fromisoformat, help="any day of the last month, like 2019-12-01")
+    parser.add_argument("-o", "--output", default=SYNTHETIC_DATA_FOLDER, help="directory to write files to")
+    parser.add_argument("-c", "--compression", nargs="*", default=[], choices=list(COMPRESSIONS),
+                        help="also write compressed variants of each file")
+    parser.add_argument("-s", "--seed", type=int, default=SYNTHETIC_SEED, help="random seed")
+    parser.add_argument("--overwrite", action="store_true", help="re-create existing files")
+    arguments = parser.parse_args(argv)
+
+    for compression in [None] + arguments.compression:
+        files = generate(arguments.start, arguments.end, arguments.output, compression, arguments.seed,
+                         arguments.overwrite)
+        print(f"Wrote {len(files)} {compression or 'plain'} file(s) to {arguments.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 import pytest
+import copy
+import pickle
+import time
+import threading
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 from pandas import Series
-from shapely.geometry import MultiPolygon, shape
+from shapely.geometry import MultiPolygon, shape, box
 
 from eocalc.context import Pollutant, GNFR
-from eocalc.methods.base import DateRange, EOEmissionCalculator
+from eocalc.methods.base import DateRange, EOEmissionCalculator, EmissionTotals, RunHandle, RunCancelled, Status
 
 
 @pytest.fixture
@@ -81,10 +86,60 @@ class TestDataRange:
     def test_bad_period(self):
         with pytest.raises(ValueError):
             DateRange(start="2019-01-01", end="2018-12-31")
-        with pytest.raises(ValueError):
-            DateRange(start="2019-01-01", end="2019-12-31").end = "2018-12-31"
-        with pytest.raises(ValueError):
-            DateRange(start="2019-01-01", end="2019-12-31").start = "2020-12-31"
+
+    def test_immutable(self, year_2019_from_strs):
+        with pytest.raises(AttributeError):
+            year_2019_from_strs.end = "2018-12-31"
+        with pytest.raises(AttributeError):
+            year_2019_from_strs.start = "2019-02-01"
+        with pytest.raises(AttributeError):
+            del year_2019_from_strs.start
+        with pytest.raises(AttributeError):
+            year_2019_from_strs.other = 42
+        assert DateRange("2019-01-01", "2019-12-31") == year_2019_from_strs
+        assert year_2019_from_strs == pickle.loads(pickle.dumps(year_2019_from_strs))
+        assert year_2019_from_strs == copy.deepcopy(year_2019_from_strs)
+
+    def test_days(self, year_2020, one_day):
+        assert 366 == len(year_2020.days())
+        assert [numpy.datetime64(day, "D") for day in year_2020] == list(year_2020.days())
+        assert [numpy.datetime64("2018-08-01")] == list(one_day.days())
+
+    @pytest.mark.parametrize("start, end, months, counts", [
+        ("2018-08-01", "2018-08-31", ["2018-08"], [31]),
+        ("2018-08-01", "2018-08-01", ["2018-08"], [1]),
+        ("2018-08-15", "2018-10-03", ["2018-08", "2018-09", "2018-10"], [17, 30, 3]),
+        ("2019-12-31", "2020-03-01", ["2019-12", "2020-01", "2020-02", "2020-03"], [1, 31, 29, 1]),
+        ("0001-01-01", "0001-01-02", ["0001-01"], [2]),
+        ("9999-12-30", "9999-12-31", ["9999-12"], [2])
+    ])
+    def test_months(self, start, end, months, counts):
+        period = DateRange(start, end)
+        assert [numpy.datetime64(month, "M") for month in months] == list(period.months()[0])
+        assert counts == list(period.months()[1])
+        assert len(period) == len(period.month_index())
+        assert counts == list(numpy.bincount(period.month_index()))
+        assert [day.isoformat()[:7] for day in period] == [months[index] for index in period.month_index()]
+
+    def test_contains(self, august_2018):
+        assert date.fromisoformat("2018-08-01") in august_2018
+        assert date.fromisoformat("2018-08-31") in august_2018
+        assert date.fromisoformat("2018-09-01") not in august_2018
+
+    def test_intersection(self, year_2019_from_strs, year_2020, august_2018):
+        assert year_2019_from_strs.intersection(year_2020) is None
+        assert august_2018 == august_2018.intersection(august_2018)
+        assert DateRange("2019-12-01", "2020-01-31").intersection(year_2020) == DateRange("2020-01-01", "2020-01-31")
+        assert year_2020.intersection(DateRange("2019-12-31", "2020-01-01")) == DateRange("2020-01-01", "2020-01-01")
+
+    def test_split_months(self, year_2020, august_2018):
+        assert [august_2018] == august_2018.split_months()
+        assert 12 == len(year_2020.split_months())
+        assert DateRange("2020-02-01", "2020-02-29") == year_2020.split_months()[1]
+        parts = DateRange("2019-12-31", "2020-02-01").split_months()
+        assert [DateRange("2019-12-31", "2019-12-31"), DateRange("2020-01-01", "2020-01-31"),
+                DateRange("2020-02-01", "2020-02-01")] == parts
+        assert list(DateRange("2019-12-31", "2020-02-01")) == [day for part in parts for day in part]
 
 
 @pytest.fixture
@@ -269,6 +324,30 @@ class TestCalcMethods:
             assert frame.iloc[:, 1].name.startswith("Umin")
             assert frame.iloc[:, 2].name.startswith("Umax")
 
+    def test_create_gnfr_frame_is_copy(self, calc):
+        frame = calc._create_gnfr_table(Pollutant.NO2)
+        frame.iloc[:, :] = 42
+        assert calc._create_gnfr_table(Pollutant.NO2).isna().all().all()
+        assert calc._create_gnfr_table(Pollutant.NO2) is not calc._create_gnfr_table(Pollutant.NO2)
+
+    def test_fill_gnfr_frame(self, calc):
+        sectors = numpy.array([[10., 2., 4.]] * len(GNFR))
+        frame = calc._fill_gnfr_table(calc._create_gnfr_table(Pollutant.SO2), sectors)
+        assert numpy.array_equal(sectors, frame.iloc[:-1].to_numpy())
+        assert 10 * len(GNFR) == frame.loc["Totals"].iloc[0]
+        assert calc._combine_uncertainties(Series(sectors[:, 0]), Series(sectors[:, 1])) == frame.loc["Totals"].iloc[1]
+        assert calc._combine_uncertainties(Series(sectors[:, 0]), Series(sectors[:, 2])) == frame.loc["Totals"].iloc[2]
+
+        with pytest.raises(ValueError):
+            calc._fill_gnfr_table(calc._create_gnfr_table(Pollutant.SO2), sectors[1:])
+
+    def test_emission_totals(self, calc):
+        frame = calc._create_gnfr_table(Pollutant.NO2)
+        frame.loc["Totals"] = [42, 1, 2]
+        assert EmissionTotals(42., 1., 2.) == EmissionTotals.from_table(frame)
+        with pytest.raises(AttributeError):
+            EmissionTotals.from_table(frame).value = 0
+
     @pytest.mark.parametrize(
         "values, uncertainties, result", [
             (Series(10), Series(2), 2),
@@ -370,3 +449,147 @@ class TestCalcMethods:
         ])
     def test_create_grid_well_known(self, calc, width, height, snap, region_small_but_well_known, cell_count):
         assert cell_count == len(calc._create_grid(region_small_but_well_known, width, height, snap=snap))
+
+    @pytest.mark.parametrize(
+        "size, tile_count", [
+            (10, 1),
+            (1, 1),
+            (.5, 4),
+            (.25, 16)
+        ])
+    def test_create_tiles(self, calc, size, tile_count, region_box_north_of_equator):
+        tiles = calc._create_tiles(region_box_north_of_equator, size)
+        assert tile_count == len(tiles)
+        assert sum(tile.area for tile in tiles) == pytest.approx(region_box_north_of_equator.area)
+
+    def test_create_tiles_drops_empty(self, calc, region_sample_north):
+        tiles = calc._create_tiles(region_sample_north, 10)
+        assert len(tiles) < len(calc._create_grid(region_sample_north, 10, 10, snap=True))
+        assert all(isinstance(tile, MultiPolygon) for tile in tiles)
+        assert sum(tile.area for tile in tiles) == pytest.approx(region_sample_north.area)
+
+    def test_create_tiles_bad_size(self, calc, region_box_north_of_equator):
+        with pytest.raises(ValueError):
+            calc._create_tiles(region_box_north_of_equator, 0)
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "Condition not met in time"
+        time.sleep(.001)
+
+
+@pytest.fixture
+def stepper(calc):
+    class Stepper(type(calc)):
+        """Report progress in steps, waiting for the test to let each step pass."""
+
+        def __init__(self):
+            super().__init__()
+            self.gates = [threading.Event() for _ in range(3)]
+
+        def run(self, region=None, period=None, pollutant=None):
+            for step, gate in enumerate(self.gates):
+                assert gate.wait(5)
+                self._progress = 100 * (step + 1) // len(self.gates)
+                self._lap(f"step {step}")
+            return self.progress
+
+    return Stepper()
+
+
+class TestRunHandles:
+
+    def test_handle(self, stepper):
+        handle = RunHandle()
+        assert (Status.READY, 0, {}) == (handle.state, handle.progress, handle.timings)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(stepper.run, handle=handle)
+            stepper.gates[0].set()
+            wait_until(lambda: handle.progress == 33)
+            assert Status.RUNNING == handle.state == stepper.state
+            for gate in stepper.gates[1:]:
+                gate.set()
+            assert 100 == future.result()
+
+        assert (Status.READY, 100, None) == (handle.state, handle.progress, handle.error)
+        assert ["step 0", "step 1", "step 2", "total"] == sorted(handle.timings)
+        assert handle.timings["total"] >= sum(handle.timings[f"step {step}"] for step in range(3))
+        assert 100 == stepper.progress  # Last run started
+
+    def test_concurrent_runs(self, stepper):
+        handles = [RunHandle(), RunHandle()]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(stepper.run, handle=handle) for handle in handles]
+            stepper.gates[0].set()
+            wait_until(lambda: all(handle.progress == 33 for handle in handles))
+            assert [33, 33] == [handle.progress for handle in handles]
+            stepper.gates[1].set()
+            stepper.gates[2].set()
+            assert [100, 100] == [future.result() for future in futures]
+
+    def test_cancel(self, stepper):
+        handle = RunHandle()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(stepper.run, handle=handle)
+            handle.cancel()
+            stepper.gates[0].set()
+            with pytest.raises(RunCancelled):
+                future.result()
+
+        assert (Status.CANCELLED, True, 33) == (handle.state, handle.cancelled, handle.progress)
+        assert isinstance(handle.error, RunCancelled)
+        with pytest.raises(RunCancelled):
+            stepper.run(handle=handle)  # Cancelled before start
+
+    def test_nested_runs_share_handle(self, stepper):
+        handle = RunHandle()
+        for gate in stepper.gates:
+            gate.set()
+        with pytest.raises(TypeError):  # Base run_totals() calls run(), which does not return tables here
+            stepper.run_totals(None, None, None, handle=handle)
+
+        assert (Status.READY, 100) == (handle.state, handle.progress)
+        assert isinstance(handle.error, TypeError)
+        assert "step 2" in handle.timings
+        assert stepper._last_run is handle
+
+
+class TestHierarchy:
+
+    @pytest.fixture
+    def regions(self):
+        return {"root": box(0, 0, 4, 2), "left": box(0, 0, 2, 2), "right": box(2, 0, 4, 2), "corner": box(3, 0, 4, 1),
+                "other": box(10, 10, 11, 11)}
+
+    @pytest.fixture
+    def parents(self):
+        return {"left": "root", "right": "root", "corner": "right"}
+
+    def test_hierarchy(self, calc, regions, parents):
+        children = calc._hierarchy(regions, parents)
+        assert set(regions) == set(children)
+        assert ["left", "right"] == children["root"] and ["corner"] == children["right"] and [] == children["other"]
+        order = list(children)
+        assert order.index("corner") < order.index("right") < order.index("root")
+        assert order.index("left") < order.index("root")
+
+    @pytest.mark.parametrize("parents", [
+        {"left": "root", "right": "root", "corner": "left"},  # Outside parent
+        {"left": "root", "right": "root", "corner": "root"},  # Overlapping siblings
+        {"left": "root", "root": "left"},  # Cycle
+        {"left": "nowhere"}
+    ])
+    def test_bad_hierarchy(self, calc, regions, parents):
+        with pytest.raises(ValueError):
+            calc._hierarchy(regions, parents)
+
+    def test_run_hierarchy(self, calc, regions, parents):
+        class AreaCalculator(type(calc)):
+            def run(self, region=None, period=None, pollutant=None):
+                return {self.TOTAL_EMISSIONS_KEY: region.area}
+
+        tables = AreaCalculator().run_hierarchy(regions, parents, None, None)
+        assert {name: region.area for name, region in regions.items()} == tables
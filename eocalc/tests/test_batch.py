@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import pytest
+import json
+from datetime import date
+
+from pandas import read_csv
+
+from eocalc.context import Pollutant
+from eocalc.batch import Job, find_methods, load_regions, parse_period, monthly_periods, plan, run, \
+    read_journal, main, calculator, JOURNAL_FILE
+from eocalc.methods.base import DateRange
+from eocalc.methods.dummy import DummyEOEmissionCalculator
+from eocalc.methods.fluky import RandomEOEmissionCalculator
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+
+
+@pytest.fixture
+def regions():
+    return load_regions(["data/regions/roughly_saxonia.geo.json", "data/regions/portugal_envelope.geo.json"])
+
+
+@pytest.fixture
+def periods():
+    return [DateRange("2019-01-01", "2019-01-31"), DateRange("2019-02-01", "2019-02-28")]
+
+
+class TestPlanning:
+
+    def test_find_methods(self):
+        methods = find_methods()
+        assert RandomEOEmissionCalculator is methods["RandomEOEmissionCalculator"]
+        assert TropomiMonthlyMeanAggregator is methods["TropomiMonthlyMeanAggregator"]
+        assert "EOEmissionCalculator" not in methods
+        assert "DummyEOEmissionCalculator" not in methods  # Returns no tables
+
+    def test_load_regions(self):
+        assert {"roughly_saxonia"} == set(load_regions(["data/regions/roughly_saxonia.geo.json"]))
+        assert len(load_regions(["data/regions"])) == len(load_regions(["data/regions/"]))
+        assert "germany" in load_regions(["data/regions"])
+        with pytest.raises(ValueError):
+            load_regions(["README.md"])
+
+    @pytest.mark.parametrize("text, period", [
+        ("2018-08-01:2018-08-31", DateRange("2018-08-01", "2018-08-31")),
+        ("2018-08-01", DateRange("2018-08-01", "2018-08-01"))
+    ])
+    def test_parse_period(self, text, period):
+        assert period == parse_period(text)
+
+    @pytest.mark.parametrize("start, end, count, first", [
+        ("2018-02-01", "2018-12-31", 11, DateRange("2018-02-01", "2018-02-28")),
+        ("2018-02-02", "2018-12-30", 9, DateRange("2018-03-01", "2018-03-31")),
+        ("2019-12-01", "2020-02-29", 3, DateRange("2019-12-01", "2019-12-31")),
+        ("2020-02-02", "2020-02-28", 0, None),
+        ("9999-01-01", "9999-12-31", 12, DateRange("9999-01-01", "9999-01-31")),
+        ("9999-12-02", "9999-12-31", 0, None)
+    ])
+    def test_monthly_periods(self, start, end, count, first):
+        periods = monthly_periods(date.fromisoformat(start), date.fromisoformat(end))
+        assert count == len(periods)
+        assert not periods or first == periods[0]
+        assert all(b.start - a.end == date.fromisoformat("2000-01-02") - date.fromisoformat("2000-01-01")
+                   for a, b in zip(periods, periods[1:]))
+
+    def test_plan(self, regions, periods):
+        methods = [RandomEOEmissionCalculator, TropomiMonthlyMeanAggregator]
+        jobs = plan(methods, regions, {method: periods for method in methods}, [Pollutant.NO2, Pollutant.SO2])
+
+        assert 2 * 2 * 2 + 2 * 2 == len(jobs)
+        assert all(job.method is RandomEOEmissionCalculator or job.pollutant == Pollutant.NO2 for job in jobs)
+        assert len(jobs) == len({job.name for job in jobs})
+        with pytest.raises(ValueError, match="does not return emission tables"):
+            plan([DummyEOEmissionCalculator], regions, {DummyEOEmissionCalculator: periods}, [Pollutant.NO2])
+
+    def test_plan_validates_regions_once(self, regions, periods, monkeypatch):
+        checked = []
+        monkeypatch.setattr(RandomEOEmissionCalculator, "_validate_region", lambda self, region: checked.append(region))
+        jobs = plan([RandomEOEmissionCalculator], regions, {RandomEOEmissionCalculator: periods},
+                    [Pollutant.NO2, Pollutant.SO2])
+        assert 2 * 2 * 2 == len(jobs)
+        assert list(regions.values()) == checked
+
+    def test_job_name(self, regions, periods):
+        job = Job(RandomEOEmissionCalculator, "roughly_saxonia", regions["roughly_saxonia"], periods[0], Pollutant.NO2)
+        assert "RandomEOEmissionCalculator_roughly_saxonia_2019-01-01_2019-01-31_NO2" == job.name
+
+
+class TestRunning:
+
+    @pytest.fixture
+    def jobs(self, regions, periods):
+        return plan([RandomEOEmissionCalculator], {"roughly_saxonia": regions["roughly_saxonia"]},
+                    {RandomEOEmissionCalculator: periods}, [Pollutant.NO2, Pollutant.NH3])
+
+    def test_run(self, jobs, tmp_path):
+        records = run(jobs, tmp_path, "csv")
+        assert 4 == len(records)
+        assert all(record["status"] == "done" for record in records)
+        for record in records:
+            assert record["value"] == pytest.approx(read_csv(record["file"], index_col=0).loc["Totals"].iloc[0])
+            assert 0 < record["timings"]["total"] <= record["seconds"]
+        assert calculator(RandomEOEmissionCalculator) is calculator(RandomEOEmissionCalculator)
+
+    def test_run_parquet_in_parallel(self, jobs, tmp_path):
+        pytest.importorskip("pyarrow")
+        from eocalc.results import load
+
+        records = run(jobs, tmp_path, "parquet", workers=2)
+        assert 4 == len(records)
+        for record in records:
+            assert record["value"] == pytest.approx(load(record["file"])["totals"].loc["Totals"].iloc[0])
+
+    def test_resume(self, jobs, tmp_path):
+        run(jobs[:1], tmp_path, "csv")
+        with open(tmp_path / JOURNAL_FILE, 'a') as journal:
+            journal.write('{"job": "incomplete line from crash", "sta')
+
+        records = run(jobs, tmp_path, "csv")
+        assert {job.name for job in jobs[1:]} == {record["job"] for record in records}
+        assert 0 == len(run(jobs, tmp_path, "csv"))
+        assert 4 == len(read_journal(tmp_path))
+
+    def test_failed_job_is_retried(self, regions, periods, tmp_path):
+        # Planning rejects the dummy, its runs fail for not returning tables
+        jobs = [Job(DummyEOEmissionCalculator, "roughly_saxonia", regions["roughly_saxonia"], periods[0],
+                    Pollutant.NO2)]
+        assert "failed" == run(jobs, tmp_path, "csv")[0]["status"]
+        assert 1 == len(run(jobs, tmp_path, "csv"))
+        assert not list(tmp_path.glob("*.csv"))
+
+    def test_bad_format(self, jobs, tmp_path):
+        with pytest.raises(ValueError):
+            run(jobs, tmp_path, "xls")
+
+
+class TestCommandLine:
+
+    def test_main(self, tmp_path, capsys):
+        assert 0 == main(["data/regions/roughly_saxonia.geo.json", "-m", "RandomEOEmissionCalculator",
+                          "--monthly", "2019-01-01:2019-03-31", "-p", "2019-06-01:2019-06-10",
+                          "-l", "NO2", "SO2", "-o", str(tmp_path), "-f", "csv", "-w", "1"])
+        assert 8 == len(read_journal(tmp_path))
+        assert "Planned 8 job(s)" in capsys.readouterr().out
+
+        assert 0 == main(["data/regions/roughly_saxonia.geo.json", "-m", "RandomEOEmissionCalculator",
+                          "--monthly", "2019-01-01:2019-03-31", "-o", str(tmp_path), "-f", "csv"])
+        assert "0 failed, 3 already done before" in capsys.readouterr().out
+
+    def test_main_without_periods(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(["data/regions", "-m", "RandomEOEmissionCalculator", "-o", str(tmp_path)])
+        with pytest.raises(SystemExit):  # Available at any time, so months need a span
+            main(["data/regions", "-m", "RandomEOEmissionCalculator", "--monthly", "-o", str(tmp_path)])
+
+    def test_main_with_dummy(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(["data/regions/germany.geo.json", "-m", "DummyEOEmissionCalculator", "-p", "2018-08-01:2018-08-02",
+                  "-o", str(tmp_path)])
+        assert not read_journal(tmp_path)
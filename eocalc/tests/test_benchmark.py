@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import pytest
+import os
+
+import numpy
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+from eocalc.benchmark import measure, benchmark, curves, main
+from eocalc.tests.test_naive import region_saxony  # noqa: F401
+
+
+def test_measure():
+    seconds, peak = measure(lambda: numpy.ones(10**6).sum(), repeat=2)
+    assert 0 < seconds < 1
+    assert 7.9 < peak < 9  # Eight bytes per value
+
+    assert numpy.isnan(measure(lambda: None, memory=False)[1])
+
+
+def test_benchmark(region_saxony, tmp_path):
+    rows = []
+    results = benchmark({"saxony": region_saxony}, [1, 2], folder=str(tmp_path), report=rows.append)
+    assert ["no2_201901.asc"] == os.listdir(tmp_path)
+    assert 2 == len(results) == len(rows)
+    assert [1, 2] == results["days"].tolist()
+    assert (results["seconds"] > 0).all() and (results["peak memory [MB]"] > 0).all()
+
+    # Runs read the synthetic data
+    calc = TropomiMonthlyMeanAggregator()
+    calc._assure_data_availability = lambda day: f"{tmp_path}/no2_201901.asc"
+    grid = calc.run(region_saxony, DateRange("2019-01-01", "2019-01-01"), Pollutant.NO2)[calc.GRIDDED_EMISSIONS_KEY]
+    assert len(grid) == results["cells"].iloc[0]
+    assert grid["Center latitude [°]"].astype(float).max() < 52
+
+
+def test_curves():
+    from pandas import DataFrame
+
+    results = DataFrame({"region": ["b", "b", "a", "a"], "cells": [2, 2, 1, 1], "days": [1, 10, 1, 10],
+                         "seconds": [1., 10., 2., 2.], "peak memory [MB]": [1., 100., 1., numpy.nan]})
+    scaling = curves(results)
+    assert ["b", "a"] == list(scaling["seconds"].columns)
+    assert [1, 10] == scaling["seconds"].index.tolist()
+    assert [1, 0] == pytest.approx(scaling["exponents"]["seconds"].tolist())
+    assert 2 == pytest.approx(scaling["exponents"].loc["b", "peak memory [MB]"])
+    assert numpy.isnan(scaling["exponents"].loc["a", "peak memory [MB]"])
+
+
+def test_main(tmp_path, capsys):
+    output = tmp_path / "results.csv"
+    assert 0 == main(["-r", "data/regions/roughly_saxonia.geo.json", "-d", "1", "--start", "2019-03-01",
+                      "--data", str(tmp_path), "--storage", "float32", "--cache", "--no-memory", "-o", str(output)])
+    assert "roughly_saxonia, 1 day(s)" in capsys.readouterr().out
+    assert output.is_file()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import pytest
+import math
+from datetime import date
+
+import numpy
+from pandas import Series
+
+from eocalc.context import Pollutant
+from eocalc.methods import naive
+from eocalc.methods.base import DateRange
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TropomiDailyAggregator
+from eocalc.corrections import Correction, CombinedCorrection, LifetimeCorrection, DiurnalCorrection, \
+    day_length, AXIAL_TILT, SOLSTICE_OFFSET, YEAR_LENGTH
+from eocalc.weighting import GridSpec, WeightCache
+from eocalc.tests.test_naive import region_saxony, region_germany, region_synthetic, daily_calc  # noqa: F401
+
+
+def declination(day: date) -> float:
+    return -AXIAL_TILT * math.cos(2 * math.pi * (day.timetuple().tm_yday - 1 + SOLSTICE_OFFSET) / YEAR_LENGTH)
+
+
+def lifetime_factor(day: date, lat: float, minimum=4, maximum=24, reference=6) -> float:
+    """Scalar reference implementation of LifetimeCorrection, one day and latitude at a time."""
+    cosine = math.cos(math.radians(lat - declination(day)))
+    lifetime = maximum if cosine <= minimum / maximum else minimum / cosine
+    return reference / lifetime
+
+
+def diurnal_factor(day: date, lat: float, night_share=.5) -> float:
+    """Scalar reference implementation of DiurnalCorrection, one day and latitude at a time."""
+    product = -math.tan(math.radians(min(max(lat, -89.99), 89.99))) * math.tan(math.radians(declination(day)))
+    hours = 0 if product >= 1 else 24 if product <= -1 else math.degrees(math.acos(product)) * 2 / 15
+    return hours / 24 + night_share * (1 - hours / 24)
+
+
+class Counting(Correction):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    def factors(self, days, lats):
+        self.calls += 1
+        return numpy.ones((len(days), len(lats))) * (numpy.asarray(lats) > 0) + 1
+
+
+DAYS = [date(2019, 1, 1), date(2019, 3, 21), date(2019, 6, 21), date(2019, 9, 30), date(2020, 12, 31)]
+LATS = [-89.9, -66, -30, 0, 23.4, 51.0625, 70, 89.9]
+
+
+class TestFactors:
+
+    @pytest.mark.parametrize("correction, reference", [(LifetimeCorrection(), lifetime_factor),
+                                                       (DiurnalCorrection(), diurnal_factor)])
+    def test_matches_scalar_reference(self, correction, reference):
+        factors = correction.factors(numpy.array(DAYS, dtype="datetime64[D]"), numpy.array(LATS))
+        assert (len(DAYS), len(LATS)) == factors.shape
+        for row, day in enumerate(DAYS):
+            for column, lat in enumerate(LATS):
+                assert reference(day, lat) == pytest.approx(factors[row, column])
+
+    def test_day_length(self):
+        lengths = day_length(numpy.array(DAYS, dtype="datetime64[D]"), numpy.array(LATS))
+        assert 12 == pytest.approx(lengths[:, LATS.index(0)])
+        assert 24 == lengths[2, LATS.index(89.9)]
+        assert 0 == lengths[2, LATS.index(-89.9)]
+        assert 16 < lengths[2, LATS.index(51.0625)] < 17
+
+    def test_lifetime(self):
+        factors = LifetimeCorrection().factors(numpy.array(DAYS, dtype="datetime64[D]"), numpy.array(LATS))
+        assert 6 / 24 == pytest.approx(factors[0, LATS.index(89.9)])  # Polar night
+        assert factors[2, LATS.index(51.0625)] > factors[0, LATS.index(51.0625)]  # Summer vs. winter
+        assert (factors <= 6 / 4).all()
+
+    def test_combined(self):
+        days, lats = numpy.array(DAYS, dtype="datetime64[D]"), numpy.array(LATS)
+        combined = CombinedCorrection([LifetimeCorrection(), DiurnalCorrection(night_share=.2)])
+        assert LifetimeCorrection().factors(days, lats) * DiurnalCorrection(.2).factors(days, lats) == \
+            pytest.approx(combined.factors(days, lats))
+
+
+class TestTables:
+
+    def test_table(self):
+        correction, grid = Counting(max_months=2), GridSpec(1)
+        table = correction.table(numpy.datetime64("2019-02"), grid)
+        assert (28, 180) == table.shape
+        assert [1] * 90 + [2] * 90 == table[0].tolist()
+        assert table is correction.table(numpy.datetime64("2019-02-10"), grid)
+        assert not table.flags.writeable
+        assert 1 == correction.calls
+
+        correction.table(numpy.datetime64("2019-03"), grid)
+        correction.table(numpy.datetime64("2019-02"), grid)
+        correction.table(numpy.datetime64("2019-04"), grid)  # Evicts March
+        assert 3 == correction.calls
+        correction.table(numpy.datetime64("2019-02"), grid)
+        assert 3 == correction.calls
+        assert (31, 360) == correction.table(numpy.datetime64("2019-03"), GridSpec(.5)).shape
+
+    def test_for_period(self):
+        correction, grid = LifetimeCorrection(), GridSpec(.125)
+        period = DateRange("2019-01-30", "2019-03-02")
+        lats = -90 + (numpy.arange(grid.rows) + .5) * grid.cell_size
+        assert correction.factors(period.days(), lats) == pytest.approx(correction.for_period(period, grid))
+
+    def test_month_sums(self):
+        correction, grid = LifetimeCorrection(), GridSpec(1)
+        period = DateRange("2019-01-30", "2019-02-02")
+        months = numpy.arange(numpy.datetime64("2018-12"), numpy.datetime64("2019-04"))
+        sums, squares = correction.month_sums(period, months, grid)
+
+        factors = correction.for_period(period, grid)
+        assert (4, 180) == sums.shape == squares.shape
+        assert [0, 0] == [sums[0].sum(), sums[3].sum()]
+        assert factors[:2].sum(axis=0) == pytest.approx(sums[1])
+        assert (factors[2:] ** 2).sum(axis=0) == pytest.approx(squares[2])
+
+
+class TestCorrectedRuns:
+
+    @pytest.fixture
+    def clipped(self):
+        return lambda day: "data/methods/temis/tropomi/no2/monthly_mean/no2_201808_clipped.asc"
+
+    def test_run_matches_scalar_reference(self, region_saxony, clipped, monkeypatch):
+        period = DateRange("2018-08-30", "2018-09-02")
+        plain, corrected = TropomiMonthlyMeanAggregator(), TropomiMonthlyMeanAggregator(correction=LifetimeCorrection())
+        monkeypatch.setattr(plain, "_assure_data_availability", clipped)
+        monkeypatch.setattr(corrected, "_assure_data_availability", clipped)
+        expected = plain.run(region_saxony, period, Pollutant.NO2)[plain.GRIDDED_EMISSIONS_KEY]
+        result = corrected.run(region_saxony, period, Pollutant.NO2)
+        grid, table = result[corrected.GRIDDED_EMISSIONS_KEY], result[corrected.TOTAL_EMISSIONS_KEY]
+
+        # Scale each cell's daily values one by one
+        days = list(period)
+        daily = expected.iloc[:, -(len(period) + 3):-3].to_numpy()
+        lats = expected["Center latitude [°]"].astype(float)
+        reference = numpy.array([[daily[row, column] * lifetime_factor(day, lat) for column, day in enumerate(days)]
+                                 for row, lat in enumerate(lats)])
+        assert numpy.allclose(reference, grid.iloc[:, -(len(period) + 3):-3].to_numpy(), equal_nan=True)
+        assert numpy.nansum(reference) / 10**6 == pytest.approx(table.loc["Totals"].iloc[0])
+
+        cells = [corrected._combine_uncertainties(Series(row), Series([naive.TEMIS_CELL_UNCERTAINTY] * len(days)))
+                 for row in reference]
+        assert cells == pytest.approx(grid["Umin [%]"].tolist())
+
+    def test_run_totals_many(self, region_saxony, region_germany, clipped, monkeypatch):
+        calc = TropomiMonthlyMeanAggregator(weights=WeightCache(None),  # Keep the working tree clean
+                                            correction=CombinedCorrection([LifetimeCorrection(), DiurnalCorrection()]))
+        monkeypatch.setattr(calc, "_assure_data_availability", clipped)
+        regions = {"saxony": region_saxony, "germany": region_germany}
+        periods = [DateRange("2018-07-30", "2018-08-02"), DateRange("2018-08-10", "2018-08-10")]
+
+        results = calc.run_totals_many(regions, periods, Pollutant.NO2)
+        for (name, period), totals in results.items():
+            expected = calc.run(regions[name], period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY].loc["Totals"]
+            assert expected.iloc[0] == pytest.approx(totals.value)
+            assert expected.iloc[1] == pytest.approx(totals.umin)
+
+    def test_daily(self, daily_calc, region_synthetic):
+        period = DateRange("2019-03-01", "2019-03-03")
+        plain = daily_calc.run(region_synthetic, period, Pollutant.NO2)[daily_calc.GRIDDED_EMISSIONS_KEY]
+        corrected = TropomiDailyAggregator(correction=DiurnalCorrection())
+        grid = corrected.run(region_synthetic, period, Pollutant.NO2)[corrected.GRIDDED_EMISSIONS_KEY]
+
+        for (_, before), (_, after) in zip(plain.iloc[[0, 100, 255]].iterrows(), grid.iloc[[0, 100, 255]].iterrows()):
+            lat = float(before["Center latitude [°]"])
+            reference = sum(value * diurnal_factor(day, lat) for value, day in zip([10, 20, 30], period))
+            assert before.iloc[1] * reference / 60 == pytest.approx(after.iloc[1])
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import pytest
+import threading
+import time
 
 from eocalc.context import Pollutant
-from eocalc.methods.dummy import DummyEOEmissionCalculator
+from eocalc.methods.base import RunHandle, RunCancelled, Status
+from eocalc.methods.dummy import DummyEOEmissionCalculator, DummyFailure, Stage
 
 from eocalc.tests.test_base import region_sample_north, region_sample_south, region_sample_span_equator
 
@@ -31,3 +34,61 @@ class TestDummyMethods:
 
     def test_run(self, calc):
         assert 42 == calc.run()
+        assert not calc.returns_tables()
+        assert 100 == calc.progress
+
+    def test_profile(self):
+        calc = DummyEOEmissionCalculator([Stage("load", .1), Stage("crunch", .1, cpu=1, memory=2**20),
+                                          Stage("nothing", 0)])
+        handle = RunHandle()
+        start = time.process_time()
+        assert 42 == calc.run(handle=handle)
+        assert .07 < time.process_time() - start  # Busy in the second stage only
+        assert ["load", "crunch", "nothing", "total"] == list(handle.timings)
+        assert .1 == pytest.approx(handle.timings["load"], abs=.03) == pytest.approx(handle.timings["crunch"], abs=.03)
+        assert .2 == pytest.approx(handle.timings["total"], abs=.05)
+        assert (Status.READY, 100) == (handle.state, handle.progress)
+
+    def test_progress(self):
+        calc = DummyEOEmissionCalculator([Stage("wait", .5)])
+        handle, raised = RunHandle(), []
+
+        def run():
+            # Record the cancellation here, the main thread asserts on it
+            try:
+                calc.run(handle=handle)
+            except RunCancelled as error:
+                raised.append(error)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(.25)
+        assert 20 <= handle.progress <= 80
+
+        handle.cancel()
+        thread.join()
+        assert 1 == len(raised) and raised[0] is handle.error
+        assert Status.CANCELLED == handle.state and isinstance(handle.error, RunCancelled)
+
+    def test_failure(self):
+        calc = DummyEOEmissionCalculator([Stage("fine", 0), Stage("broken", 0, failure=1)])
+        handle = RunHandle()
+        with pytest.raises(DummyFailure):
+            calc.run(handle=handle)
+        assert ["fine", "broken", "total"] == list(handle.timings)
+
+        # Same seed, same failures
+        flaky = [Stage(f"{index}", 0, failure=.5) for index in range(10)]
+        outcomes = []
+        for _ in range(2):
+            try:
+                outcomes.append(DummyEOEmissionCalculator(flaky, seed=1).run())
+            except DummyFailure as failure:
+                outcomes.append(str(failure))
+        assert outcomes[0] == outcomes[1]
+
+    def test_invalid_stage(self):
+        for invalid in [{"duration": -1}, {"duration": 1, "cpu": 2}, {"duration": 1, "memory": -1},
+                        {"duration": 1, "failure": 1.5}]:
+            with pytest.raises(ValueError):
+                Stage("invalid", **invalid)
@@ -53,3 +53,39 @@ class TestRandomMethods:
 
         with pytest.raises(AttributeError):
             calc.run(region, period, None)
+
+    def test_seed(self, region, period):
+        first = RandomEOEmissionCalculator(seed=1).run(region, period, Pollutant.NO2)
+        # Same seed and input, same results, also after other runs
+        other = RandomEOEmissionCalculator(seed=1)
+        other.run(region, DateRange("2020-01-01", "2020-01-31"), Pollutant.SO2)
+        second = other.run(region, period, Pollutant.NO2)
+        for key in [RandomEOEmissionCalculator.TOTAL_EMISSIONS_KEY, RandomEOEmissionCalculator.GRIDDED_EMISSIONS_KEY]:
+            assert first[key].equals(second[key])
+
+        third = RandomEOEmissionCalculator(seed=2).run(region, period, Pollutant.NO2)
+        assert not first[RandomEOEmissionCalculator.TOTAL_EMISSIONS_KEY].equals(
+            third[RandomEOEmissionCalculator.TOTAL_EMISSIONS_KEY])
+        assert not first[RandomEOEmissionCalculator.TOTAL_EMISSIONS_KEY].equals(
+            other.run(region, period, Pollutant.SO2)[RandomEOEmissionCalculator.TOTAL_EMISSIONS_KEY])
+
+    def test_daily(self, region):
+        period = DateRange("2020-02-01", "2020-02-29")
+        grid = RandomEOEmissionCalculator(seed=3, daily=True).run(region, period, Pollutant.NO2)[
+            RandomEOEmissionCalculator.GRIDDED_EMISSIONS_KEY]
+        assert 6 + 29 + 3 == len(grid.columns)
+        assert ["2020-02-01 NO2 emissions [kg]", "2020-02-29 NO2 emissions [kg]"] == [grid.columns[6], grid.columns[34]]
+        assert ["Center latitude [°]", "Center longitude [°]", "geometry"] == list(grid.columns[-3:])
+
+        days = grid.iloc[:, 6:-3]
+        assert grid["Total NO2 emissions [kg]"].to_numpy() == pytest.approx(days.sum(axis=1).to_numpy())
+        assert (grid["Missing values [1]"] == days.isna().sum(axis=1)).all()
+        assert 0 < grid["Missing values [1]"].sum() < days.size / 2
+
+    def test_unclipped(self, region, period):
+        clipped = RandomEOEmissionCalculator(seed=4).run(region, period, Pollutant.NO2)
+        unclipped = RandomEOEmissionCalculator(seed=4, clip=False).run(region, period, Pollutant.NO2)
+        clipped, unclipped = (result[RandomEOEmissionCalculator.GRIDDED_EMISSIONS_KEY] for result in [clipped, unclipped])
+        assert len(clipped) == len(unclipped) == 30 * 10
+        assert clipped["Area [km²]"].sum() == pytest.approx(unclipped["Area [km²]"].sum())
+        assert region.difference(unclipped.geometry.union_all()).area == pytest.approx(0, abs=1e-9)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+
+import numpy
+
+from eocalc.golden import GoldenCase, cases, calibrate, run, reference, compare, over_budget, check, \
+    load_reference, load_performance, GOLDEN_MINIMUM_SECONDS, GOLDEN_SYNTHETIC_MONTHS
+from eocalc.methods.base import DateRange
+
+
+@pytest.fixture(scope="module")
+def data_folder(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("synthetic"))
+
+
+@pytest.fixture(scope="module")
+def calibration():
+    return calibrate()
+
+
+@pytest.fixture(scope="module")
+def saxony():
+    case = GoldenCase("roughly_saxonia", "clipped", DateRange("2018-08-01", "2018-08-31"))
+    return case, run(case)
+
+
+# Europe takes more than a minute, check with "python -m eocalc.golden -k europe"
+CASES = [case for case in cases() if case.region != "europe"]
+# Budgets depend on the machine's load, check them on an idle machine with EOCALC_GOLDEN_BUDGETS=1 python -m pytest
+BUDGETS = bool(os.environ.get("EOCALC_GOLDEN_BUDGETS"))
+
+
+@pytest.mark.parametrize("case", CASES, ids=lambda case: case.name)
+def test_golden(case, data_folder):
+    assert [] == check(case, data_folder=data_folder, budgets=False)
+
+
+@pytest.mark.skipif(not BUDGETS, reason="set EOCALC_GOLDEN_BUDGETS=1 to check time and memory budgets")
+@pytest.mark.parametrize("case", CASES, ids=lambda case: case.name)
+def test_budgets(case, data_folder, calibration):
+    assert [] == check(case, data_folder=data_folder, calibration=calibration)
+
+
+def test_cases():
+    names = [case.name for case in cases()]
+    assert len(names) == len(set(names))
+    assert set(names) == set(load_performance()["cases"])
+    regions = {name.split("_", 1)[1] for name in names}
+    synthetic = {f"synthetic-{month:%Y-%m}_{region}" for month in GOLDEN_SYNTHETIC_MONTHS for region in regions}
+    assert synthetic <= set(names) and all(name.startswith("clipped_") for name in set(names) - synthetic)
+    assert "clipped_germany" in names and "clipped_europe" not in names  # Outside the clipped file
+    assert not any("adak" in name for name in names)  # Not covered
+
+
+def test_compare(saxony):
+    case, (results, _, _) = saxony
+    expected = load_reference(case)
+    assert [] == compare(results, expected)
+
+    changed = {**expected, "totals": expected["totals"] * 1.001}
+    assert 1 == len(compare(results, changed)) and "GNFR" in compare(results, changed)[0]
+
+    grid = expected["grid"].copy()
+    grid[5, 1] += 1
+    assert ["Grid column 'Total NO2 emissions [kg]' differs in 1 of 237 cells"] == \
+        compare(results, {**expected, "grid": grid})
+    assert ["Grid has 237 cells instead of 227, 0 missing and 10 extra"] == \
+        compare(results, {**expected, "cells": expected["cells"][10:], "grid": expected["grid"][10:]})
+
+    # Tiny differences, like from summing in another order, are fine
+    current = reference(results)
+    assert [] == compare(results, {**current, "totals": current["totals"] * (1 + 1e-9),
+                                   "grid": current["grid"] * (1 + 1e-9)})
+
+
+def test_over_budget(saxony):
+    _, (_, seconds, peaks) = saxony
+    assert {"read", "grid", "table", "total"} <= set(seconds) and {"read", "grid", "total"} <= set(peaks)
+
+    # Reference stages at least as long as the budgets' floor, so three times as long is over budget anywhere
+    floored = {stage: max(value, GOLDEN_MINIMUM_SECONDS) for stage, value in seconds.items()}
+    expected = {"calibration": 1., "seconds": floored, "memory [MB]": peaks}
+    assert [] == over_budget(seconds, peaks, expected, 1.)
+    slower = {stage: value * 3 for stage, value in floored.items()}
+    assert {f"Stage '{stage}'" for stage in seconds} == {problem.split(" took")[0]
+                                                         for problem in over_budget(slower, peaks, expected, 1.)}
+    assert [] == over_budget(slower, peaks, expected, 2.)  # On a machine twice as slow
+    bigger = {stage: value * 2 + 10 for stage, value in peaks.items()}
+    assert len(peaks) == len(over_budget(seconds, bigger, expected, 1.))
+    assert numpy.isfinite(list(seconds.values())).all()
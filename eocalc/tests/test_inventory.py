@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import pytest
+import time
+from datetime import date
+
+import numpy
+from pandas import DataFrame
+
+from eocalc.context import Pollutant, GNFR
+from eocalc.methods.base import DateRange, EmissionTotals, EOEmissionCalculator
+from eocalc.batch import monthly_periods
+from eocalc.inventory import load_inventory, calculated, compare, tables, INVENTORY_KEYS, INVENTORY_VALUES
+
+
+@pytest.fixture
+def report(tmp_path):
+    file = tmp_path / "report.csv"
+    DataFrame({"country": ["germany", "germany", "germany", "saxony", "saxony"],
+               "pollutant": ["NO2", "NO2", "NO2", "NO2", "SO2"],
+               "year": [2019, 2019, 2019, 2019, 2019],
+               "sector": ["A_PublicPower", "F", "NATIONAL_TOTAL", "Totals", "Totals"],
+               "emissions": [100., 200., 1000., 50., 5.],
+               "Umin [%]": [10., 20., numpy.nan, 5., 5.]}).to_csv(file, index=False)
+    return file
+
+
+@pytest.fixture
+def results():
+    table = EOEmissionCalculator._create_gnfr_table(Pollutant.NO2)
+    table.loc[GNFR.A_PublicPower] = [110., 20., 20.]
+    table.loc[GNFR.F_RoadTransport] = [100., 30., 30.]
+    table.loc["Totals"] = [900., 10., 10.]
+    return {("germany", DateRange("2019-01-01", "2019-12-31")): {EOEmissionCalculator.TOTAL_EMISSIONS_KEY: table},
+            **{("saxony", period): EmissionTotals(count + 1., 10, 10)
+               for count, period in enumerate(monthly_periods(date(2019, 1, 1), date(2019, 12, 31)))}}
+
+
+class TestInventory:
+
+    def test_load(self, report, tmp_path):
+        inventory = load_inventory(str(report), columns={"country": "region", "emissions": "Value [kt]"},
+                                   uncertainty=15)
+        assert INVENTORY_KEYS == list(inventory.index.names)
+        assert INVENTORY_VALUES == list(inventory.columns)
+        assert 5 == len(inventory)
+        assert [100, 10, 10] == inventory.loc[("NO2", "germany", 2019, "A_PublicPower")].tolist()
+        assert [1000, 15, 15] == inventory.loc[("NO2", "germany", 2019, "Totals")].tolist()
+        assert 200 == inventory.loc[("NO2", "germany", 2019, "F_RoadTransport"), "Value [kt]"]
+
+        # Parquet works the same, later files win
+        parquet = tmp_path / "update.parquet"
+        DataFrame({"region": ["germany"], "pollutant": ["NO2"], "year": [2019], "sector": ["A"],
+                   "Value [kt]": [120.]}).to_parquet(parquet)
+        updated = load_inventory([str(report), str(parquet)], columns={"country": "region", "emissions": "Value [kt]"})
+        assert 5 == len(updated)
+        assert [120, 0, 0] == updated.loc[("NO2", "germany", 2019, "A_PublicPower")].tolist()
+
+    def test_load_invalid(self, report, tmp_path):
+        with pytest.raises(ValueError):
+            load_inventory(str(report))  # Columns not mapped
+        bad = tmp_path / "bad.csv"
+        DataFrame({"region": ["a"], "pollutant": ["NO2"], "year": [2019], "sector": ["Q"],
+                   "Value [kt]": [1.]}).to_csv(bad, index=False)
+        with pytest.raises(ValueError):
+            load_inventory(str(bad))
+        DataFrame({"region": ["a"], "pollutant": ["XYZ"], "year": [2019], "sector": ["A"],
+                   "Value [kt]": [1.]}).to_csv(bad, index=False)
+        with pytest.raises(ValueError, match="Unknown pollutant 'XYZ'!"):
+            load_inventory(str(bad))
+
+    def test_calculated(self, results):
+        table = calculated(results, Pollutant.NO2)
+        assert INVENTORY_KEYS == list(table.index.names)
+        assert [("NO2", "germany", 2019, "A_PublicPower"), ("NO2", "germany", 2019, "F_RoadTransport"),
+                ("NO2", "germany", 2019, "Totals"), ("NO2", "saxony", 2019, "Totals")] == list(table.index)
+
+        # Months add up to the year, uncertainties combined
+        values = numpy.arange(1, 13)
+        expected = EOEmissionCalculator._combine_uncertainties(DataFrame(values)[0], DataFrame([10] * 12)[0])
+        assert [78, expected, expected] == pytest.approx(table.loc[("NO2", "saxony", 2019, "Totals")].tolist())
+
+        # Incomplete years are left out, whole years preferred
+        del results[("saxony", DateRange("2019-03-01", "2019-03-31"))]
+        assert ("NO2", "saxony", 2019, "Totals") not in calculated(results, Pollutant.NO2).index
+        results[("saxony", DateRange("2019-01-01", "2019-12-31"))] = EmissionTotals(70, 5, 5)
+        assert [70, 5, 5] == calculated(results, Pollutant.NO2).loc[("NO2", "saxony", 2019, "Totals")].tolist()
+        assert 0 == len(calculated({}, Pollutant.NO2))
+
+    def test_compare(self, report, results):
+        inventory = load_inventory(str(report), columns={"country": "region", "emissions": "Value [kt]"})
+        comparison = compare(calculated(results, Pollutant.NO2), inventory)
+        assert 4 == len(comparison)
+
+        germany = comparison.loc[("NO2", "germany", 2019)]
+        assert [1.1, .5, .9] == pytest.approx(germany["Ratio [1]"].tolist())
+        assert [10, -100, -100] == pytest.approx(germany["Difference [kt]"].tolist())
+        # [88, 132] vs. [90, 110], [70, 130] vs. [160, 240], [810, 990] vs. [1000, 1000]
+        assert [20 / 44, 0, 0] == pytest.approx(germany["Overlap [1]"].tolist())
+        assert [True, False, False] == germany["Consistent"].tolist()
+
+        saxony = comparison.loc[("NO2", "saxony", 2019, "Totals")]
+        assert 78 / 50 == pytest.approx(saxony["Ratio [1]"])
+        assert not saxony["Consistent"] and 0 == saxony["Overlap [1]"]
+
+        wide = tables(comparison)
+        assert {"ratio", "difference", "overlap"} == set(wide)
+        assert ["A_PublicPower", "F_RoadTransport", "Totals"] == list(wide["ratio"].columns)
+        assert numpy.isnan(wide["ratio"].loc[("NO2", "saxony", 2019), "A_PublicPower"])
+        assert -100 == wide["difference"].loc[("NO2", "germany", 2019), "Totals"]
+
+    def test_scale(self):
+        # Thousands of region, year and sector rows
+        rng = numpy.random.default_rng(0)
+        keys = [("NO2", f"region {region}", year, sector.name) for region in range(200) for year in range(2005, 2025)
+                for sector in list(GNFR)[:3]]
+        inventory = DataFrame(rng.uniform(1, 100, (len(keys), 3)), columns=INVENTORY_VALUES,
+                              index=DataFrame(keys, columns=INVENTORY_KEYS).set_index(INVENTORY_KEYS).index)
+        calculation = inventory * [1.1, 1, 1]
+
+        start = time.perf_counter()
+        comparison = compare(calculation, inventory.sample(frac=1, random_state=1))
+        wide = tables(comparison)
+        assert time.perf_counter() - start < 1
+        assert len(keys) == len(comparison)
+        assert numpy.allclose(wide["ratio"].to_numpy(), 1.1)
+        assert (200 * 20, 3) == wide["overlap"].shape
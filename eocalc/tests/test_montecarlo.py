@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import numpy
+from pandas import Series
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, EOEmissionCalculator
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TEMIS_BIN_WIDTH
+from eocalc.montecarlo import MonteCarlo
+from eocalc.weighting import GridSpec, SparseMatrix
+from eocalc.tests.test_naive import region_saxony, clipped_data_file_name  # noqa: F401
+
+
+@pytest.fixture
+def grid():
+    return GridSpec(TEMIS_BIN_WIDTH)
+
+
+@pytest.fixture
+def cells(grid):
+    # A block of 20 x 30 cells around Saxony
+    rows, columns = numpy.meshgrid(numpy.arange(1120, 1140), numpy.arange(1560, 1590), indexing="ij")
+    return (rows * grid.columns + columns).ravel()
+
+
+@pytest.fixture
+def values(cells):
+    return numpy.random.default_rng(1).uniform(1, 10, len(cells))
+
+
+class TestMonteCarlo:
+
+    def test_matches_error_propagation(self, cells, values, grid):
+        uncertainties = numpy.full(len(cells), 50.)
+        expected = EOEmissionCalculator._combine_uncertainties(Series(values), Series(uncertainties))
+
+        umin, umax = MonteCarlo(samples=20_000, seed=1).bounds(cells, values, uncertainties, grid)
+        assert isinstance(umin, float) and isinstance(umax, float)
+        assert expected == pytest.approx(umin, rel=.05) == pytest.approx(umax, rel=.05)
+
+    def test_reproducible(self, cells, values, grid):
+        simulation = MonteCarlo(samples=100, seed=3)
+        assert simulation.bounds(cells, values, 30, grid) == simulation.bounds(cells, values, 30, grid)
+        assert simulation.bounds(cells, values, 30, grid) != MonteCarlo(samples=100, seed=4).bounds(cells, values,
+                                                                                                      30, grid)
+
+    @pytest.mark.parametrize("correlation_length", [0, 50])
+    def test_chunks(self, cells, values, grid, correlation_length):
+        whole = MonteCarlo(samples=50, correlation_length=correlation_length, seed=5)
+        chunked = MonteCarlo(samples=50, correlation_length=correlation_length, seed=5, chunk_bytes=8 * 7 * len(cells))
+        assert 8 == len(list(chunked.fields(cells, grid)))
+        assert whole.simulate(cells, values, 30, grid) == pytest.approx(chunked.simulate(cells, values, 30, grid))
+
+    def test_correlation(self, cells, values, grid):
+        independent = MonteCarlo(samples=2000, seed=6).bounds(cells, values, 30, grid)
+        correlated = MonteCarlo(samples=2000, correlation_length=100, seed=6).bounds(cells, values, 30, grid)
+        assert correlated[0] > 3 * independent[0] and correlated[1] > 3 * independent[1]
+
+        # Correlation decays with distance, but each cell keeps unit variance
+        fields = next(MonteCarlo(samples=4000, correlation_length=20, seed=6).fields(cells, grid))
+        assert numpy.ones(len(cells)) == pytest.approx(fields.std(axis=0), rel=.1)
+        near, far = numpy.corrcoef(fields[:, 0], fields[:, 1])[0, 1], numpy.corrcoef(fields[:, 0], fields[:, 20])[0, 1]
+        assert near > .5 > far > -.1
+
+    def test_duplicate_cells(self, cells, values, grid):
+        # Cells split into parts (e.g. by tiles) are perturbed together
+        doubled = numpy.concatenate([cells, cells])
+        umin, _ = MonteCarlo(samples=2000, seed=8).bounds(doubled, numpy.concatenate([values, values]), 30, grid)
+        assert MonteCarlo(samples=2000, seed=8).bounds(cells, values, 30, grid)[0] == pytest.approx(umin)
+
+    def test_many_totals(self, cells, values, grid):
+        parts = numpy.stack([values, 2 * values, numpy.where(cells % 2, values, 0)], axis=1)
+        uncertainties = numpy.stack([numpy.full(len(cells), 30.)] * 2 + [numpy.full(len(cells), 60.)], axis=1)
+        umin, umax = MonteCarlo(samples=2000, seed=9).bounds(cells, parts, uncertainties, grid)
+        assert (3,) == umin.shape == umax.shape
+        assert umin[0] == pytest.approx(umin[1])  # Same perturbations, scaled
+        assert umin[2] > umin[0]
+
+    def test_weights(self, cells, values, grid):
+        # Three overlapping regions, totals for two columns each
+        rng = numpy.random.default_rng(13)
+        weights = SparseMatrix(rng.integers(0, 3, 900), rng.integers(0, len(cells), 900), rng.uniform(0, 1, 900),
+                               (3, len(cells)))
+        parts = numpy.stack([values, values[::-1]], axis=1)
+        uncertainties = numpy.broadcast_to([30., 60.], parts.shape)
+        dense = (parts[:, :, numpy.newaxis] * weights.to_dense().T[:, numpy.newaxis, :]).reshape(len(cells), 6)
+        sigmas = numpy.repeat(uncertainties, 3, axis=1)
+
+        simulation = MonteCarlo(samples=200, seed=14)
+        expected = simulation.simulate(cells, dense, sigmas, grid)
+        assert expected == pytest.approx(simulation.simulate(cells, parts, uncertainties, grid, weights))
+        blocks = MonteCarlo(samples=200, seed=14, chunk_bytes=8 * len(weights) * 7)  # Samples in blocks of 7
+        assert expected == pytest.approx(blocks.simulate(cells, parts, uncertainties, grid, weights))
+
+        umin, _ = simulation.bounds(cells, parts, uncertainties, grid, weights)
+        assert (6,) == umin.shape and simulation.bounds(cells, dense, sigmas, grid)[0] == pytest.approx(umin)
+        with pytest.raises(ValueError):
+            MonteCarlo(samples=200).simulate(cells[1:], parts[1:], 30, grid, weights)
+
+    def test_lognormal(self, cells, values, grid):
+        simulation = MonteCarlo(samples=5000, distribution="lognormal", seed=10)
+        assert (simulation.simulate(cells[:1], values[:1], 1000, grid) > 0).all()
+        umin, umax = simulation.bounds(cells[:1], values[:1], 1000, grid)
+        assert umin < 100 < umax
+
+        normal = MonteCarlo(samples=5000, seed=10).bounds(cells[:1], values[:1], 1000, grid)
+        assert normal[0] == pytest.approx(normal[1], rel=.1)
+
+    def test_time_limit(self, cells, values, grid):
+        simulation = MonteCarlo(samples=1000, seed=11, chunk_bytes=8 * 10 * len(cells), time_limit=0)
+        assert (10, 1) == simulation.simulate(cells, values, 30, grid).shape
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            MonteCarlo(samples=1)
+        with pytest.raises(ValueError):
+            MonteCarlo(distribution="uniform")
+
+    def test_naive(self, region_saxony, clipped_data_file_name, monkeypatch):
+        period = DateRange("2018-08-01", "2018-08-31")
+        calc = TropomiMonthlyMeanAggregator(uncertainty=MonteCarlo(samples=5000, seed=12))
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+
+        propagated = TropomiMonthlyMeanAggregator()
+        monkeypatch.setattr(propagated, "_assure_data_availability", lambda day: clipped_data_file_name)
+        expected = propagated.run(region_saxony, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY].iloc[-1]
+
+        totals = calc.run(region_saxony, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY].iloc[-1]
+        assert expected.iloc[0] == totals.iloc[0]
+        assert expected.iloc[1] == pytest.approx(totals.iloc[1], rel=.1)
+        assert totals.iloc[1] != totals.iloc[2]
+
+        # Same simulation for totals only
+        result = calc.run_totals(region_saxony, period, Pollutant.NO2)
+        assert totals.iloc[0] == pytest.approx(result.value)
+        assert expected.iloc[1] == pytest.approx(result.umin, rel=.1) == pytest.approx(result.umax, rel=.1)
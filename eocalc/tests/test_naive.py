@@ -4,11 +4,15 @@ import json
 import os
 from datetime import date, timedelta
 
+import numpy
+from pandas import Series
 from shapely.geometry import shape
+from shapely.ops import unary_union as shapely_union
 
 from eocalc.context import Pollutant
+from eocalc.methods import naive
 from eocalc.methods.base import DateRange
-from eocalc.methods.naive import TropomiMonthlyMeanAggregator, LOCAL_DATA_FOLDER
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TropomiDailyAggregator, LOCAL_DATA_FOLDER
 
 from eocalc.tests.test_base import region_sample_north, region_sample_south, region_sample_span_equator
 
@@ -108,6 +112,293 @@ class TestTropomiMonthlyMeanAggregatorMethods:
     def test_read_toms_data(self, calc, file, region, result, request):
         assert result == calc._read_toms_data(request.getfixturevalue(region), request.getfixturevalue(file))
 
+    @pytest.mark.parametrize("tile_size, workers", [(1, 1), (.5, 3)])
+    def test_run_tiled(self, calc, region_saxony, clipped_data_file_name, tile_size, workers, monkeypatch, tmp_path):
+        pytest.importorskip("pyarrow")
+        from eocalc.results import load
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        period = DateRange(start='2018-08-01', end='2018-08-03')
+
+        expected = calc.run(region_saxony, period, Pollutant.NO2)
+        result = calc.run(region_saxony, period, Pollutant.NO2, tile_size=tile_size, workers=workers,
+                          output=tmp_path / "grid.parquet")
+
+        assert numpy.allclose(expected[calc.TOTAL_EMISSIONS_KEY].iloc[-1], result[calc.TOTAL_EMISSIONS_KEY].iloc[-1])
+        assert len(expected[calc.GRIDDED_EMISSIONS_KEY].columns) - 3 == len(result[calc.GRIDDED_EMISSIONS_KEY].columns)
+        assert 100 == calc.progress
+
+        written = load(tmp_path / "grid.parquet")[calc.GRIDDED_EMISSIONS_KEY]
+        assert list(expected[calc.GRIDDED_EMISSIONS_KEY].columns) == list(written.columns)
+        assert expected[calc.GRIDDED_EMISSIONS_KEY].iloc[:, 1].sum() == pytest.approx(written.iloc[:, 1].sum())
+        assert expected[calc.GRIDDED_EMISSIONS_KEY]["Area [km²]"].sum() == pytest.approx(written["Area [km²]"].sum())
+
+    def test_run_tiled_reads_tiles(self, calc, region_saxony, clipped_data_file_name, monkeypatch):
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        period = DateRange(start='2018-08-01', end='2018-08-03')
+        expected = calc.run(region_saxony, period, Pollutant.NO2)
+
+        # Each tile only reads its own bounding box
+        read, read_raw = [], calc._read_raw
+        monkeypatch.setattr(calc, "_read_raw", lambda region, day: read.append(region) or read_raw(region, day))
+        result = calc.run(region_saxony, period, Pollutant.NO2, tile_size=.5, workers=2)
+        assert len(calc._create_tiles(region_saxony, .5)) == len(read)
+        assert region_saxony.area == pytest.approx(sum(region.area for region in read))
+        assert expected[calc.TOTAL_EMISSIONS_KEY].iloc[-1].tolist() == \
+            pytest.approx(result[calc.TOTAL_EMISSIONS_KEY].iloc[-1].tolist())
+        assert len(expected[calc.GRIDDED_EMISSIONS_KEY]) == len(result[calc.GRIDDED_EMISSIONS_KEY])
+
+        # Tiles not aligned with the cells would split cells between them
+        for tile_size in [.3, .1, .125 * 2.5]:
+            with pytest.raises(ValueError, match="multiple of"):
+                calc.run(region_saxony, period, Pollutant.NO2, tile_size=tile_size)
+
+    def test_run_simplified(self, calc, region_germany, clipped_data_file_name, monkeypatch):
+        import shapely
+        from eocalc.regions import MAX_AREA_ERROR
+
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        period = DateRange(start='2018-08-01', end='2018-08-01')
+        expected = calc.run(region_germany, period, Pollutant.NO2)
+
+        # Cells are clipped with the simplified region, its area stays within bounds
+        clipped, clip_grid = [], calc._clip_grid
+        monkeypatch.setattr(calc, "_clip_grid", lambda grid, tile, region, *args:
+                            clipped.append(region) or clip_grid(grid, tile, region, *args))
+        result = calc.run(region_germany, period, Pollutant.NO2, simplify=MAX_AREA_ERROR)
+        assert shapely.get_num_coordinates(clipped[0]) < shapely.get_num_coordinates(region_germany)
+        assert clipped[0].area == pytest.approx(region_germany.area, rel=MAX_AREA_ERROR)
+        grid, expected_grid = result[calc.GRIDDED_EMISSIONS_KEY], expected[calc.GRIDDED_EMISSIONS_KEY]
+        assert grid["Area [km²]"].sum() == pytest.approx(expected_grid["Area [km²]"].sum(), rel=MAX_AREA_ERROR)
+        assert result[calc.TOTAL_EMISSIONS_KEY].iloc[-1, 0] == \
+            pytest.approx(expected[calc.TOTAL_EMISSIONS_KEY].iloc[-1, 0], rel=.01)
+
+    @pytest.mark.parametrize("tile_size, sectors", [(None, False), (3, True)])
+    def test_run_adaptive(self, region_germany, clipped_data_file_name, tile_size, sectors, monkeypatch, tmp_path):
+        from eocalc.context import GNFR
+        from eocalc.corrections import LifetimeCorrection
+        from eocalc.proxies import SectorProxies, Proxy
+
+        proxies = None
+        if sectors:
+            raster = tmp_path / "population.asc"
+            numpy.savetxt(raster, numpy.random.default_rng(42).uniform(0, 100, (80, 80)), fmt="%.2f",
+                          header="ncols 80\nnrows 80\nxllcorner 5\nyllcorner 47\ncellsize .125", comments="")
+            proxies = SectorProxies({GNFR.C_OtherStationaryComb: Proxy(str(raster), 20)}, cache_folder=None)
+        calc = TropomiMonthlyMeanAggregator(proxies=proxies, correction=LifetimeCorrection() if sectors else None)
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        period = DateRange(start='2018-08-01', end='2018-08-03')
+
+        expected = calc.run(region_germany, period, Pollutant.NO2)
+        result = calc.run(region_germany, period, Pollutant.NO2, tile_size=tile_size, adaptive=True)
+
+        # Same table, from far fewer geometries
+        table = expected[calc.TOTAL_EMISSIONS_KEY]
+        assert table.isna().equals(result[calc.TOTAL_EMISSIONS_KEY].isna())
+        assert table.fillna(0).to_numpy() == pytest.approx(result[calc.TOTAL_EMISSIONS_KEY].fillna(0).to_numpy(),
+                                                           rel=1e-12)
+        grid, blocks = expected[calc.GRIDDED_EMISSIONS_KEY], result[calc.GRIDDED_EMISSIONS_KEY]
+        assert list(grid.columns) == list(blocks.columns)
+        assert len(blocks) < len(grid) / 3
+        for column in grid.columns[[0, 1, 4, 5, 6]]:
+            assert grid[column].sum() == pytest.approx(blocks[column].sum(), rel=1e-12)
+        assert 0 == pytest.approx(grid.union_all().symmetric_difference(blocks.union_all()).area, abs=1e-12)
+
+        # Block rows cover all their cells' values
+        merged = blocks[blocks["Number of values [1]"] > len(period)]
+        assert len(merged) > 0 and (merged["Number of values [1]"] % len(period) == 0).all()
+        assert merged.iloc[:, 1].to_numpy() == pytest.approx(merged.iloc[:, -6:-3].sum(axis=1).to_numpy())
+
+    def test_quadtree(self, region_saxony):
+        from shapely.geometry import box
+
+        blocks, cells = TropomiMonthlyMeanAggregator._quadtree(region_saxony, 8)
+        assert {1, 2, 4} <= set(blocks[:, 2]) <= {1, 2, 4, 8}
+        assert (blocks[:, :2] % blocks[:, 2:] == 0).all()
+
+        # Blocks are inside, cells on the boundary, together they cover the region without overlaps
+        size = naive.TEMIS_BIN_WIDTH
+        boxes = [box(-180 + column * size, -90 + row * size, -180 + (column + width) * size, -90 + (row + width) * size)
+                 for row, column, width in blocks] + \
+            [box(-180 + column * size, -90 + row * size, -180 + (column + 1) * size, -90 + (row + 1) * size)
+             for row, column in cells]
+        assert all(region_saxony.covers(block) for block in boxes[:len(blocks)])
+        assert all(region_saxony.intersects(cell) and not region_saxony.covers(cell) for cell in boxes[len(blocks):])
+        assert sum(block.area for block in boxes) == pytest.approx(shapely_union(boxes).area)
+        assert shapely_union(boxes).covers(region_saxony)
+
+        with pytest.raises(ValueError):
+            TropomiMonthlyMeanAggregator._quadtree(region_saxony, 6)
+
+    @pytest.mark.parametrize("region, period", [
+        ("region_saxony", DateRange(start='2018-08-01', end='2018-08-31')),
+        ("region_saxony", DateRange(start='2018-07-30', end='2018-08-02')),
+        ("region_germany", DateRange(start='2018-08-10', end='2018-08-10'))
+    ])
+    def test_run_totals(self, calc, region, period, clipped_data_file_name, monkeypatch, request):
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        region = request.getfixturevalue(region)
+
+        expected = calc.run(region, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY].loc["Totals"]
+        totals = calc.run_totals(region, period, Pollutant.NO2)
+        assert expected.iloc[0] == pytest.approx(totals.value)
+        assert expected.iloc[1] == pytest.approx(totals.umin)
+        assert expected.iloc[2] == pytest.approx(totals.umax)
+
+    def test_run_totals_many(self, calc, region_germany, region_saxony, clipped_data_file_name, monkeypatch):
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        regions = {"germany": region_germany, "saxony": region_saxony}
+        periods = [DateRange("2018-08-01", "2018-08-31"), DateRange("2018-07-30", "2018-08-02"),
+                   DateRange("2018-08-10", "2018-08-10")]
+
+        results = calc.run_totals_many(regions, periods, Pollutant.NO2)
+        assert {(name, period) for name in regions for period in periods} == set(results)
+        for (name, period), totals in results.items():
+            expected = calc.run(regions[name], period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY].loc["Totals"]
+            assert expected.iloc[0] == pytest.approx(totals.value)
+            assert expected.iloc[1] == pytest.approx(totals.umin)
+        assert 22.54838 == pytest.approx(results[("germany", periods[0])].value, abs=1e-5)
+        assert 100 == calc.progress
+
+        # Data cache gives the same results
+        cached = TropomiMonthlyMeanAggregator(cache=naive.TemisDataCache())
+        monkeypatch.setattr(cached, "_assure_data_availability", lambda day: clipped_data_file_name)
+        assert results == cached.run_totals_many(regions, periods, Pollutant.NO2)
+
+        with pytest.raises(ValueError):
+            calc.run_totals_many(regions, [DateRange("2017-08-01", "2017-08-31")], Pollutant.NO2)
+
+    def test_run_totals_many_validates_once(self, calc, region_germany, region_saxony, clipped_data_file_name,
+                                            monkeypatch):
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        checked = []
+        validate = calc._validate_region
+        monkeypatch.setattr(calc, "_validate_region", lambda region: checked.append(region) or validate(region))
+
+        periods = [DateRange("2018-08-01", "2018-08-31")] + [DateRange(day, day) for day in DateRange("2018-08-01",
+                                                                                                       "2018-08-10")]
+        results = calc.run_totals_many({"germany": region_germany, "saxony": region_saxony}, periods, Pollutant.NO2)
+        assert 22 == len(results)
+        assert [region_germany, region_saxony] == checked
+
+    @pytest.mark.parametrize("sectors", [False, True])
+    def test_run_hierarchy(self, region_germany, region_saxony, clipped_data_file_name, sectors, monkeypatch,
+                           tmp_path):
+        from shapely.geometry import box
+        from eocalc.context import GNFR
+        from eocalc.corrections import LifetimeCorrection
+        from eocalc.proxies import SectorProxies, Proxy
+
+        proxies = None
+        if sectors:
+            raster = tmp_path / "population.asc"
+            numpy.savetxt(raster, numpy.random.default_rng(42).uniform(0, 100, (80, 80)), fmt="%.2f",
+                          header="ncols 80\nnrows 80\nxllcorner 5\nyllcorner 47\ncellsize .125", comments="")
+            proxies = SectorProxies({GNFR.C_OtherStationaryComb: Proxy(str(raster), 20)}, cache_folder=None)
+        calc = TropomiMonthlyMeanAggregator(proxies=proxies, correction=LifetimeCorrection() if sectors else None)
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        regions = {"germany": region_germany, "west": region_germany.intersection(box(0, 40, 10, 60)),
+                   "east": region_germany.intersection(box(10, 40, 20, 60)),
+                   "saxony": region_saxony.intersection(region_germany), "poland": box(20, 50, 22, 52)}
+        parents = {"west": "germany", "east": "germany", "saxony": "east"}
+        period = DateRange("2018-08-01", "2018-08-31")
+
+        # Each area is clipped only once
+        tiles = []
+        process = calc._process_tile
+        monkeypatch.setattr(calc, "_process_tile", lambda tile, *args: tiles.append(tile) or process(tile, *args))
+        tables = calc.run_hierarchy(regions, parents, period, Pollutant.NO2)
+        assert region_germany.area + 4 == pytest.approx(sum(tile.area for tile in tiles))
+        assert 100 == calc.progress
+
+        for name, region in regions.items():
+            expected = calc.run(region, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY]
+            assert expected.isna().equals(tables[name].isna())
+            assert expected.fillna(0).to_numpy() == pytest.approx(tables[name].fillna(0).to_numpy(), rel=1e-8)
+        if not sectors:
+            assert 22.54838 == pytest.approx(tables["germany"].loc["Totals"].iloc[0], abs=1e-5)
+
+    def test_storage_modes(self, region_saxony, clipped_data_file_name, monkeypatch):
+        period = DateRange(start='2018-08-01', end='2018-08-31')
+        results = {}
+        for storage in naive.TEMIS_STORAGE_MODES:
+            calc = TropomiMonthlyMeanAggregator(storage=storage)
+            monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+            results[storage] = calc.run(region_saxony, period, Pollutant.NO2)
+        expected = results["float64"]
+
+        assert 1.49627 == pytest.approx(expected[calc.TOTAL_EMISSIONS_KEY].loc["Totals"].iloc[0], abs=1e-5)
+        for storage in ("float32", "int16"):
+            grid, table = results[storage][calc.GRIDDED_EMISSIONS_KEY], results[storage][calc.TOTAL_EMISSIONS_KEY]
+            daily = grid.iloc[:, -(len(period) + 3):-3]
+            assert (daily.dtypes == numpy.float32).all()
+            assert numpy.allclose(expected[calc.GRIDDED_EMISSIONS_KEY].iloc[:, -(len(period) + 3):-3], daily,
+                                  rtol=2e-7, atol=0, equal_nan=True)
+            assert list(expected[calc.GRIDDED_EMISSIONS_KEY]["Missing values [1]"]) == list(grid["Missing values [1]"])
+            assert list(expected[calc.TOTAL_EMISSIONS_KEY].loc["Totals"]) == \
+                pytest.approx(list(table.loc["Totals"]), rel=1e-6)
+
+        with pytest.raises(ValueError):
+            TropomiMonthlyMeanAggregator(storage="float16")
+        with pytest.raises(ValueError):
+            TropomiDailyAggregator(storage="int16")
+
+    @pytest.mark.parametrize("cache", [False, True])
+    def test_storage_modes_totals_many(self, region_germany, region_saxony, clipped_data_file_name, cache,
+                                       monkeypatch):
+        regions = {"germany": region_germany, "saxony": region_saxony}
+        periods = [DateRange("2018-08-01", "2018-08-31"), DateRange("2018-08-10", "2018-08-12")]
+        results, raw = {}, {}
+        for storage in naive.TEMIS_STORAGE_MODES:
+            calc = TropomiMonthlyMeanAggregator(cache=naive.TemisDataCache() if cache else None, storage=storage)
+            monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+            results[storage] = calc.run_totals_many(regions, periods, Pollutant.NO2)
+            raw[storage] = calc._read_raw_cells(numpy.arange(3_248_600, 3_248_700), periods[0].start)
+
+        assert results["float64"] == results["float32"] == results["int16"]
+        assert [numpy.float64, numpy.float32, numpy.int16] == [raw[mode].dtype for mode in naive.TEMIS_STORAGE_MODES]
+        assert numpy.array_equal(raw["float64"], raw["int16"]) and not numpy.isnan(raw["float64"]).any()
+
+    def test_storage_memory(self, region_germany, clipped_data_file_name, monkeypatch):
+        # Long period over a large region: memory of the raw month values and of the per-day grid columns
+        period = DateRange(start='2018-08-01', end='2018-09-30')
+        usage = {}
+        for storage in ("float64", "int16"):
+            calc = TropomiMonthlyMeanAggregator(storage=storage)
+            monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+            grid = calc.run(region_germany, period, Pollutant.NO2)[calc.GRIDDED_EMISSIONS_KEY]
+            usage[storage] = (calc._read_raw(region_germany, period.start).nbytes,
+                              grid.iloc[:, -(len(period) + 3):-3].memory_usage(index=False).sum())
+
+        assert usage["int16"][0] * 4 == usage["float64"][0]
+        assert usage["int16"][1] * 2 == usage["float64"][1]
+
+    def test_concurrent_runs_on_one_instance(self, region_germany, region_saxony, clipped_data_file_name,
+                                             monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from eocalc.methods.base import RunHandle, Status
+
+        calc = TropomiMonthlyMeanAggregator(cache=naive.TemisDataCache())
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped_data_file_name)
+        jobs = [(region_saxony, DateRange('2018-08-01', '2018-08-31')),
+                (region_saxony, DateRange('2018-08-05', '2018-08-05')),
+                (region_germany, DateRange('2018-08-10', '2018-08-11')),
+                (region_saxony, DateRange('2018-08-01', '2018-08-31'))]
+        expected = [calc.run(region, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY] for region, period in jobs]
+
+        handles = [RunHandle() for _ in jobs]
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            results = list(executor.map(lambda job, handle: calc.run(*job, Pollutant.NO2, handle=handle),
+                                        jobs, handles))
+
+        for table, result, handle in zip(expected, results, handles):
+            assert list(table.loc["Totals"]) == pytest.approx(list(result[calc.TOTAL_EMISSIONS_KEY].loc["Totals"]))
+            assert (Status.READY, 100) == (handle.state, handle.progress)
+            assert {"read", "grid", "table", "total"} == set(handle.timings)
+
+        handle = RunHandle()
+        calc.run_totals(region_saxony, DateRange('2018-08-01', '2018-08-31'), Pollutant.NO2, handle=handle)
+        assert {"weights", "read", "aggregate", "total"} == set(handle.timings)
+
     def test_assure_data_availability(self, calc):
         day = date.fromisoformat("2018-09-15")
         file = calc._assure_data_availability(day)
@@ -115,3 +406,100 @@ class TestTropomiMonthlyMeanAggregatorMethods:
 
         os.remove(file)
         assert f"{LOCAL_DATA_FOLDER}/no2_201809.asc" == calc._assure_data_availability(day)
+
+
+def write_toms_file(file, value, lats=range(792, 824), missing=()):
+    """Write synthetic TOMS file with constant value for given latitude rows (row 0 is at -90°)."""
+    with open(file, 'w') as data:
+        data.write("Synthetic daily tropospheric NO2 columns\n")
+        data.write("units: 1e13 molecules/cm2, undef=-999\n")
+        for row in lats:
+            data.write(f"lat= {-90 + row * 0.125 + 0.0625:9.4f}\n")
+            values = [-999 if (row, column) in missing else value for column in range(2880)]
+            for start in range(0, 2880, 20):
+                data.write("".join(f"{v:4d}" for v in values[start:start + 20]) + "\n")
+
+
+@pytest.fixture
+def daily_calc(tmp_path, monkeypatch):
+    monkeypatch.setattr(naive, "LOCAL_DAILY_DATA_FOLDER", str(tmp_path))
+    for day, value in zip(DateRange("2019-03-01", "2019-03-03"), [10, 20, 30]):
+        write_toms_file(tmp_path / f"no2_{day:%Y%m%d}.asc", value)
+    return TropomiDailyAggregator()
+
+
+@pytest.fixture
+def region_synthetic():
+    return shape({"type": "MultiPolygon",
+                  "coordinates": [[[[10., 10.], [12., 10.], [12., 12.], [10., 12.], [10., 10.]]]]})
+
+
+class TestTropomiDailyAggregatorMethods:
+
+    @pytest.mark.parametrize("file, region", [
+        ("clipped_data_file_name", "region_small_but_well_known"),
+        ("clipped_data_file_name", "region_small_but_well_known_other"),
+        ("clipped_data_file_name", "region_small_but_well_known_third"),
+        ("clipped_data_file_name", "region_saxony")
+    ])
+    def test_read_toms_array(self, calc, file, region, request):
+        region, file = request.getfixturevalue(region), request.getfixturevalue(file)
+        expected = numpy.array(calc._read_toms_data(region, file), dtype=float)
+        assert numpy.array_equal(expected, calc._read_toms_array(region, file), equal_nan=True)
+
+    def test_stream_days_is_lazy(self, daily_calc, region_synthetic):
+        days = daily_calc._stream_days(region_synthetic, DateRange("2019-03-01", "2019-03-04"))
+        assert numpy.allclose(daily_calc._to_kg_per_km2(10), next(days))
+        assert numpy.allclose(daily_calc._to_kg_per_km2(20), next(days))
+        assert 25 == daily_calc.progress
+
+    def test_accumulate(self, daily_calc):
+        days = iter([numpy.array([1., numpy.nan, -2.]), numpy.array([3., numpy.nan, 2.])])
+        totals, absolutes, squares, counts = daily_calc._accumulate(days, 3)
+        assert [4, 0, 0] == totals.tolist()
+        assert [4, 0, 4] == absolutes.tolist()
+        assert numpy.allclose([10 * naive.TEMIS_CELL_UNCERTAINTY ** 2, 0, 8 * naive.TEMIS_CELL_UNCERTAINTY ** 2],
+                              squares)
+        assert [2, 0, 2] == counts.tolist()
+
+    def test_run(self, daily_calc, region_synthetic):
+        result = daily_calc.run(region_synthetic, DateRange("2019-03-01", "2019-03-03"), Pollutant.NO2)
+        grid, table = result[daily_calc.GRIDDED_EMISSIONS_KEY], result[daily_calc.TOTAL_EMISSIONS_KEY]
+
+        assert 256 == len(grid)
+        assert (grid["Missing values [1]"] == 0).all()
+        assert (grid["Number of values [1]"] == 3).all()
+        expected = daily_calc._to_kg_per_km2(10 + 20 + 30) * grid["Area [km²]"].sum() / 10**6
+        assert expected == pytest.approx(table.iloc[-1, 0])
+        cell = (10**2 + 20**2 + 30**2) ** 0.5 * naive.TEMIS_CELL_UNCERTAINTY / 60
+        assert numpy.allclose(cell, grid["Umin [%]"])
+        assert table.iloc[-1, 1] == pytest.approx(cell / 16, rel=.01)
+        assert 100 == daily_calc.progress
+
+    def test_run_matches_per_day_reference(self, daily_calc, region_synthetic, tmp_path):
+        write_toms_file(tmp_path / "no2_20190302.asc", 20, missing={(805, 1520), (806, 1521)})
+        result = daily_calc.run(region_synthetic, DateRange("2019-03-01", "2019-03-03"), Pollutant.NO2)
+        grid = result[daily_calc.GRIDDED_EMISSIONS_KEY]
+
+        assert 2 == grid["Missing values [1]"].sum()
+        for _, row in grid[grid["Missing values [1]"] > 0].iterrows():
+            assert daily_calc._to_kg_per_km2(40) * row["Area [km²]"] == pytest.approx(row.iloc[1])
+            assert daily_calc._combine_uncertainties(
+                daily_calc._to_kg_per_km2(Series([10, 30])), Series([naive.TEMIS_CELL_UNCERTAINTY] * 2)) == \
+                pytest.approx(row["Umin [%]"])
+
+    def test_run_totals(self, daily_calc, region_synthetic):
+        period = DateRange("2019-03-01", "2019-03-03")
+        table = daily_calc.run(region_synthetic, period, Pollutant.NO2)[daily_calc.TOTAL_EMISSIONS_KEY]
+        totals = daily_calc.run_totals(region_synthetic, period, Pollutant.NO2)
+        assert table.loc["Totals"].tolist() == pytest.approx([totals.value, totals.umin, totals.umax])
+
+        # Sum over all days, not the first day's value for each of them
+        first = daily_calc.run_totals(region_synthetic, DateRange("2019-03-01", "2019-03-01"), Pollutant.NO2)
+        assert 6 * first.value == pytest.approx(totals.value)
+
+        periods = [period, DateRange("2019-03-02", "2019-03-03")]
+        many = daily_calc.run_totals_many({"synthetic": region_synthetic}, periods, Pollutant.NO2)
+        assert totals == many[("synthetic", period)]
+        assert 5 * first.value == pytest.approx(many[("synthetic", periods[1])].value)
+        assert 100 == daily_calc.progress
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import pytest
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from shapely.geometry import box
+
+from eocalc.context import GNFR, Pollutant
+from eocalc.methods.base import DateRange, EOEmissionCalculator
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+from eocalc.proxies import Proxy, SectorProxies, align, read_raster, read_points
+from eocalc.weighting import GridSpec
+
+
+@pytest.fixture
+def grid():
+    return GridSpec(1)
+
+
+@pytest.fixture
+def raster(tmp_path):
+    # Two by three cells of two degrees, lower left corner at (10°, 50°), first line is the northern row
+    file = tmp_path / "roads.asc"
+    file.write_text("ncols 3\nnrows 2\nxllcorner 10\nyllcorner 50\ncellsize 2\nNODATA_value -9999\n"
+                    "4 -9999 8\n0 12 16\n")
+    return file
+
+
+@pytest.fixture
+def points(tmp_path):
+    file = tmp_path / "plants.csv"
+    file.write_text("longitude,latitude,weight\n10.5,50.5,3\n10.7,50.2,1\n14.5,53.5,2\n")
+    return file
+
+
+@pytest.fixture
+def proxies(raster, points):
+    return SectorProxies({GNFR.F_RoadTransport: Proxy(str(raster), 10), GNFR.A_PublicPower: Proxy(str(points))},
+                         cache_folder=None)
+
+
+class TestReaders:
+
+    def test_read_raster(self, raster, tmp_path):
+        values, long, lat, size = read_raster(raster)
+        assert (10, 50, 2) == (long, lat, size)
+        assert [[0, 12, 16], [4, -1, 8]] == numpy.nan_to_num(values, nan=-1).tolist()
+
+        centered = tmp_path / "centered.asc"
+        centered.write_text("ncols 1\nnrows 1\nxllcenter 10.5\nyllcenter 50.5\ncellsize 1\n7\n")
+        assert (10, 50, 1) == read_raster(centered)[1:]
+
+    def test_read_points(self, points):
+        longs, lats, weights = read_points(points)
+        assert [10.5, 10.7, 14.5] == longs.tolist()
+        assert [3, 1, 2] == weights.tolist()
+
+    def test_align(self, grid):
+        cells, values = align([10.5, 10.7, 14.5, 200, 0], [50.5, 50.2, 53.5, 0, 0], [3, 1, 2, 5, numpy.nan], grid)
+        assert [140 * 360 + 190, 143 * 360 + 194] == cells.tolist()
+        assert [4, 2] == values.tolist()
+        assert [190 + 140 * 360, -1] == grid.cells([10.5, 180], [50.5, 0]).tolist()
+
+
+class TestSectorProxies:
+
+    def test_aligned(self, proxies, grid):
+        aligned = proxies.aligned(grid)
+        assert (len(GNFR), len(grid)) == aligned.shape
+        dense = aligned.to_dense()
+
+        # Raster cells are larger than grid cells, their values are spread evenly
+        roads = dense[list(GNFR).index(GNFR.F_RoadTransport)]
+        assert 4 + 8 + 12 + 16 == pytest.approx(roads.sum())
+        assert [3, 3, 3, 3] == roads[[140 * 360 + 192, 140 * 360 + 193, 141 * 360 + 192, 141 * 360 + 193]].tolist()
+        assert 0 == roads[142 * 360 + 192]  # Missing value
+
+        plants = dense[list(GNFR).index(GNFR.A_PublicPower)]
+        assert 4 == plants[140 * 360 + 190]
+        assert 6 == plants.sum()
+
+        # Built once per grid
+        assert aligned is proxies.aligned(grid)
+        assert aligned is not proxies.aligned(GridSpec(grid.cell_size / 2))
+
+    def test_split(self, proxies, grid):
+        cells = numpy.array([140 * 360 + 190, 140 * 360 + 190, 140 * 360 + 192, 0])
+        sectors = proxies.split(cells, numpy.array([10., 20., 5., 7.]), numpy.array([50., 50., 20., 30.]), grid)
+        assert (len(GNFR), 3) == sectors.shape
+        road, power, other = (list(GNFR).index(sector)
+                              for sector in (GNFR.F_RoadTransport, GNFR.A_PublicPower, GNFR.M_Other))
+
+        # First cell: 0/4 (roads have value 0 there) and 4/4 (power plants), third cell all roads, last fallback
+        assert 30 == pytest.approx(sectors[power, 0])
+        assert 5 == pytest.approx(sectors[road, 0])
+        assert 7 == pytest.approx(sectors[other, 0])
+        assert 10 + 20 + 5 + 7 == pytest.approx(sectors[:, 0].sum())
+        assert 0 == sectors[list(GNFR).index(GNFR.B_Industry), 0]
+
+        # Uncertainties combine per sector, proxy uncertainty is added per cell
+        assert (10 ** 2 + 20 ** 2) ** .5 * 50 / 30 == pytest.approx(sectors[power, 1])
+        assert (20 ** 2 + 10 ** 2) ** .5 == pytest.approx(sectors[road, 1])
+        assert 30 == pytest.approx(sectors[other, 2])
+
+    def test_split_without_proxies(self, grid):
+        sectors = SectorProxies({}, fallback=GNFR.N_Natural).split([5, 6], [1., 2.], [10., 10.], grid)
+        assert 3 == sectors[list(GNFR).index(GNFR.N_Natural), 0]
+        assert 3 == sectors[:, 0].sum()
+        assert (len(GNFR), 3) == SectorProxies({}).split([], [], [], grid).shape
+
+    def test_invalid(self, tmp_path):
+        with pytest.raises(ValueError):
+            SectorProxies({GNFR.F_RoadTransport: Proxy("roads.tif")})
+
+        config = tmp_path / "sectors.json"
+        config.write_text(json.dumps({"X_Unknown": {"file": "roads.asc"}}))
+        with pytest.raises(KeyError):
+            SectorProxies.from_config(str(config))
+
+    def test_from_config(self, raster, points, tmp_path):
+        config = tmp_path / "sectors.json"
+        config.write_text(json.dumps({"F_RoadTransport": {"file": raster.name, "uncertainty": 10},
+                                      "C_OtherStationaryComb": {"file": raster.name},
+                                      "fallback": "N_Natural"}))
+        proxies = SectorProxies.from_config(str(config), cache_folder=None)
+        assert Proxy(str(raster), 10) == proxies.proxies[GNFR.F_RoadTransport]
+        assert 0 == proxies.proxies[GNFR.C_OtherStationaryComb].uncertainty
+        assert GNFR.N_Natural == proxies.fallback
+
+    def test_cache(self, raster, points, grid, tmp_path):
+        folder = tmp_path / "cache"
+        proxies = {GNFR.F_RoadTransport: Proxy(str(raster)), GNFR.C_OtherStationaryComb: Proxy(str(raster))}
+        first = SectorProxies(proxies, cache_folder=str(folder)).aligned(grid)
+        assert 1 == len(list(folder.glob("*.npz")))  # Same file, aligned once
+
+        second = SectorProxies(proxies, cache_folder=str(folder)).aligned(grid)
+        assert first.to_dense().tolist() == second.to_dense().tolist()
+        SectorProxies(proxies, cache_folder=str(folder)).aligned(GridSpec(.5))
+        assert 2 == len(list(folder.glob("*.npz")))
+
+        # Changed file invalidates the cache
+        raster.write_text("ncols 1\nnrows 1\nxllcorner 10\nyllcorner 50\ncellsize 1\n99\n")
+        changed = SectorProxies(proxies, cache_folder=str(folder)).aligned(grid)
+        assert 2 * 99 == changed.to_dense().sum()
+
+    def test_concurrent(self, proxies, grid):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: proxies.aligned(grid).to_dense().sum(), range(8)))
+        assert [results[0]] * 8 == results
+
+
+class TestDisaggregation:
+
+    @pytest.fixture
+    def region(self):
+        return box(12.3, 50.4, 14.9, 51.6)
+
+    @pytest.fixture
+    def calc(self, tmp_path, monkeypatch):
+        # Population-like raster at the TEMIS resolution, one point source
+        rng = numpy.random.default_rng(42)
+        raster, plants = tmp_path / "population.asc", tmp_path / "plants.csv"
+        numpy.savetxt(raster, rng.uniform(0, 100, (16, 32)), fmt="%.2f",
+                      header="ncols 32\nnrows 16\nxllcorner 12\nyllcorner 50\ncellsize .125", comments="")
+        plants.write_text("longitude,latitude,weight\n13.4,51.1,500\n")
+        proxies = SectorProxies({GNFR.C_OtherStationaryComb: Proxy(str(raster), 20),
+                                 GNFR.A_PublicPower: Proxy(str(plants), 5)}, cache_folder=None)
+
+        calc = TropomiMonthlyMeanAggregator(proxies=proxies)
+        clipped = "data/methods/temis/tropomi/no2/monthly_mean/no2_201808_clipped.asc"
+        monkeypatch.setattr(calc, "_assure_data_availability", lambda day: clipped)
+        return calc
+
+    def test_run(self, calc, region):
+        period = DateRange("2018-08-01", "2018-08-31")
+        table = calc.run(region, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY]
+
+        plain = TropomiMonthlyMeanAggregator()
+        plain._assure_data_availability = calc._assure_data_availability
+        expected = plain.run(region, period, Pollutant.NO2)[calc.TOTAL_EMISSIONS_KEY]
+
+        assert list(expected.loc["Totals"]) == pytest.approx(list(table.loc["Totals"]))
+        assert table.iloc[:len(GNFR), 0].sum() == pytest.approx(table.loc["Totals"].iloc[0])
+        assert not table.isna().any().any()
+        assert 0 < table.loc[GNFR.A_PublicPower].iloc[0] < table.loc[GNFR.C_OtherStationaryComb].iloc[0]
+        assert 0 == table.loc[GNFR.B_Industry].iloc[0]
+        assert table.loc[GNFR.C_OtherStationaryComb].iloc[1] > table.loc["Totals"].iloc[1]
+        assert expected.iloc[:len(GNFR)].isna().all().all()
+
+    def test_large_region_overhead(self, calc):
+        # Splitting is a few vectorized operations, so it must not depend much on the number of cells
+        proxies = calc._proxies
+        grid = GridSpec(.125)
+        rng = numpy.random.default_rng(0)
+        cells = rng.integers(0, len(grid), 500_000)
+        values, uncertainties = rng.uniform(0, 10, len(cells)), rng.uniform(0, 100, len(cells))
+        proxies.split(cells[:10], values[:10], uncertainties[:10], grid)  # Aligns proxies
+
+        start = time.perf_counter()
+        sectors = proxies.split(cells, values, uncertainties, grid)
+        assert time.perf_counter() - start < 2
+        assert values.sum() == pytest.approx(sectors[:, 0].sum())
+
+        table = EOEmissionCalculator._fill_gnfr_table(EOEmissionCalculator._create_gnfr_table(Pollutant.NO2), sectors)
+        assert values.sum() == pytest.approx(table.loc["Totals"].iloc[0])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pytest
+import json
+import os
+import shutil
+
+from shapely.geometry import MultiPolygon, shape
+
+from eocalc.regions import RegionRegistry
+
+
+def vertex_count(region):
+    return sum(len(p.exterior.coords) + sum(len(i.coords) for i in p.interiors) for p in region.geoms)
+
+
+@pytest.fixture
+def directory(tmp_path):
+    shutil.copytree("data/regions", tmp_path / "regions")
+    return tmp_path / "regions"
+
+
+@pytest.fixture
+def registry(directory, tmp_path):
+    return RegionRegistry(directory, tmp_path / "cache")
+
+
+class TestRegionRegistry:
+
+    def test_names(self, registry):
+        assert "germany" in registry.names()
+        assert "roughly_saxonia" in registry.names()
+        assert len(os.listdir("data/regions")) == len(registry.names())
+
+    @pytest.mark.parametrize("name", ["germany", "roughly_saxonia", "new_zealand"])
+    def test_get(self, registry, name):
+        with open(f"data/regions/{name}.geo.json", 'r') as geojson_file:
+            expected = shape(json.load(geojson_file)["geometry"])
+
+        region = registry.get(name)
+        assert isinstance(region, MultiPolygon)
+        assert expected.equals(region)
+        assert region is registry.get(name)
+
+    def test_get_unknown(self, registry):
+        with pytest.raises(KeyError):
+            registry.get("atlantis")
+
+    def test_cache(self, registry, directory, tmp_path):
+        region = registry.get("germany")
+        assert (tmp_path / "cache" / "germany.wkb").exists()
+
+        with open(directory / "germany.geo.json", 'w') as geojson_file:
+            geojson_file.write("Not JSON at all, only readable from cache")
+        os.utime(directory / "germany.geo.json", (0, 0))
+        assert region.equals(RegionRegistry(directory, tmp_path / "cache").get("germany"))
+
+    def test_cache_outdated(self, registry, directory, tmp_path):
+        registry.get("roughly_saxonia")
+        shutil.copy(directory / "europe.geo.json", directory / "roughly_saxonia.geo.json")
+        os.utime(tmp_path / "cache" / "roughly_saxonia.wkb", (0, 0))
+        assert RegionRegistry(directory, tmp_path / "cache").get("roughly_saxonia").equals(registry.get("europe"))
+
+    def test_validate(self, directory, tmp_path):
+        with open(directory / "bowtie.geo.json", 'w') as geojson_file:
+            json.dump({"type": "Feature", "properties": {}, "geometry": {
+                "type": "Polygon", "coordinates": [[[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]]}}, geojson_file)
+        with open(directory / "line.geo.json", 'w') as geojson_file:
+            json.dump({"type": "Feature", "properties": {}, "geometry": {
+                "type": "LineString", "coordinates": [[0, 0], [1, 1]]}}, geojson_file)
+
+        registry = RegionRegistry(directory, tmp_path / "cache")
+        with pytest.raises(ValueError):
+            registry.get("bowtie")
+        with pytest.raises(ValueError):
+            registry.get("line")
+
+    @pytest.mark.parametrize("cell_size, max_area_error", [(.125, .001), (.125, .01), (.5, .01), (.01, .0001)])
+    def test_get_simplified(self, registry, cell_size, max_area_error, tmp_path):
+        region = registry.get("germany")
+        simplified = registry.get("germany", cell_size=cell_size, max_area_error=max_area_error)
+
+        assert simplified.is_valid
+        assert vertex_count(simplified) <= vertex_count(region)
+        assert region.symmetric_difference(simplified).area <= max_area_error * region.area
+        assert simplified is registry.get("germany", cell_size=cell_size, max_area_error=max_area_error)
+        assert (tmp_path / "cache" / f"germany-{cell_size}-{max_area_error}.wkb").exists()
+
+    def test_simplify_reduces_vertices(self, registry):
+        region = registry.get("germany")
+        assert vertex_count(RegionRegistry.simplify(region, .5, .05)) < vertex_count(region) / 2
+        assert vertex_count(RegionRegistry.simplify(region, .125, .05)) <= \
+               vertex_count(RegionRegistry.simplify(region, .125, .01))
+
+    def test_simplify_impossible(self, registry):
+        region = registry.get("germany")
+        simplified = RegionRegistry.simplify(region, .125, 0)
+        assert region.equals(simplified)
+        assert vertex_count(region) == vertex_count(simplified)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+
+import pytest
+from shapely.geometry import box
+
+from eocalc.context import Pollutant
+from eocalc.batch import load_regions
+from eocalc.methods import registry
+from eocalc.methods.base import DateRange
+from eocalc.methods.registry import MethodSpec, CapabilityIndex, discover, load
+from eocalc.methods.dummy import DummyEOEmissionCalculator
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TropomiDailyAggregator
+
+# Modules that make up the start-up cost of short-lived processes, like the CLI or batch workers
+STARTUP_MODULES = ("eocalc.methods.base", "eocalc.methods.registry", "eocalc.methods.dummy",
+                   "eocalc.methods.fluky", "eocalc.methods.naive", "eocalc.regions", "eocalc.batch")
+# Modules that must not be loaded just by importing any of the above
+HEAVY_MODULES = ("numpy", "pandas", "geopandas", "shapely", "pyproj", "urllib.request", "gzip")
+# Maximum cumulative import time per start-up module, loading the heavy modules takes about .5s [s]
+STARTUP_BUDGET = .2
+# Import times depend on the machine's load and file cache, check them with EOCALC_STARTUP_BUDGETS=1 python -m pytest
+STARTUP_BUDGETS = bool(os.environ.get("EOCALC_STARTUP_BUDGETS"))
+
+
+def import_times(statement: str) -> dict[str, float]:
+    """Run statement in a fresh interpreter with -X importtime, return cumulative import time per module [s]."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, check=True).stderr
+
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 10**6
+    return times
+
+
+class TestRegistry:
+
+    def test_discover(self):
+        methods = discover()
+        assert list(methods) == sorted(methods)
+        assert MethodSpec("DummyEOEmissionCalculator", "eocalc.methods.dummy") == methods["DummyEOEmissionCalculator"]
+        assert "TropomiDailyAggregator" in methods  # Derives from another method
+        assert "EOEmissionCalculator" not in methods
+        assert "TemisDataCache" not in methods
+
+        methods.clear()  # Callers get a copy
+        assert len(discover()) == 4
+
+    def test_load(self):
+        assert DummyEOEmissionCalculator is load("DummyEOEmissionCalculator")
+        assert TropomiMonthlyMeanAggregator is load("TropomiMonthlyMeanAggregator")
+        assert TropomiDailyAggregator is discover()["TropomiDailyAggregator"].load()
+        with pytest.raises(KeyError):
+            load("EOEmissionCalculator")
+        with pytest.raises(KeyError):
+            load("NoSuchMethod")
+
+    def test_discover_skips_abstract(self, tmp_path, monkeypatch):
+        package = tmp_path / "fakemethods"
+        package.mkdir()
+        (package / "__init__.py").write_text("")
+        (package / "base.py").write_text(
+            "from abc import ABC, abstractmethod\n"
+            "class EOEmissionCalculator(ABC):\n"
+            "    @abstractmethod\n    def run(self): pass\n"
+            "    @staticmethod\n    @abstractmethod\n    def supports(pollutant): pass\n")
+        (package / "some.py").write_text(
+            "import abc\nfrom fakemethods.base import EOEmissionCalculator\n"
+            "class Partial(EOEmissionCalculator):\n    def run(self): pass\n"
+            "class Complete(Partial):\n    @staticmethod\n    def supports(pollutant): return True\n"
+            "class AbstractAgain(Complete):\n    @abc.abstractmethod\n    def run(self): pass\n"
+            "class Unrelated:\n    def run(self): pass\n")
+        monkeypatch.syspath_prepend(str(tmp_path))
+
+        assert {"Complete": MethodSpec("Complete", "fakemethods.some")} == discover("fakemethods")
+        assert load("Complete", "fakemethods")().supports(None)
+        registry._specs.pop("fakemethods")
+
+
+class TestStartup:
+
+    @pytest.mark.parametrize("module", STARTUP_MODULES)
+    def test_no_heavy_imports(self, module):
+        times = import_times(f"import {module}")
+        assert module in times
+        assert [heavy for heavy in HEAVY_MODULES if heavy in times] == []
+
+    def test_discover_does_not_import_methods(self):
+        times = import_times("from eocalc.methods.registry import discover; discover()")
+        assert [name for name in times if name.startswith("eocalc.methods.") and name != "eocalc.methods.registry"] == []
+
+    @pytest.mark.skipif(not STARTUP_BUDGETS, reason="set EOCALC_STARTUP_BUDGETS=1 to check import times")
+    @pytest.mark.parametrize("module", STARTUP_MODULES)
+    def test_startup_budget(self, module):
+        # Best of three, to keep the benchmark stable on busy machines
+        seconds = min(import_times(f"import {module}")[module] for _ in range(3))
+        assert seconds < STARTUP_BUDGET, f"Importing {module} took {seconds:.3f}s, budget is {STARTUP_BUDGET}s"
+
+
+class TestCapabilityIndex:
+
+    @pytest.fixture(scope="class")
+    def index(self):
+        return CapabilityIndex()
+
+    @pytest.fixture(scope="class")
+    def regions(self):
+        return load_regions(["data/regions"])
+
+    def test_methods(self, index):
+        assert len(discover()) == len(index)
+        assert [spec.name for spec in discover().values()] == [method.__name__ for method in index.methods]
+        assert [DummyEOEmissionCalculator] == CapabilityIndex([DummyEOEmissionCalculator]).methods
+        assert {"germany": []} == CapabilityIndex([]).query_many({"germany": box(6, 48, 14, 54)},
+                                                                 DateRange("2019-01-01", "2019-01-31"), Pollutant.NO2)
+
+    def test_covering(self, index, regions):
+        covering = index.covering(regions)
+        assert list(regions) == list(covering)
+        for name, region in regions.items():
+            assert [method for method in index.methods if method.covers(region)] == covering[name]
+
+    @pytest.mark.parametrize("period", [DateRange("2019-01-01", "2019-01-31"), DateRange("2010-01-01", "2019-01-31"),
+                                        DateRange("2018-02-01", "2018-02-01"), DateRange("2099-01-01", "2099-01-01")])
+    @pytest.mark.parametrize("pollutant", list(Pollutant))
+    def test_query_many(self, index, regions, period, pollutant):
+        applicable = index.query_many(regions, period, pollutant)
+        for name, region in regions.items():
+            assert [method for method in index.methods if method.covers(region) and method.supports(pollutant) and
+                    method.earliest_start_date() <= period.start and period.end <= method.latest_end_date() and
+                    method.minimum_period_length() <= len(period)] == applicable[name]
+            assert applicable[name] == index.query(region, period, pollutant)
+
+    def test_query(self, index):
+        period = DateRange("2019-01-01", "2019-01-31")
+        saxony = box(12, 50.5, 15, 51.5)
+        assert TropomiMonthlyMeanAggregator in index.query(saxony, period, Pollutant.NO2)
+        assert TropomiMonthlyMeanAggregator not in index.query(saxony, period, Pollutant.SO2)
+        assert TropomiMonthlyMeanAggregator not in index.query(box(12, 70, 15, 71), period, Pollutant.NO2)
+        assert DummyEOEmissionCalculator in index.query(box(12, 70, 15, 71), period, Pollutant.NO2)
+        assert TropomiMonthlyMeanAggregator not in index.query(saxony, DateRange("2018-01-01", "2018-01-31"),
+                                                               Pollutant.NO2)
+        assert {} == index.query_many({}, period, Pollutant.NO2)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import pytest
+import time
+
+import numpy
+from pandas import DataFrame, concat
+from geopandas import GeoDataFrame
+from shapely.geometry import box
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, EOEmissionCalculator
+from eocalc.results import GridWriter, save, load, DAILY_COLUMN
+
+pyarrow = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def grid():
+    return GeoDataFrame({"Area [km²]": [1., 2.], "Missing values [1]": [0, 3],
+                         "geometry": [box(0, 0, 1, 1), box(1, 0, 2, 1)]}, crs="EPSG:4326")
+
+
+@pytest.fixture
+def results():
+    period, cells = DateRange("2018-01-01", "2020-12-31"), 2000
+    days = DataFrame(numpy.random.default_rng(42).random((cells, len(period))),
+                     columns=[f"{day} NO2 emissions [kg]" for day in period])
+    days.iloc[0, 0] = numpy.nan
+    grid = DataFrame({"Area [km²]": numpy.ones(cells), "Total NO2 emissions [kg]": days.sum(axis=1),
+                      "Missing values [1]": numpy.zeros(cells, dtype=int)})
+    grid = GeoDataFrame(concat([grid, days], axis=1).assign(
+        **{"Center latitude [°]": "0.0625", "geometry": [box(x * .125, 0, x * .125 + .125, .125) for x in range(cells)]}),
+        crs="EPSG:4326")
+    totals = EOEmissionCalculator._create_gnfr_table(Pollutant.NO2)
+    totals.iloc[-1] = [42., 5., 6.]
+    return {EOEmissionCalculator.TOTAL_EMISSIONS_KEY: totals, EOEmissionCalculator.GRIDDED_EMISSIONS_KEY: grid}
+
+
+class TestGridWriter:
+
+    def test_write_row_groups(self, grid, tmp_path):
+        from geopandas import read_parquet
+        import pyarrow.parquet
+
+        with GridWriter(tmp_path / "grid.parquet") as writer:
+            writer.write(grid)
+            writer.write(grid)
+
+        assert 2 == pyarrow.parquet.ParquetFile(tmp_path / "grid.parquet").num_row_groups
+        result = read_parquet(tmp_path / "grid.parquet")
+        assert 4 == len(result)
+        assert list(grid.columns) == list(result.columns)
+        assert result.crs == grid.crs
+        assert grid.geometry[1].equals(result.geometry[3])
+
+    def test_no_rows(self, tmp_path):
+        GridWriter(tmp_path / "grid.parquet").close()
+        assert not (tmp_path / "grid.parquet").exists()
+
+    def test_load(self, results, tmp_path):
+        grid = results[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY]
+        with GridWriter(tmp_path / "grid.parquet") as writer:
+            writer.write(grid.iloc[:1000])
+            writer.write(grid.iloc[1000:])
+
+        loaded = load(tmp_path / "grid.parquet")
+        assert EOEmissionCalculator.TOTAL_EMISSIONS_KEY not in loaded
+        assert grid.equals(loaded[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY])
+
+
+class TestSaveAndLoad:
+
+    @pytest.mark.parametrize("file", ["results.parquet", "results.arrow"])
+    def test_round_trip(self, results, file, tmp_path):
+        save(results, tmp_path / file)
+        loaded = load(tmp_path / file)
+
+        grid, loaded_grid = results[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY], \
+            loaded[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY]
+        assert list(grid.columns) == list(loaded_grid.columns)
+        assert grid.equals(loaded_grid)
+        assert grid.crs == loaded_grid.crs
+        assert numpy.isnan(loaded_grid.iloc[0, 3])
+
+        totals, loaded_totals = results[EOEmissionCalculator.TOTAL_EMISSIONS_KEY], \
+            loaded[EOEmissionCalculator.TOTAL_EMISSIONS_KEY]
+        assert list(totals.index) == list(loaded_totals.index)
+        assert totals.astype(float).equals(loaded_totals)
+
+    def test_daily_values_in_single_column(self, results, tmp_path):
+        import pyarrow.parquet
+
+        save(results, tmp_path / "results.parquet")
+        schema = pyarrow.parquet.read_schema(tmp_path / "results.parquet")
+        assert DAILY_COLUMN in schema.names
+        assert 6 == len(schema.names)
+        assert 1096 == schema.field(DAILY_COLUMN).type.list_size
+
+    def test_geoparquet(self, results, tmp_path):
+        from geopandas import read_parquet
+
+        save(results, tmp_path / "results.parquet")
+        assert results[EOEmissionCalculator.GRIDDED_EMISSIONS_KEY].geometry.equals(
+            read_parquet(tmp_path / "results.parquet").geometry)
+
+    @pytest.mark.parametrize("file", ["results.parquet", "results.arrow"])
+    def test_speed(self, results, file, tmp_path):
+        start = time.perf_counter()
+        save(results, tmp_path / file)
+        load(tmp_path / file)
+        assert time.perf_counter() - start < 1
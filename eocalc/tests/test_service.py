@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import pytest
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen, Request
+
+import numpy
+from shapely.geometry import shape
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange
+from eocalc.methods.fluky import RandomEOEmissionCalculator
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator, TropomiDailyAggregator, TemisDataCache
+from eocalc.service import EmissionService
+from eocalc.weighting import WeightCache
+
+
+@pytest.fixture
+def clipped_data_file_name():
+    return "data/methods/temis/tropomi/no2/monthly_mean/no2_201808_clipped.asc"
+
+
+@pytest.fixture
+def region_saxony():
+    with open("data/regions/roughly_saxonia.geo.json", 'r') as geojson_file:
+        return json.load(geojson_file)
+
+
+@pytest.fixture
+def service(clipped_data_file_name, monkeypatch):
+    naive = TropomiMonthlyMeanAggregator(cache=TemisDataCache(), weights=WeightCache(folder=None))
+    monkeypatch.setattr(naive, "_assure_data_availability", lambda day: clipped_data_file_name)
+    service = EmissionService(port=0, calculators={"TropomiMonthlyMeanAggregator": naive,
+                                                   "RandomEOEmissionCalculator": RandomEOEmissionCalculator()})
+    yield service.start()
+    service.stop()
+
+
+def post(service, body):
+    request = Request(f"{service.url}/run", data=json.dumps(body).encode(), method="POST",
+                      headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def get(service, path):
+    with urlopen(f"{service.url}{path}") as response:
+        return json.loads(response.read())
+
+
+class TestEmissionService:
+
+    def test_methods(self, service):
+        assert ["RandomEOEmissionCalculator", "TropomiMonthlyMeanAggregator"] == get(service, "/methods")["methods"]
+
+    def test_run_totals(self, service, region_saxony):
+        status, body = post(service, {"method": "TropomiMonthlyMeanAggregator", "region": region_saxony,
+                                      "period": "2018-08-01:2018-08-31", "pollutant": "NO2"})
+        assert 200 == status
+        assert 1.49 <= body["totals"]["value"] <= 1.5
+        assert 12.6 <= body["totals"]["umin"] <= 12.7
+        assert body["metrics"]["seconds"] > 0
+        assert "grid" not in body
+
+    def test_run_grid(self, service, region_saxony):
+        status, body = post(service, {"method": "TropomiMonthlyMeanAggregator", "region": region_saxony["geometry"],
+                                      "period": {"start": "2018-08-01", "end": "2018-08-03"}, "pollutant": "NO2",
+                                      "grid": True})
+        assert 200 == status
+        assert "FeatureCollection" == body["grid"]["type"]
+        assert not any(key.startswith("2018-08-01") for key in body["grid"]["features"][0]["properties"])
+        assert "Totals" == body["table"]["index"][-1]
+        assert body["totals"]["value"] == pytest.approx(body["table"]["data"][-1][0])
+
+    @pytest.mark.parametrize("body", [
+        {"method": "Unknown", "region": {}, "period": "2018-08-01:2018-08-31", "pollutant": "NO2"},
+        {"method": "TropomiMonthlyMeanAggregator", "period": "2018-08-01:2018-08-31", "pollutant": "NO2"},
+        {"method": "TropomiMonthlyMeanAggregator", "region": {"type": "Point", "coordinates": [1, 1]},
+         "period": "2018-08-01:2018-08-31", "pollutant": "NO2"},
+        {"method": "TropomiMonthlyMeanAggregator", "region": {"type": "Point", "coordinates": [1, 1]},
+         "period": "2018-08-01:2018-08-31", "pollutant": "XYZ"}
+    ])
+    def test_bad_requests(self, service, body):
+        status, response = post(service, body)
+        assert 400 == status
+        assert response["error"]
+        assert 1 == get(service, "/metrics")["errors"]
+
+    def test_concurrent_requests_share_data(self, service, region_saxony):
+        body = {"method": "TropomiMonthlyMeanAggregator", "region": region_saxony,
+                "period": "2018-08-01:2018-08-31", "pollutant": "NO2"}
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: post(service, body), range(8)))
+
+        assert all(200 == status for status, _ in results)
+        assert 1 == len({body["totals"]["value"] for _, body in results})
+        metrics = get(service, "/metrics")
+        assert 8 == metrics["requests"]
+        assert {"files": 1, "hits": 7, "misses": 1} == metrics["cache"]
+        assert 1 == metrics["weights"]["regions"]
+        assert 8 == metrics["weights"]["hits"] + metrics["weights"]["misses"]
+        assert metrics["latency"]["max"] >= metrics["latency"]["p50"] > 0
+
+    def test_unknown_path(self, service):
+        with pytest.raises(HTTPError):
+            get(service, "/nothing")
+
+    def test_daily_cache(self):
+        service = EmissionService(port=0)
+        try:
+            monthly = service.calculators["TropomiMonthlyMeanAggregator"]
+            daily = service.calculators["TropomiDailyAggregator"]
+            assert isinstance(daily, TropomiDailyAggregator)
+            assert monthly._cache is service.cache and daily._cache is not service.cache
+            assert monthly._weights is daily._weights is service.weights
+            assert "DummyEOEmissionCalculator" not in service.calculators  # Runs return no tables
+            assert all(calculator.returns_tables() for calculator in service.calculators.values())
+        finally:
+            service.stop()
+
+
+class TestTemisDataCache:
+
+    def test_window_matches_file(self, clipped_data_file_name, region_saxony):
+        region = shape(region_saxony["geometry"])
+        expected = TropomiMonthlyMeanAggregator._read_toms_array(region, clipped_data_file_name)
+        assert numpy.array_equal(expected, TemisDataCache().window(region, clipped_data_file_name), equal_nan=True)
+
+    def test_coalesce_loads(self, clipped_data_file_name, monkeypatch):
+        calls, gate = [], threading.Event()
+
+        def load(file):
+            calls.append(file)
+            gate.wait()
+            return numpy.zeros((2, 2))
+
+        monkeypatch.setattr(TropomiMonthlyMeanAggregator, "_read_toms_grid", staticmethod(load))
+        cache = TemisDataCache()
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            futures = [executor.submit(cache.get, clipped_data_file_name) for _ in range(6)]
+            gate.set()
+            grids = [future.result() for future in futures]
+
+        assert 1 == len(calls)
+        assert all(grid is grids[0] for grid in grids)
+        assert 1 == cache.misses
+
+    def test_size_limit(self, monkeypatch):
+        monkeypatch.setattr(TropomiMonthlyMeanAggregator, "_read_toms_grid", staticmethod(lambda f: numpy.zeros(1)))
+        cache = TemisDataCache(max_files=2)
+        for file in ["a", "b", "a", "c"]:
+            cache.get(file)
+
+        assert 2 == len(cache)
+        cache.get("a")
+        assert 2 == cache.hits
+        cache.get("b")
+        assert 4 == cache.misses
+
+    def test_run_with_cache(self, clipped_data_file_name, monkeypatch):
+        with open("data/regions/germany.geo.json", 'r') as geojson_file:
+            region = shape(json.load(geojson_file)["geometry"])
+        cache = TemisDataCache()
+        calc, cached_calc = TropomiMonthlyMeanAggregator(), TropomiMonthlyMeanAggregator(cache=cache)
+        for instance in (calc, cached_calc):
+            monkeypatch.setattr(instance, "_assure_data_availability", lambda day: clipped_data_file_name)
+
+        period = DateRange("2018-08-30", "2018-09-02")
+        assert calc.run_totals(region, period, Pollutant.NO2) == cached_calc.run_totals(region, period, Pollutant.NO2)
+        assert 1 == cache.misses
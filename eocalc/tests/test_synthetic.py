@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import pytest
+import os
+from datetime import date
+
+import numpy
+
+from eocalc.methods.naive import TropomiMonthlyMeanAggregator
+from eocalc.synthetic import synthetic_columns, write_toms_file, temis_file, generate, main, COMPRESSIONS
+from eocalc.tests.test_naive import region_saxony  # noqa: F401
+
+
+@pytest.fixture(scope="module")
+def january():
+    return synthetic_columns(date(2019, 1, 1))
+
+
+@pytest.fixture(scope="module")
+def january_file(january, tmp_path_factory):
+    file = temis_file(str(tmp_path_factory.mktemp("synthetic")), date(2019, 1, 1))
+    write_toms_file(file, january, date(2019, 1, 1))
+    return file
+
+
+class TestColumns:
+
+    def test_shape(self, january):
+        assert (1440, 2880) == january.shape
+        valid = january[~numpy.isnan(january)]
+        assert (valid == numpy.round(valid)).all()
+        assert -999 < valid.min() < 0 < 5 < numpy.median(valid) < 100 < valid.max() <= 9999
+
+    def test_reproducible(self, january):
+        assert numpy.array_equal(january, synthetic_columns(date(2019, 1, 31)), equal_nan=True)
+        assert not numpy.array_equal(january, synthetic_columns(date(2019, 1, 1), seed=1), equal_nan=True)
+
+    def test_seasons(self, january):
+        july = synthetic_columns(date(2019, 7, 1))
+        assert numpy.isnan(january[-10:]).all() and numpy.isnan(july[:10]).all()  # Polar night
+        assert not numpy.isnan(january[:10]).all() and not numpy.isnan(july[-10:]).all()
+        assert numpy.nanmean(january[1080:1200]) > 1.5 * numpy.nanmean(july[1080:1200])  # Winter in 45-60°N
+
+        # Same hot spots, but different noise and gaps
+        both = ~numpy.isnan(january[1080:1200]) & ~numpy.isnan(july[1080:1200])
+        assert .8 < numpy.corrcoef(january[1080:1200][both], july[1080:1200][both])[0, 1]
+        assert not numpy.array_equal(numpy.isnan(january[600:800]), numpy.isnan(july[600:800]))
+
+
+class TestFiles:
+
+    def test_read(self, january, january_file, region_saxony):
+        assert numpy.array_equal(january, TropomiMonthlyMeanAggregator._read_toms_grid(january_file), equal_nan=True)
+        assert numpy.array_equal(TropomiMonthlyMeanAggregator._window(january, region_saxony),
+                                 TropomiMonthlyMeanAggregator._read_toms_array(region_saxony, january_file),
+                                 equal_nan=True)
+        with open(january_file, 'r') as text:
+            assert text.readline().startswith("Synthetic")
+            assert 4 + 1440 * (1 + 2880 // 20) == 1 + sum(1 for _ in text)
+
+    @pytest.mark.parametrize("compression", list(COMPRESSIONS))
+    def test_compression(self, january, january_file, compression, tmp_path):
+        file = temis_file(str(tmp_path), date(2019, 1, 1), compression)
+        assert file.endswith(f".asc.{compression}")
+        write_toms_file(file, january, date(2019, 1, 1), compression)
+        with COMPRESSIONS[compression](file, 'rb') as compressed, open(january_file, 'rb') as plain:
+            assert plain.read() == compressed.read()
+        assert os.path.getsize(file) < os.path.getsize(january_file) / 3
+
+    def test_bad_compression(self, january, tmp_path):
+        with pytest.raises(ValueError):
+            write_toms_file(str(tmp_path / "no2.asc.zip"), january, date(2019, 1, 1), "zip")
+
+    def test_generate(self, january_file, tmp_path, capsys):
+        os.link(january_file, temis_file(str(tmp_path), date(2019, 1, 1)))
+        files = generate(date(2018, 12, 31), date(2019, 1, 1), str(tmp_path))
+        assert [f"{tmp_path}/no2_201812.asc", f"{tmp_path}/no2_201901.asc"] == files
+        assert 2 == os.stat(files[1]).st_nlink  # Existing file kept
+
+        assert 0 == main(["2019-02-01", "2019-02-28", "-o", str(tmp_path), "-c", "gz"])
+        assert os.path.isfile(f"{tmp_path}/no2_201902.asc") and os.path.isfile(f"{tmp_path}/no2_201902.asc.gz")
+        assert "Wrote 1 gz file(s)" in capsys.readouterr().out
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import pytest
+import json
+from datetime import date
+
+import numpy
+from pandas import DataFrame, Period, period_range
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, EmissionTotals
+from eocalc.methods.fluky import RandomEOEmissionCalculator
+from eocalc.batch import Job, JOURNAL_FILE, monthly_periods
+from eocalc.trends import monthly_matrix, read_batch, trends, _student_t_quantile, TREND_MINIMUM_MONTHS
+
+
+@pytest.fixture
+def months():
+    return period_range("2015-01", "2024-12", freq="M")
+
+
+@pytest.fixture
+def slopes():
+    return numpy.random.default_rng(0).normal(0, 1, 200)  # [kt/year]
+
+
+@pytest.fixture
+def matrix(months, slopes):
+    rng = numpy.random.default_rng(1)
+    years = numpy.arange(len(months)) / 12
+    values = 50 + slopes[:, numpy.newaxis] * years + 10 * numpy.sin(2 * numpy.pi * years) + \
+        rng.normal(0, 1, (len(slopes), len(months)))
+    return DataFrame(values, index=[f"region {index}" for index in range(len(slopes))], columns=months)
+
+
+class TestTrends:
+
+    def test_slopes(self, matrix, slopes):
+        result = trends(matrix)
+        assert list(matrix.index) == list(result.index)
+        assert (120 == result["Months [1]"]).all()
+        assert matrix.mean(axis=1).to_numpy() == pytest.approx(result["Mean [kt]"].to_numpy())
+        assert slopes == pytest.approx(result["Slope [kt/year]"].to_numpy(), abs=.1)
+        assert slopes == pytest.approx(result["Theil-Sen slope [kt/year]"].to_numpy(), abs=.1)
+        assert (100 * result["Theil-Sen slope [kt/year]"] / result["Mean [kt]"]).to_numpy() == \
+            pytest.approx(result["Trend [%/year]"].to_numpy())
+
+        # Intervals hold the true slope about as often as promised
+        for method in ["Slope", "Theil-Sen"]:
+            covered = (result[f"{method} lower [kt/year]"] < slopes) & (slopes < result[f"{method} upper [kt/year]"])
+            assert .9 < covered.mean() <= 1
+
+        narrow = trends(matrix, confidence=.5)
+        assert (narrow["Slope upper [kt/year]"] < result["Slope upper [kt/year]"]).all()
+
+    def test_seasons(self, matrix):
+        # Without removing the seasonal cycle, slopes over a few years are much less certain
+        short = matrix.iloc[:, 3:27]
+        width = trends(short)["Slope upper [kt/year]"] - trends(short)["Slope lower [kt/year]"]
+        raw = trends(short, deseasonalize=False)
+        assert (raw["Slope upper [kt/year]"] - raw["Slope lower [kt/year]"] > 3 * width).all()
+
+    def test_outliers(self, matrix, slopes):
+        matrix = matrix.copy()
+        matrix.iloc[:5, -3:] = 1000
+        result = trends(matrix)
+        assert slopes[:5] == pytest.approx(result["Theil-Sen slope [kt/year]"].iloc[:5].to_numpy(), abs=.2)
+        assert (result["Slope [kt/year]"].iloc[:5] > slopes[:5] + 5).all()
+
+    def test_gaps(self, matrix, slopes):
+        matrix = matrix.copy()
+        matrix.iloc[0, :-2 * TREND_MINIMUM_MONTHS + 1] = numpy.nan  # Less than two values per season
+        matrix.iloc[1, ::2] = numpy.nan
+        matrix = matrix.drop(columns=matrix.columns[60:70])
+        matrix.columns = [str(month) for month in matrix.columns]  # Any month labels work
+
+        result = trends(matrix)
+        assert [2 * TREND_MINIMUM_MONTHS - 1, 55] == result["Months [1]"].iloc[:2].tolist()
+        assert result.iloc[0, 1:].isna().all()
+        assert trends(matrix, deseasonalize=False).iloc[0, 1:].notna().all()
+        assert slopes[1:] == pytest.approx(result["Theil-Sen slope [kt/year]"].iloc[1:].to_numpy(), abs=.15)
+
+    def test_empty(self, months):
+        assert 0 == len(trends(DataFrame(columns=months, dtype=float)))
+        with pytest.raises(ValueError):
+            trends(DataFrame(columns=months, dtype=float), confidence=95)
+
+    def test_student_t(self):
+        # Reference values from tables
+        assert [3.182, 2.228, 2.042, 1.960] == \
+            pytest.approx(_student_t_quantile(.975, numpy.array([3, 10, 30, 10**6])), abs=5e-3)
+        assert numpy.isnan(_student_t_quantile(.975, numpy.array([0, 1, 2]))).all()  # Too inaccurate
+
+
+class TestInput:
+
+    def test_monthly_matrix(self):
+        totals = {("a", DateRange("2019-01-01", "2019-01-31")): EmissionTotals(1, 10, 10),
+                  ("a", DateRange("2018-12-01", "2018-12-31")): EmissionTotals(2, 10, 10),
+                  ("b", DateRange("2019-01-01", "2019-01-31")): EmissionTotals(3, 10, 10),
+                  ("b", DateRange("2019-02-01", "2019-02-27")): EmissionTotals(4, 10, 10),  # Not a full month
+                  ("b", DateRange("2019-02-01", "2019-03-31")): EmissionTotals(5, 10, 10)}  # Two months
+        matrix = monthly_matrix(totals)
+        assert [Period("2018-12", freq="M"), Period("2019-01", freq="M")] == list(matrix.columns)
+        assert ["a", "b"] == list(matrix.index)
+        assert numpy.array_equal([[2, 1], [numpy.nan, 3]], matrix.to_numpy(dtype=float), equal_nan=True)
+
+    def test_read_batch(self, tmp_path):
+        periods = monthly_periods(date(2018, 1, 1), date(2019, 12, 31))
+        records = []
+        for count, period in enumerate(periods):
+            for region in ["roughly_saxonia", "north_rhine_westphalia"]:
+                job = Job(RandomEOEmissionCalculator, region, None, period, Pollutant.NO2)
+                records.append({"job": job.name, "status": "done", "value": count, "umin": 1, "umax": 1})
+        records.append({"job": records[0]["job"], "status": "failed", "error": "Oops"})
+        records.append({"job": records[0]["job"].replace("NO2", "SO2"), "status": "done", "value": -1, "umin": 1,
+                        "umax": 1})
+        with open(tmp_path / JOURNAL_FILE, 'w') as journal:
+            journal.writelines(json.dumps(record) + "\n" for record in records)
+
+        matrix = read_batch(str(tmp_path))
+        assert ["roughly_saxonia", "north_rhine_westphalia"] == list(matrix.index)
+        assert (24, ) == matrix.columns.shape
+        assert list(range(24)) == matrix.loc["north_rhine_westphalia"].tolist()
+        assert 12 == pytest.approx(trends(matrix)["Theil-Sen slope [kt/year]"].to_numpy())
+        assert -1 == read_batch(str(tmp_path), pollutant=Pollutant.SO2).iloc[0, 0]
+        assert 0 == len(read_batch(str(tmp_path), method="TropomiMonthlyMeanAggregator"))
+
+        # Totals of different methods are not mixed
+        with open(tmp_path / JOURNAL_FILE, 'a') as journal:
+            journal.write(json.dumps({**records[0], "job": "Other" + records[0]["job"][len("RandomEOEmission"):]}))
+        with pytest.raises(ValueError):
+            read_batch(str(tmp_path))
+        assert 2 == len(read_batch(str(tmp_path), method="RandomEOEmissionCalculator"))
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from pandas import Series
+from shapely.geometry import box
+from geopandas import GeoDataFrame, overlay
+
+from eocalc.methods.base import DateRange, EOEmissionCalculator
+from eocalc.weighting import GridSpec, SparseMatrix, WeightCache, area_weights, day_weights, aggregate, \
+    contributions
+
+
+@pytest.fixture
+def countries():
+    # A rough raster of 48 country sized regions across Europe
+    return [box(long, lat, long + 4.5, lat + 3.5) for long in range(-10, 30, 5) for lat in range(36, 66, 5)]
+
+
+@pytest.fixture
+def grid():
+    return GridSpec(1)
+
+
+@pytest.fixture
+def sparse():
+    return SparseMatrix([2, 0, 0, 2], [1, 0, 3, 1], [1., 2., 3., 4.], (3, 5))
+
+
+class TestGridSpec:
+
+    def test_size(self, grid):
+        assert (180, 360, 180 * 360) == (grid.rows, grid.columns, len(grid))
+        assert (1440, 2880) == (GridSpec(.125).rows, GridSpec(.125).columns)
+
+
+class TestSparseMatrix:
+
+    def test_dense(self, sparse):
+        assert [[2, 0, 0, 3, 0], [0, 0, 0, 0, 0], [0, 5, 0, 0, 0]] == sparse.to_dense().tolist()
+        assert [[4, 0, 0, 9, 0], [0, 0, 0, 0, 0], [0, 25, 0, 0, 0]] == sparse.power(2).to_dense().tolist()
+
+    def test_dot(self, sparse):
+        dense = numpy.arange(10.).reshape(5, 2)
+        assert sparse.to_dense() @ dense == pytest.approx(sparse.dot(dense))
+        assert (0, 2) == SparseMatrix([], [], [], (0, 5)).dot(dense).shape
+        assert numpy.zeros((3, 2)) == pytest.approx(SparseMatrix([], [], [], (3, 5)).dot(dense))
+        with pytest.raises(ValueError):
+            sparse.dot(numpy.ones((4, 2)))
+
+    def test_compress(self, sparse):
+        compressed, used = sparse.compress()
+        assert [0, 1, 3] == used.tolist()
+        assert (3, 3) == compressed.shape
+        assert sparse.to_dense()[:, used] == pytest.approx(compressed.to_dense())
+
+    def test_dot_vector(self, sparse):
+        assert sparse.to_dense() @ numpy.arange(5.) == pytest.approx(sparse.dot(numpy.arange(5.)))
+        with pytest.raises(ValueError):
+            sparse.dot(numpy.ones(4))
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            SparseMatrix([0, 1], [0], [1.], (2, 2))
+        with pytest.raises(ValueError):
+            SparseMatrix([2], [0], [1.], (2, 2))
+        with pytest.raises(ValueError):
+            SparseMatrix([0], [-1], [1.], (2, 2))
+
+
+class TestWeights:
+
+    def test_area_weights(self, grid):
+        regions = [box(10.5, 50.5, 12, 52), box(-1, -1, 1, 1), box(10, 50, 11, 51)]
+        weights = area_weights(regions, grid)
+        assert (3, len(grid)) == weights.shape
+        assert 4 + 4 + 1 == len(weights)
+
+        for index, region in enumerate(regions):
+            cells = EOEmissionCalculator._create_grid(region, 1, 1, snap=True)
+            cells = overlay(cells, GeoDataFrame({"geometry": [region]}, crs="EPSG:4326"), how="intersection")
+            areas = cells.to_crs(epsg=8857).area / 10 ** 6
+            assert sorted(areas) == pytest.approx(sorted(weights.to_dense()[index][weights.to_dense()[index] > 0]))
+
+        dense = weights.to_dense()
+        assert 0 < dense[0, 140 * 360 + 190] < dense[2, 140 * 360 + 190] / 4  # North east quarter of the cell
+        assert 0 == dense[2, 140 * 360 + 191]  # Only touches
+        assert 0 == len(area_weights([], grid))
+
+    def test_day_weights(self):
+        periods = [DateRange("2018-08-01", "2018-08-31"), DateRange("2018-07-30", "2018-09-02"),
+                   DateRange("2020-01-01", "2020-12-31"), DateRange("2017-01-01", "2017-01-31")]
+        months = numpy.arange(numpy.datetime64("2018-07"), numpy.datetime64("2018-10"))
+        assert [[0, 31, 0], [2, 31, 2], [0, 0, 0], [0, 0, 0]] == day_weights(periods, months).tolist()
+
+        months = numpy.arange(numpy.datetime64("2020-01"), numpy.datetime64("2021-01"))
+        assert list(periods[2].months()[1]) == day_weights(periods[2:3], months)[0].tolist()
+        assert (0, 12) == day_weights([], months).shape
+
+
+def assert_same_weights(expected: SparseMatrix, actual: SparseMatrix):
+    assert expected.shape == actual.shape
+    assert expected.rows.tolist() == actual.rows.tolist()
+    assert expected.columns.tolist() == actual.columns.tolist()
+    assert expected.data == pytest.approx(actual.data)
+
+
+class TestWeightCache:
+
+    def test_get(self, tmp_path, countries):
+        grid = GridSpec(.125)
+        cache = WeightCache(tmp_path)
+        expected = area_weights([countries[2], countries[0], countries[2]], grid)
+
+        assert_same_weights(area_weights(countries[:3], grid), cache.get(countries[:3], grid))
+        assert (0, 3, 3) == (cache.hits, cache.misses, len(cache))
+        assert_same_weights(expected, cache.get([countries[2], countries[0], countries[2]], grid))
+        assert (2, 3) == (cache.hits, cache.misses)
+
+        # Persisted, same geometry with other vertex order, different grid
+        other = WeightCache(tmp_path)
+        assert_same_weights(area_weights(countries[1:2], grid), other.get([countries[1].reverse()], grid))
+        assert (1, 0) == (other.hits, other.misses)
+        assert_same_weights(area_weights(countries[:1], GridSpec(.25)), other.get(countries[:1], GridSpec(.25)))
+        assert 1 == other.misses
+        assert 4 == len(list(tmp_path.glob("*.npz")))
+        assert WeightCache.key(countries[0], grid) != WeightCache.key(countries[0], GridSpec(.25))
+
+    def test_memory_only(self, tmp_path, countries):
+        cache = WeightCache(folder=None)
+        cache.get(countries[:2], GridSpec(1))
+        cache.get(countries[:2], GridSpec(1))
+        assert (2, 2, 2) == (cache.hits, cache.misses, len(cache))
+        assert (0, len(GridSpec(1))) == cache.get([], GridSpec(1)).shape
+
+    def test_concurrent(self, tmp_path, countries):
+        cache = WeightCache(tmp_path)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: cache.get(countries[:4], GridSpec(.5)), range(8)))
+
+        for result in results:
+            assert_same_weights(results[0], result)
+        assert 4 == len(cache) == len(list(tmp_path.glob("*.npz")))
+        assert [] == list(tmp_path.glob("*.tmp"))
+
+    def test_monthly_update_is_fast(self, tmp_path, countries):
+        grid = GridSpec(.125)
+        start = time.perf_counter()
+        WeightCache(tmp_path).get(countries, grid)
+        first = time.perf_counter() - start
+
+        # A new process would start with a fresh cache, reading the weights from disk
+        start = time.perf_counter()
+        weights, cells = WeightCache(tmp_path).get(countries, grid).compress()
+        month = numpy.random.default_rng(42).uniform(0, 10, len(grid))
+        totals = weights.dot(month[cells])
+        second = time.perf_counter() - start
+
+        assert (len(countries),) == totals.shape
+        assert second < first / 5
+        assert second < .5
+
+
+class TestAggregate:
+
+    def test_matches_naive_aggregation(self):
+        rng = numpy.random.default_rng(42)
+        values = rng.uniform(0, 10, (3, 20))  # Three months of 20 cells
+        values[1, 5] = numpy.nan
+        weights = SparseMatrix(rng.integers(0, 4, 30), rng.integers(0, 20, 30), rng.uniform(0, 100, 30), (4, 20))
+        periods = [DateRange("2019-01-01", "2019-03-31"), DateRange("2019-02-10", "2019-02-11")]
+        days = day_weights(periods, numpy.arange(numpy.datetime64("2019-01"), numpy.datetime64("2019-04")))
+
+        result = aggregate(values, weights, days, 1000)
+        assert (2, 4) == result.totals.shape == result.uncertainties.shape
+
+        # Do it the naive way: per-day values per cell, combine uncertainties per cell, then for the region
+        for row, period in enumerate(periods):
+            daily = numpy.nan_to_num(values[period.month_index() + (period.start.month - 1)])
+            for region, areas in enumerate(weights.to_dense()):
+                totals = Series(areas * daily.sum(axis=0))
+                cells = Series([EOEmissionCalculator._combine_uncertainties(Series(column), Series([1000] * len(column)))
+                                for column in daily.T])
+                assert totals.sum() == pytest.approx(result.totals[row, region])
+                assert EOEmissionCalculator._combine_uncertainties(totals, cells) == \
+                    pytest.approx(result.uncertainties[row, region])
+
+    def test_per_value_uncertainty(self):
+        values, weights = numpy.array([[1., 2.]]), SparseMatrix([0, 0], [0, 1], [1., 1.], (1, 2))
+        result = aggregate(values, weights, numpy.array([[1]]), numpy.array([[10., 20.]]))
+        assert [[3]] == result.totals.tolist()
+        assert (.1 ** 2 + .4 ** 2) ** .5 / 3 * 100 == pytest.approx(result.uncertainties[0, 0])
+
+    def test_contributions(self):
+        rng = numpy.random.default_rng(7)
+        values = rng.uniform(0, 10, (3, 20))
+        weights = SparseMatrix(rng.integers(0, 4, 30), rng.integers(5, 20, 30), rng.uniform(0, 100, 30), (4, 20))
+        days = rng.integers(0, 31, (2, 3))
+
+        result = aggregate(values, weights, days, 1000)
+        cells, sums, uncertainties, covered = contributions(values, weights, days, 1000)
+        assert (len(cells), 2) == sums.shape == uncertainties.shape and (4, len(cells)) == covered.shape
+        assert cells.min() >= 5
+        # Weights stay sparse, dense contributions only for checking
+        parts = (sums[:, :, numpy.newaxis] * covered.to_dense().T[:, numpy.newaxis, :]).reshape(len(cells), 8)
+        uncertainties = numpy.repeat(uncertainties, 4, axis=1)
+        assert result.totals.ravel() == pytest.approx(parts.sum(axis=0))
+        for column in range(8):
+            assert result.uncertainties.ravel()[column] == pytest.approx(
+                EOEmissionCalculator._combine_uncertainties(Series(parts[:, column]), Series(uncertainties[:, column])))
+
+    def test_empty(self):
+        result = aggregate(numpy.ones((2, 5)), SparseMatrix([], [], [], (3, 5)), numpy.ones((4, 2)), 10)
+        assert numpy.zeros((4, 3)) == pytest.approx(result.totals)
+        assert numpy.zeros((4, 3)) == pytest.approx(result.uncertainties)
+        with pytest.raises(ValueError):
+            aggregate(numpy.ones((2, 4)), SparseMatrix([], [], [], (3, 5)), numpy.ones((4, 2)), 10)
+
+    def test_scale(self):
+        # Thousands of regions and periods in one go
+        rng = numpy.random.default_rng(0)
+        values = rng.uniform(0, 10, (120, 50_000))
+        weights = SparseMatrix(rng.integers(0, 2_000, 200_000), rng.integers(0, 50_000, 200_000),
+                               rng.uniform(0, 100, 200_000), (2_000, 50_000))
+        days = rng.integers(0, 31, (3_000, 120))
+
+        result = aggregate(values, weights, days, 1000)
+        assert (3_000, 2_000) == result.totals.shape
+        assert days[7] @ values @ weights.to_dense()[11] == pytest.approx(result.totals[7, 11])
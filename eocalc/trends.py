@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Derive emission trends for many regions at once from monthly totals, e.g. as calculated by a batch."""
+
+from __future__ import annotations
+
+import re
+from datetime import timedelta
+from statistics import NormalDist
+from typing import TYPE_CHECKING
+
+import numpy
+
+from eocalc.context import Pollutant
+from eocalc.methods.base import DateRange, EmissionTotals
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+# Confidence level of the slopes' intervals [1]
+TREND_CONFIDENCE = .95
+# Regions with fewer months of values get no trend, twice as many when deseasonalizing, i.e. two per season [1]
+TREND_MINIMUM_MONTHS = 12
+# Maximum size of the pairwise slopes held in memory at once for Theil-Sen estimates [bytes]
+TREND_CHUNK_BYTES = 2**26
+# Job names as created by eocalc.batch.Job.name, method names have no underscores
+JOB_NAME_PATTERN = re.compile(r"^(?P<method>[^_]+)_(?P<region>.+)_(?P<start>\d{4}-\d{2}-\d{2})_"
+                              r"(?P<end>\d{4}-\d{2}-\d{2})_(?P<pollutant>[A-Z0-9_]+)$")
+
+
+def monthly_matrix(totals: dict[tuple[str, DateRange], EmissionTotals]) -> DataFrame:
+    """
+    Arrange monthly totals as a (region x month) matrix.
+
+    Parameters
+    ----------
+    totals: dict
+        Totals by region name and period, e.g. as returned by run_totals_many(). Only periods
+        covering exactly one calendar month are used.
+
+    Returns
+    -------
+    DataFrame
+        Total emissions [kt] with one row per region and one column per month (as pandas.Period),
+        months without a total are NaN.
+    """
+    from pandas import DataFrame, Period
+
+    values: dict[str, dict[Period, float]] = {}
+    for (name, period), total in totals.items():
+        if period.start.day == 1 and (period.end + timedelta(days=1)).day == 1 and len(period.split_months()) == 1:
+            values.setdefault(name, {})[Period(period.start, freq="M")] = total.value
+
+    matrix = DataFrame.from_dict(values, orient="index")
+    return matrix.reindex(columns=sorted(matrix.columns))
+
+
+def read_batch(output: str, method: str = None, pollutant: Pollutant = Pollutant.NO2) -> DataFrame:
+    """
+    Read monthly totals calculated by a batch (see eocalc.batch) from its journal, no results
+    need to be loaded or calculated again.
+
+    Parameters
+    ----------
+    output: str
+        Output directory of the batch.
+    method: str
+        Name of the calculation method to use totals of, defaults to None, i.e. the only one used.
+    pollutant: Pollutant
+        Pollutant to use totals of, defaults to NO2.
+
+    Returns
+    -------
+    DataFrame
+        Matrix as created by monthly_matrix(), the latest total counts for jobs run more than once.
+    """
+    from eocalc.batch import read_journal
+
+    totals, methods = {}, set()
+    for record in read_journal(output):
+        match = JOB_NAME_PATTERN.match(record["job"])
+        if record["status"] != "done" or not match or match["pollutant"] != pollutant.name:
+            continue
+        if method is None or match["method"] == method:
+            methods.add(match["method"])
+            period = DateRange(match["start"], match["end"])
+            totals[(match["region"], period)] = EmissionTotals(record["value"], record["umin"], record["umax"])
+
+    if len(methods) > 1:
+        raise ValueError(f"Batch used several methods {sorted(methods)}, please select one!")
+    return monthly_matrix(totals)
+
+
+def trends(matrix: DataFrame, confidence: float = TREND_CONFIDENCE, deseasonalize: bool = True) -> DataFrame:
+    """
+    Derive linear trends of all regions at once.
+
+    Trends are estimated by ordinary least squares with Student's t intervals and by Theil-Sen
+    (median of pairwise slopes) with Sen's rank-based intervals, the latter being robust to
+    outliers. To remove the seasonal cycle, the least squares fit gets one intercept per calendar
+    month and Theil-Sen only compares values of the same calendar month (seasonal Kendall slope,
+    Hirsch et al. 1982). Both are computed for the whole matrix in a few array operations,
+    Theil-Sen in chunks of regions to bound memory.
+
+    Parameters
+    ----------
+    matrix: DataFrame
+        Totals [kt] with one row per region and one column per month (as pandas.Period or anything
+        convertible, like "2019-01"), e.g. created by monthly_matrix() or read_batch(). Missing
+        values are NaN, months may be missing.
+    confidence: float
+        Confidence level of the intervals, defaults to TREND_CONFIDENCE.
+    deseasonalize: bool
+        Whether to remove the seasonal cycle, defaults to True.
+
+    Returns
+    -------
+    DataFrame
+        One row per region with its number of months and mean value, the slopes and their
+        intervals [kt/year] and the Theil-Sen slope relative to the mean [%/year]. Regions with
+        fewer than TREND_MINIMUM_MONTHS values (twice as many if deseasonalized) get NaN.
+    """
+    from pandas import DataFrame, PeriodIndex
+
+    if not 0 < confidence < 1:
+        raise ValueError(f"Confidence needs to be between 0 and 1, got {confidence}!")
+
+    values = matrix.to_numpy(dtype=float)
+    months = PeriodIndex(matrix.columns, freq="M").asi8  # Months since 1970-01
+    seasons = months % 12 if deseasonalize else numpy.zeros(len(months), dtype=int)
+    times = months / 12  # [years]
+
+    count = numpy.count_nonzero(~numpy.isnan(values), axis=1)
+    # One intercept per season needs more values, otherwise regions would pass with no degrees of freedom left
+    enough = count >= (2 * TREND_MINIMUM_MONTHS if deseasonalize else TREND_MINIMUM_MONTHS)
+    values = numpy.where(enough[:, numpy.newaxis], values, numpy.nan)
+
+    slope, error, dof = _least_squares(values, times, seasons)
+    margin = _student_t_quantile((1 + confidence) / 2, dof) * error
+    sen, sen_low, sen_high = _theil_sen(values, times, seasons, confidence)
+    mean = _nanmean(values)
+
+    return DataFrame({"Months [1]": count, "Mean [kt]": mean,
+                      "Slope [kt/year]": slope, "Slope lower [kt/year]": slope - margin,
+                      "Slope upper [kt/year]": slope + margin,
+                      "Theil-Sen slope [kt/year]": sen, "Theil-Sen lower [kt/year]": sen_low,
+                      "Theil-Sen upper [kt/year]": sen_high,
+                      "Trend [%/year]": numpy.divide(100 * sen, numpy.abs(mean), out=numpy.full(len(mean), numpy.nan),
+                                                     where=mean != 0)},
+                     index=matrix.index)
+
+
+def _least_squares(values: numpy.ndarray, times: numpy.ndarray,
+                   seasons: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Fit lines with a common slope, but one intercept per season, to each row ignoring NaN.
+    Return slopes, their standard errors and the degrees of freedom left.
+    """
+    valid = ~numpy.isnan(values)
+    dx, dy = numpy.zeros(values.shape), numpy.zeros(values.shape)
+    intercepts = numpy.zeros(len(values), dtype=int)
+    for season in numpy.unique(seasons):
+        selected = seasons == season
+        present = valid[:, selected].any(axis=1)
+        intercepts += present
+        x = numpy.where(valid[:, selected], times[selected], numpy.nan)
+        dx[:, selected] = numpy.nan_to_num(x - _nanmean(x)[:, numpy.newaxis])
+        dy[:, selected] = numpy.nan_to_num(values[:, selected] - _nanmean(values[:, selected])[:, numpy.newaxis])
+
+    dof = valid.sum(axis=1) - intercepts - 1
+    sxx = (dx ** 2).sum(axis=1)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        slope = (dx * dy).sum(axis=1) / sxx
+        error = numpy.sqrt(((dy - slope[:, numpy.newaxis] * dx) ** 2).sum(axis=1) / dof / sxx)
+
+    return slope, numpy.where(dof > 0, error, numpy.nan), dof
+
+
+def _theil_sen(values: numpy.ndarray, times: numpy.ndarray, seasons: numpy.ndarray,
+               confidence: float) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Median of pairwise slopes within seasons per row ignoring NaN, plus the bounds of Sen's interval."""
+    first, second = numpy.triu_indices(len(times), 1)
+    same = seasons[first] == seasons[second]
+    first, second = first[same], second[same]
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    result = numpy.full((3, len(values)), numpy.nan)
+    if not len(first):
+        return result[0], result[1], result[2]
+
+    size = max(1, TREND_CHUNK_BYTES // (8 * len(first)))
+    for start in range(0, len(values), size):
+        chunk = values[start:start + size]
+        slopes = numpy.sort((chunk[:, second] - chunk[:, first]) / (times[second] - times[first]), axis=1)  # NaN last
+        pairs = numpy.count_nonzero(~numpy.isnan(slopes), axis=1)
+
+        # Ranks of the interval's bounds among the sorted slopes, see Sen (1968), variances add up over seasons
+        variance = numpy.zeros(len(chunk))
+        for season in numpy.unique(seasons):
+            count = numpy.count_nonzero(~numpy.isnan(chunk[:, seasons == season]), axis=1)
+            variance += count * (count - 1) * (2 * count + 5) / 18
+        spread = z * numpy.sqrt(variance)
+        last = numpy.maximum(pairs - 1, 0)
+        low = numpy.clip(numpy.round((pairs - spread) / 2).astype(int) - 1, 0, last)
+        high = numpy.clip(numpy.round((pairs + spread) / 2).astype(int), 0, last)
+        middle = numpy.stack([last // 2, pairs // 2], axis=1)
+
+        ranked = numpy.take_along_axis(slopes, numpy.column_stack([middle, low, high]), axis=1)
+        estimates = numpy.vstack([ranked[:, :2].mean(axis=1), ranked[:, 2], ranked[:, 3]])
+        result[:, start:start + size] = numpy.where(pairs > 0, estimates, numpy.nan)
+
+    return result[0], result[1], result[2]
+
+
+def _student_t_quantile(p: float, dof: numpy.ndarray) -> numpy.ndarray:
+    """
+    Quantile of Student's t distribution, via the Cornish-Fisher expansion around the normal
+    distribution (Abramowitz and Stegun 26.7.5), accurate to about 1e-3 for three and more
+    degrees of freedom. NaN for fewer, where the expansion is off by up to 11%.
+    """
+    z = NormalDist().inv_cdf(p)
+    dof = numpy.asarray(dof, dtype=float)
+    terms = [(z ** 3 + z) / 4, (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+             (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+             (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        quantile = z + sum(term / dof ** (power + 1) for power, term in enumerate(terms))
+    return numpy.where(dof >= 3, quantile, numpy.nan)
+
+
+def _nanmean(values: numpy.ndarray) -> numpy.ndarray:
+    """Mean per row ignoring NaN, NaN for rows without any value (without warning)."""
+    count = numpy.count_nonzero(~numpy.isnan(values), axis=1)
+    return numpy.divide(numpy.nansum(values, axis=1), count, out=numpy.full(len(values), numpy.nan), where=count > 0)
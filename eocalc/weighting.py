@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""Aggregate gridded monthly values to totals for many regions and periods at once."""
+
+from __future__ import annotations
+
+import os
+import math
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy
+
+if TYPE_CHECKING:
+    from shapely.geometry import MultiPolygon
+    from eocalc.methods.base import DateRange
+
+# Local directory we use to store area weights per region and grid
+LOCAL_CACHE_FOLDER = "data/cache/weights"
+
+
+@dataclass(frozen=True)
+class GridSpec:
+    """
+    Represent a regular global grid in WGS84. Cells are numbered row by row, starting with the
+    cell at the bottom left (-180°, -90°) and moving east, then north. This matches the layout of
+    the global arrays created by TropomiMonthlyMeanAggregator._read_toms_grid().
+    """
+
+    cell_size: float  # Cell width and height [degrees]
+
+    @property
+    def rows(self) -> int:
+        """Number of latitude rows [1]."""
+        return round(180 / self.cell_size)
+
+    @property
+    def columns(self) -> int:
+        """Number of longitude columns [1]."""
+        return round(360 / self.cell_size)
+
+    def __len__(self) -> int:
+        return self.rows * self.columns
+
+    def cells(self, longs, lats) -> numpy.ndarray:
+        """
+        Find cells containing the points given.
+
+        Parameters
+        ----------
+        longs: array_like
+            Point longitudes [degrees].
+        lats: array_like
+            Point latitudes [degrees].
+
+        Returns
+        -------
+        numpy.ndarray
+            Cell index per point, -1 for points outside the grid.
+        """
+        columns = numpy.floor((numpy.asarray(longs, dtype=float) + 180) / self.cell_size).astype(int)
+        rows = numpy.floor((numpy.asarray(lats, dtype=float) + 90) / self.cell_size).astype(int)
+        inside = (0 <= columns) & (columns < self.columns) & (0 <= rows) & (rows < self.rows)
+        return numpy.where(inside, rows * self.columns + columns, -1)
+
+
+class SparseMatrix:
+    """
+    Minimal sparse matrix in coordinate (COO) format, duplicate entries are summed up and entries
+    are kept sorted by row and column. Supports
+    what the weighting engine needs (products with dense matrices) using plain numpy only.
+    """
+
+    def __init__(self, rows, columns, data, shape: tuple[int, int]):
+        rows, columns, data = numpy.asarray(rows, dtype=int), numpy.asarray(columns, dtype=int), \
+            numpy.asarray(data, dtype=float)
+        if not len(rows) == len(columns) == len(data):
+            raise ValueError("Rows, columns and data need to have the same length!")
+        if len(rows) and (rows.min() < 0 or rows.max() >= shape[0] or columns.min() < 0 or columns.max() >= shape[1]):
+            raise ValueError(f"Entries out of bounds for matrix of shape {shape}!")
+
+        # Sum up duplicate entries, sorting the entries by row and column on the way
+        keys, positions = numpy.unique(rows * shape[1] + columns, return_inverse=True)
+        self.rows, self.columns = keys // shape[1], keys % shape[1]
+        self.data = numpy.bincount(positions, weights=data, minlength=len(keys)).astype(float)
+        self.shape = tuple(shape)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def dot(self, dense: numpy.ndarray) -> numpy.ndarray:
+        """
+        Multiply with dense matrix.
+
+        Parameters
+        ----------
+        dense: numpy.ndarray
+            Array of shape (number of columns, k), or vector of length number of columns.
+
+        Returns
+        -------
+        numpy.ndarray
+            Dense result of shape (number of rows, k), or vector of length number of rows.
+        """
+        if dense.shape[0] != self.shape[1]:
+            raise ValueError(f"Cannot multiply matrix of shape {self.shape} with {dense.shape}!")
+        if dense.ndim == 1:
+            return self.dot(dense[:, numpy.newaxis])[:, 0]
+
+        result = numpy.zeros((self.shape[0], dense.shape[1]))
+        if len(self):
+            # Entries are sorted by row, so each row's products are a contiguous block to sum up
+            starts = numpy.flatnonzero(numpy.r_[True, self.rows[1:] != self.rows[:-1]])
+            result[self.rows[starts]] = numpy.add.reduceat(self.data[:, numpy.newaxis] * dense[self.columns], starts)
+        return result
+
+    def power(self, exponent: float) -> SparseMatrix:
+        """Raise all entries to given power, entries not stored stay zero."""
+        return SparseMatrix(self.rows, self.columns, self.data ** exponent, self.shape)
+
+    def compress(self) -> tuple[SparseMatrix, numpy.ndarray]:
+        """
+        Drop all columns without entries.
+
+        Returns
+        -------
+        tuple
+            Matrix with only the columns used and the original index of each column kept. Use
+            the latter to select the matching rows of a dense matrix to multiply with.
+        """
+        used, columns = numpy.unique(self.columns, return_inverse=True)
+        return SparseMatrix(self.rows, columns, self.data, (self.shape[0], len(used))), used
+
+    def to_dense(self) -> numpy.ndarray:
+        """Convert to dense array, meant for small matrices and testing."""
+        dense = numpy.zeros(self.shape)
+        numpy.add.at(dense, (self.rows, self.columns), self.data)
+        return dense
+
+
+class WeightCache:
+    """
+    Keep area weights (see area_weights()) per region and grid, in memory and as files in a
+    local folder. Regions are identified by a hash of their normalized geometry, so renamed or
+    reloaded regions still hit the cache. Weights for any set of regions are assembled from the
+    single region entries. Safe to share between threads.
+    """
+
+    def __init__(self, folder: str = LOCAL_CACHE_FOLDER):
+        """
+        Create cache.
+
+        Parameters
+        ----------
+        folder: str
+            Directory to persist weights in, None to only keep them in memory. Defaults to LOCAL_CACHE_FOLDER.
+        """
+        self._folder = folder
+        self._entries: dict[str, tuple[numpy.ndarray, numpy.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, regions: list[MultiPolygon], grid: GridSpec) -> SparseMatrix:
+        """
+        Get area weights, calculate and store the ones not known yet.
+
+        Parameters
+        ----------
+        regions: list
+            Areas to get weights for.
+        grid: GridSpec
+            Grid the weights refer to.
+
+        Returns
+        -------
+        SparseMatrix
+            Same as area_weights(regions, grid).
+        """
+        keys = [self.key(region, grid) for region in regions]
+        with self._lock:
+            entries = {key: self._entries.get(key) or self._read(key) for key in set(keys)}
+            missing = [key for key, entry in entries.items() if entry is None]
+            self.hits += len(entries) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            first = {key: regions[keys.index(key)] for key in missing}
+            weights = area_weights(list(first.values()), grid)
+            for row, key in enumerate(first):
+                entry = weights.columns[weights.rows == row], weights.data[weights.rows == row]
+                self._write(key, entry)
+                entries[key] = entry
+
+        with self._lock:
+            self._entries.update(entries)
+
+        rows = [numpy.full(len(entries[key][0]), row) for row, key in enumerate(keys)]
+        return SparseMatrix(numpy.concatenate(rows) if rows else [],
+                            numpy.concatenate([entries[key][0] for key in keys]) if keys else [],
+                            numpy.concatenate([entries[key][1] for key in keys]) if keys else [],
+                            (len(regions), len(grid)))
+
+    @staticmethod
+    def key(region: MultiPolygon, grid: GridSpec) -> str:
+        """Identify weights by region geometry and grid spec."""
+        import shapely
+
+        return f"{hashlib.sha256(shapely.to_wkb(shapely.normalize(region))).hexdigest()}-{grid.cell_size}"
+
+    def _read(self, key: str) -> tuple[numpy.ndarray, numpy.ndarray] | None:
+        if self._folder is None or not os.path.isfile(f"{self._folder}/{key}.npz"):
+            return None
+
+        with numpy.load(f"{self._folder}/{key}.npz") as cached:
+            return cached["columns"], cached["data"]
+
+    def _write(self, key: str, entry: tuple[numpy.ndarray, numpy.ndarray]):
+        if self._folder is None:
+            return
+
+        os.makedirs(self._folder, exist_ok=True)
+        temporary = f"{self._folder}/{key}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as cached:
+            numpy.savez(cached, columns=entry[0], data=entry[1])
+        os.replace(temporary, f"{self._folder}/{key}.npz")
+
+
+@dataclass(frozen=True)
+class Aggregation:
+    """Represent totals for all combinations of periods and regions."""
+
+    totals: numpy.ndarray  # Totals per period (rows) and region (columns) [value unit * km² * days]
+    uncertainties: numpy.ndarray  # Combined uncertainty per period and region [%]
+
+
+def area_weights(regions: list[MultiPolygon], grid: GridSpec) -> SparseMatrix:
+    """
+    Find the area each region covers in each grid cell.
+
+    Parameters
+    ----------
+    regions: list
+        Areas to create weights for.
+    grid: GridSpec
+        Grid to intersect with.
+
+    Returns
+    -------
+    SparseMatrix
+        Matrix of shape (number of regions, number of grid cells), with the area of each region
+        within each cell [km²]. Areas are calculated in the Equal Earth projection (EPSG:8857).
+    """
+    import shapely
+    from geopandas import GeoSeries
+
+    rows, columns, data = [], [], []
+    for index, region in enumerate(regions):
+        min_long, min_lat, max_long, max_lat = region.bounds
+        x = numpy.arange(math.floor((min_long + 180) / grid.cell_size), math.ceil((max_long + 180) / grid.cell_size))
+        y = numpy.arange(math.floor((min_lat + 90) / grid.cell_size), math.ceil((max_lat + 90) / grid.cell_size))
+        x, y = numpy.meshgrid(x, y)
+        x, y = x.ravel(), y.ravel()
+
+        boxes = shapely.box(x * grid.cell_size - 180, y * grid.cell_size - 90,
+                            (x + 1) * grid.cell_size - 180, (y + 1) * grid.cell_size - 90)
+        parts = shapely.intersection(boxes, region)
+        areas = GeoSeries(parts, crs="EPSG:4326").to_crs(epsg=8857).area.to_numpy() / 10**6  # Equal earth projection
+        covered = areas > 0
+
+        rows.append(numpy.full(numpy.count_nonzero(covered), index))
+        columns.append(y[covered] * grid.columns + x[covered])
+        data.append(areas[covered])
+
+    return SparseMatrix(numpy.concatenate(rows) if rows else [], numpy.concatenate(columns) if columns else [],
+                        numpy.concatenate(data) if data else [], (len(regions), len(grid)))
+
+
+def day_weights(periods: list[DateRange], months: numpy.ndarray) -> numpy.ndarray:
+    """
+    Count the days each period has in each month.
+
+    Parameters
+    ----------
+    periods: list
+        Periods to count days for.
+    months: numpy.ndarray
+        Calendar months as numpy.datetime64 values, e.g. the months values are available for.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (number of periods, number of months) with the day counts. Days of the
+        periods outside the months given are not counted.
+    """
+    months = numpy.asarray(months, dtype="datetime64[M]")
+    starts = numpy.array([period.start for period in periods], dtype="datetime64[D]")[:, numpy.newaxis]
+    ends = numpy.array([period.end for period in periods], dtype="datetime64[D]")[:, numpy.newaxis]
+
+    firsts = numpy.maximum(months.astype("datetime64[D]"), starts)
+    lasts = numpy.minimum((months + 1).astype("datetime64[D]") - 1, ends)
+    return numpy.maximum((lasts - firsts).astype(int) + 1, 0).reshape(len(periods), len(months))
+
+
+def aggregate(values: numpy.ndarray, weights: SparseMatrix, days: numpy.ndarray,
+              uncertainty: float | numpy.ndarray) -> Aggregation:
+    """
+    Derive totals and their uncertainties for all periods and regions using a few matrix products.
+
+    Each value stands for every day of its month and the part of its cell a region covers. Thus,
+    totals are days @ values @ weights^T. Uncertainties are propagated assuming independent
+    errors per cell and day (IPCC Guidelines formula 6.3). For cells whose values do not change
+    sign within a period, this gives the same numbers as aggregating the cells' daily values
+    first and combining the cell uncertainties then. Missing values (NaN) count as zero.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Array of shape (number of months, number of cells) with the value per area and day.
+    weights: SparseMatrix
+        Matrix of shape (number of regions, number of cells), e.g. created by area_weights().
+    days: numpy.ndarray
+        Array of shape (number of periods, number of months), e.g. created by day_weights().
+    uncertainty: float or numpy.ndarray
+        Relative uncertainty of each value [%], either the same for all or of the values' shape.
+
+    Returns
+    -------
+    Aggregation
+        Totals and uncertainties, each of shape (number of periods, number of regions).
+    """
+    if values.shape[0] != days.shape[1] or values.shape[1] != weights.shape[1]:
+        raise ValueError(f"Shapes of values {values.shape}, weights {weights.shape} and days {days.shape} "
+                         f"do not match!")
+
+    # Only look at cells actually covered by any region
+    weights, cells = weights.compress()
+    values = numpy.nan_to_num(values[:, cells])
+    uncertainty = numpy.asarray(uncertainty, dtype=float)
+    uncertainty = uncertainty[:, cells] if uncertainty.ndim == 2 else uncertainty
+
+    totals = days @ weights.dot(values.T).T
+    absolutes = days @ weights.dot(numpy.abs(values).T).T
+    squares = days @ weights.power(2).dot((values * uncertainty).T ** 2).T
+    uncertainties = numpy.divide(squares ** 0.5, absolutes, out=numpy.zeros_like(absolutes), where=absolutes > 0)
+
+    return Aggregation(totals, uncertainties)
+
+
+def contributions(values: numpy.ndarray, weights: SparseMatrix, days: numpy.ndarray, uncertainty: float | numpy.ndarray
+                  ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, SparseMatrix]:
+    """
+    Split the totals of aggregate() into each cell's contribution, e.g. to simulate them.
+
+    Parameters are the same as for aggregate(). Each cell's uncertainty combines its months'
+    uncertainties such that the absolute error of each contribution matches the one aggregate()
+    propagates, so for cells not changing sign both give the same uncertainties. The region's
+    area weight only scales a cell's contribution, so contributions are kept per period and
+    the weights stay sparse.
+
+    Returns
+    -------
+    tuple
+        Index of each cell covered by any region, plus its value summed per period and the
+        uncertainty of that sum [%], both of shape (number of cells covered, number of periods),
+        and the weights for the cells covered only. Cell c contributes sums[c, p] * weights[r, c]
+        to the total for period p and region r, see MonteCarlo.bounds().
+    """
+    if values.shape[0] != days.shape[1] or values.shape[1] != weights.shape[1]:
+        raise ValueError(f"Shapes of values {values.shape}, weights {weights.shape} and days {days.shape} "
+                         f"do not match!")
+
+    weights, cells = weights.compress()
+    values = numpy.nan_to_num(values[:, cells])
+    uncertainty = numpy.asarray(uncertainty, dtype=float)
+    uncertainty = uncertainty[:, cells] if uncertainty.ndim == 2 else uncertainty
+
+    sums = days @ values
+    squares = days @ (values * uncertainty) ** 2
+    uncertainties = numpy.divide(squares ** 0.5, numpy.abs(sums), out=numpy.zeros_like(sums), where=sums != 0)
+    return cells, sums.T, uncertainties.T, weights